@@ -0,0 +1,280 @@
+#archive.py
+"""
+Caption a video archive in parallel: a directory of files, or one long file, is
+split into shards (a file, or a time range of a long file) that a multiprocessing
+pool captions with offline.run_offline. Each worker process loads one describer.
+
+Progress is kept in a manifest (manifest.json in the output directory), written
+after every finished shard, so an interrupted run started again with the same
+arguments skips the shards already done. Once all shards are done, their timelines
+are merged into one index sorted by source and media time.
+
+    python archive.py --source /data/archive --output_dir captions --workers 2 --devices cuda:0,cuda:1
+    python archive.py --source long.mp4 --shard_duration 600 --interval 2 --output_dir captions
+"""
+import os
+import csv
+import math
+import json
+import time
+import argparse
+import multiprocessing
+
+from offline import TIMELINE_FIELDS, timeline_fields, single_prompt
+from offline import add_sampling_args, sampling_kwargs, add_decoding_args, decoding_kwargs
+
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.mov', '.avi', '.webm', '.m4v', '.ts')
+MANIFEST_NAME = "manifest.json"
+
+# per-process state, set by _init_worker
+_describer = None
+_options = None
+
+
+def probe_duration(path):
+    """Duration of a video file in seconds (PyAV, or OpenCV without it), None if unknown."""
+    try:
+        import av
+        with av.open(path) as container:
+            stream = container.streams.video[0]
+            if stream.duration is not None:
+                return float(stream.duration * stream.time_base)
+            if container.duration is not None:
+                return container.duration / av.time_base
+            return None
+    except ImportError:
+        import cv2
+        cap = cv2.VideoCapture(path)
+        try:
+            frames, fps = cap.get(cv2.CAP_PROP_FRAME_COUNT), cap.get(cv2.CAP_PROP_FPS)
+            return frames / fps if frames > 0 and fps > 0 else None
+        finally:
+            cap.release()
+
+
+def list_videos(source):
+    """(path, name) of the videos in source (a file or a directory), name relative to the directory."""
+    if os.path.isdir(source):
+        return sorted((os.path.join(root, name), os.path.relpath(os.path.join(root, name), source))
+                      for root, _, names in os.walk(source)
+                      for name in names if name.lower().endswith(VIDEO_EXTENSIONS))
+    return [(source, os.path.basename(source))]
+
+
+def plan_shards(videos, shard_duration=0):
+    """
+    One shard per file, or per shard_duration seconds of a file when shard_duration
+    is set (files whose duration can't be probed stay whole). Shard ids are stable
+    across runs, which is what lets the manifest resume them.
+    """
+    shards = []
+    for path, name in videos:
+        duration = probe_duration(path) if shard_duration else None
+        ranges = [(None, None)]
+        if duration and duration > shard_duration:
+            # the last shard is left open-ended, so frames past the probed duration aren't lost
+            starts = [i * shard_duration for i in range(int(math.ceil(duration / shard_duration)))]
+            ranges = [(start, start + shard_duration) for start in starts[:-1]] + [(starts[-1], None)]
+        for start, end in ranges:
+            shard_id = name.replace(os.sep, '_')
+            if start is not None:
+                shard_id += f"@{start:g}"
+            shards.append({"id": shard_id, "source": path, "start": start, "end": end})
+    return shards
+
+
+# options that change what a shard's captions say; a done shard captioned with other values is redone
+CAPTION_OPTIONS = ("model_id", "prompt", "max_tokens", "stop_on", "max_words",
+                   "stride", "interval", "timestamps")
+
+
+class Manifest:
+    """
+    Shard status ('pending', 'done' or 'failed') and results, saved as JSON after
+    every update. The file is replaced atomically, so a crash never leaves it torn.
+    Every entry records the shard's source, time range and caption options, so a
+    run with other options (or another --shard_duration) doesn't reuse its output.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.shards = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.shards = json.load(f).get("shards", {})
+
+    def plan(self, shards, options=None):
+        """
+        Make the manifest hold exactly these shards: entries of shards no longer planned
+        (e.g. time ranges of another --shard_duration) are dropped, so merge() can't mix
+        overlapping timelines, and done shards are redone when their output is gone or
+        their range or options (see CAPTION_OPTIONS) changed.
+        """
+        options = json.loads(json.dumps(options or {}))  # as stored, so lists and tuples compare equal
+        planned = {}
+        for shard in shards:
+            entry = self.shards.get(shard["id"])
+            if entry is None or any(entry.get(key) != shard[key] for key in ("source", "start", "end", "output")) \
+                    or entry.get("options") != options:
+                entry = dict(shard, status="pending", options=options)
+            elif entry["status"] == "done" and not os.path.exists(entry["output"]):
+                entry["status"] = "pending"  # output deleted since, redo it
+            planned[shard["id"]] = entry
+        dropped = len(self.shards.keys() - planned.keys())
+        if dropped:
+            print(f"[Archive] Dropped {dropped} shard(s) of an earlier plan from the manifest")
+        self.shards = planned
+        self.save()
+
+    def pending(self):
+        return [entry for entry in self.shards.values() if entry["status"] != "done"]
+
+    def update(self, shard_id, **fields):
+        self.shards[shard_id].update(fields)
+        self.save()
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"shards": self.shards}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def _init_worker(model_id, fast_preprocess, devices, options, describer_options):
+    global _describer, _options
+    from offline import load_describer
+    # pool workers are numbered from 1; spread them over the devices round robin
+    identity = multiprocessing.current_process()._identity
+    device = devices[(identity[0] - 1) % len(devices)] if identity else devices[0]
+    print(f"[Archive] Worker {os.getpid()} loading {model_id} on {device}")
+    _describer = load_describer(model_id, fast_preprocess, device, **describer_options)
+    _options = options
+
+
+def _run_shard(shard):
+    """Caption one shard into its own timeline file. Runs in a pool worker."""
+    from offline import run_offline
+    from utils.caption_writer import CaptionWriter
+
+    output = shard["output"]
+    partial = output + ".partial"
+    if os.path.exists(partial):
+        os.remove(partial)  # left over from a crashed run
+
+    sampling = dict(_options["sampling"], start=shard["start"] or 0.0, end=shard["end"])
+    caption_writer = CaptionWriter(partial, format='jsonl', fieldnames=TIMELINE_FIELDS,
+                                   flush_every=32, flush_interval=2.0)
+    caption_writer.start()
+    start = time.perf_counter()
+    try:
+        report = run_offline(_describer, shard["source"], _options["prompt"], _options["max_tokens"],
+                             _options["batch_size"], caption_writer=caption_writer, **sampling)
+    except Exception as e:
+        # a describer error (CUDA OOM, a bad frame) fails this shard only, the pool goes on with the rest
+        print(f"[Archive] Shard {shard['id']} failed: {e}")
+        report = {"error": str(e) or type(e).__name__, "frames_captioned": 0,
+                  "elapsed": time.perf_counter() - start}
+    finally:
+        caption_writer.close()
+    if report["error"] is None:
+        os.replace(partial, output)  # only complete shards get their final name
+    return shard["id"], report
+
+
+def merge(manifest, output_file, fieldnames=TIMELINE_FIELDS):
+    """Merge the timelines of the done shards into output_file (.jsonl or .csv), sorted by source and media time."""
+    entries = []
+    for entry in manifest.shards.values():
+        if entry["status"] != "done":
+            continue
+        with open(entry["output"], encoding='utf-8') as f:
+            entries.extend(json.loads(line) for line in f if line.strip())
+    entries.sort(key=lambda e: (e["source"], e["media_time"]))
+
+    tmp_path = output_file + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        if output_file.endswith(('.jsonl', '.json')):
+            for e in entries:
+                f.write(json.dumps(e, ensure_ascii=False) + "\n")
+        else:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(entries)
+    os.replace(tmp_path, output_file)
+    print(f"[Archive] Merged {len(entries)} captions into {output_file}")
+    return len(entries)
+
+
+def run_archive(sources, output_dir, model_id, workers=1, devices=("cuda:0",), shard_duration=0,
+                prompt=None, max_tokens=16, batch_size=4, fast_preprocess=True, index_file=None,
+                describer_options=None, **sampling):
+    os.makedirs(os.path.join(output_dir, "shards"), exist_ok=True)
+    videos = [video for source in sources for video in list_videos(source)]
+    shards = plan_shards(videos, shard_duration)
+    for shard in shards:
+        shard["output"] = os.path.join(output_dir, "shards", shard["id"] + ".jsonl")
+
+    manifest = Manifest(os.path.join(output_dir, MANIFEST_NAME))
+    settings = dict(sampling, model_id=model_id, prompt=prompt, max_tokens=max_tokens, **(describer_options or {}))
+    manifest.plan(shards, {key: settings.get(key) for key in CAPTION_OPTIONS})
+    pending = manifest.pending()
+    print(f"[Archive] {len(videos)} file(s), {len(shards)} shard(s), {len(shards) - len(pending)} already done")
+
+    start = time.perf_counter()
+    captioned = 0
+    workers = max(1, min(workers, len(pending)))
+    if pending:
+        options = {"prompt": prompt, "max_tokens": max_tokens, "batch_size": batch_size, "sampling": sampling}
+        # spawn: CUDA can't be used in forked children
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(processes=workers, initializer=_init_worker,
+                          initargs=(model_id, fast_preprocess, list(devices), options, describer_options or {})) as pool:
+            for shard_id, report in pool.imap_unordered(_run_shard, pending):
+                status = "failed" if report["error"] else "done"
+                manifest.update(shard_id, status=status, captions=report["frames_captioned"],
+                                elapsed=round(report["elapsed"], 2), error=report["error"])
+                captioned += report["frames_captioned"]
+                done = sum(1 for entry in manifest.shards.values() if entry["status"] == "done")
+                print(f"[Archive] Shard {shard_id} {status} ({done}/{len(shards)} done)")
+
+    elapsed = time.perf_counter() - start
+    print(f"[Archive] {captioned} frames captioned in {elapsed:.1f}s "
+          f"({captioned / elapsed if elapsed else 0.0:.2f} frames/s over {workers} worker(s))")
+    failed = [entry["id"] for entry in manifest.shards.values() if entry["status"] != "done"]
+    if failed:
+        print(f"[Archive] {len(failed)} shard(s) not done, run again to retry: {', '.join(failed)}")
+    merge(manifest, index_file or os.path.join(output_dir, "index.jsonl"), timeline_fields(prompt))
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Caption a video archive in parallel, resumable shards")
+    parser.add_argument("--source", type=str, nargs="+", required=True, help="Video files and/or directories")
+    parser.add_argument("--output_dir", type=str, required=True, help="Shard timelines, manifest and merged index")
+    parser.add_argument("--index_file", type=str, default=None, help="Merged index (.jsonl or .csv, default: <output_dir>/index.jsonl)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes, each loading one model")
+    parser.add_argument("--devices", type=str, default="cuda:0", help="Comma separated devices the workers are spread over")
+    parser.add_argument("--shard_duration", type=float, default=0, help="Split files longer than this many seconds into time shards (0 = one shard per file)")
+    parser.add_argument("--model_id", type=str, default="google/gemma-3-4b-it")
+    parser.add_argument("--prompt", type=str, nargs="+", default=["Describe the image precisely within 10 words."],
+                        help="Prompt(s); several prompts are all asked about every frame, one column each")
+    parser.add_argument("--max_tokens", type=int, default=16)
+    parser.add_argument("--batch_size", type=int, default=4, help="Frames per describer call")
+    parser.add_argument("--no_fast_preprocess", dest="fast_preprocess", action="store_false")
+    add_sampling_args(parser)
+    add_decoding_args(parser)
+    args = parser.parse_args()
+
+    sampling = sampling_kwargs(args)
+    if args.start or args.end is not None:
+        print("[Warning] --start/--end are ignored, shards set their own time range")
+    sampling.pop("start"), sampling.pop("end")
+
+    run_archive(args.source, args.output_dir, args.model_id, workers=args.workers,
+                devices=args.devices.split(','), shard_duration=args.shard_duration,
+                prompt=single_prompt(args.prompt), max_tokens=args.max_tokens, batch_size=args.batch_size,
+                fast_preprocess=args.fast_preprocess, index_file=args.index_file,
+                describer_options=decoding_kwargs(args), **sampling)
+
+
+if __name__ == "__main__":
+    main()
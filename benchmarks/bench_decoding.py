@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Measure early-stop and speculative decoding against plain greedy decoding.
+
+Captions the same frames with every decoding setup (greedy, stop criteria,
+prompt-lookup and, given --draft_model_id, assisted decoding; speculative modes
+also combined with the stop criteria) and reports the decode time and tokens per
+caption, the speedup over greedy, and how many captions match the greedy ones
+(speculative decoding alone should not change any caption; the stop criteria
+only shorten them). Runs on CPU with a small local checkpoint.
+
+    python benchmarks/bench_decoding.py --model_id google/gemma-3-4b-it --draft_model_id google/gemma-3-1b-it
+    python benchmarks/bench_decoding.py --model_id ./tiny-gemma3 --video clip.mp4 --frames 20
+"""
+import os
+import sys
+import time
+import json
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model import Gemma3ImageDescriber, _load_draft_model
+
+
+def load_frames(args):
+    if args.video is None:
+        rng = np.random.default_rng(0)
+        return [rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8) for _ in range(args.frames)]
+
+    import cv2
+    cap = cv2.VideoCapture(args.video)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or args.frames
+    frames = []
+    for index in np.linspace(0, total - 1, args.frames).astype(int):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+        ok, frame = cap.read()
+        if ok:
+            frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    cap.release()
+    return frames
+
+
+def run_setup(describer, frames, args):
+    tokenizer = describer.processor.tokenizer
+    describer.describe_frame(frames[0], args.prompt, args.max_tokens)  # warmup
+    captions, latencies, decode, tokens = [], [], [], []
+    for frame in frames:
+        start = time.perf_counter()
+        caption = describer.describe_frame(frame, args.prompt, args.max_tokens)
+        latencies.append(time.perf_counter() - start)
+        decode.append(describer.last_timings.get("decode", 0.0))
+        tokens.append(len(tokenizer(caption, add_special_tokens=False).input_ids))
+        captions.append(caption)
+    return captions, np.array(latencies), np.array(decode), np.array(tokens)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark early-stop / speculative caption decoding")
+    parser.add_argument("--model_id", type=str, default="google/gemma-3-4b-it")
+    parser.add_argument("--draft_model_id", type=str, default=None, help="Draft model for assisted decoding")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--video", type=str, default=None, help="Caption frames sampled from this file instead of random frames")
+    parser.add_argument("--frames", type=int, default=10)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--prompt", type=str, default="Describe the image precisely.")
+    parser.add_argument("--max_tokens", type=int, default=32)
+    parser.add_argument("--max_words", type=int, default=10, help="Word limit of the stop criteria")
+    parser.add_argument("--num_assistant_tokens", type=int, default=8)
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON results to this file")
+    args = parser.parse_args()
+
+    describer = Gemma3ImageDescriber(model_id=args.model_id, device=args.device,
+                                     num_assistant_tokens=args.num_assistant_tokens)
+    frames = load_frames(args)
+    stop = dict(stop_on=('sentence', 'newline'), max_words=args.max_words)
+    setups = [
+        ("greedy", {}),
+        ("stop", stop),
+        ("prompt_lookup", {"decoding": "prompt_lookup"}),
+        ("prompt_lookup+stop", dict(stop, decoding="prompt_lookup")),
+    ]
+    if args.draft_model_id:
+        describer.draft_model, describer.draft_tokenizer = _load_draft_model(args.draft_model_id, args.device)
+        setups += [("assisted", {"decoding": "assisted"}), ("assisted+stop", dict(stop, decoding="assisted"))]
+
+    results = {}
+    baseline = None
+    for name, settings in setups:
+        # the settings are plain attributes, so one loaded model serves every setup
+        describer.stop_on = tuple(settings.get("stop_on", ()))
+        describer.max_words = settings.get("max_words")
+        describer.decoding = settings.get("decoding", "greedy")
+        captions, latencies, decode, tokens = run_setup(describer, frames, args)
+        if baseline is None:
+            baseline = (captions, latencies.mean())
+        same = sum(caption == reference for caption, reference in zip(captions, baseline[0]))
+        prefix = sum(reference.startswith(caption) for caption, reference in zip(captions, baseline[0]))
+        results[name] = {
+            "latency_mean": float(latencies.mean()),
+            "decode_mean": float(decode.mean()),
+            "tokens_per_caption": float(tokens.mean()),
+            "speedup": float(baseline[1] / latencies.mean()),
+            "same_as_greedy": same / len(captions),
+            "prefix_of_greedy": prefix / len(captions),
+        }
+        r = results[name]
+        print(f"[Decoding] {name:<20} latency={r['latency_mean']*1000:8.1f}ms decode={r['decode_mean']*1000:8.1f}ms "
+              f"tokens={r['tokens_per_caption']:5.1f} speedup={r['speedup']:5.2f}x "
+              f"same={r['same_as_greedy']:.0%} prefix={r['prefix_of_greedy']:.0%}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
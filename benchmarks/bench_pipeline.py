@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the video_query pipeline.
+
+Drives LiveVideoAgent with a synthetic VideoSource (generated NumPy frames or a
+local video file) and a stub describer (or a tiny local checkpoint on CPU), so
+it runs without jetson_utils or a GPU. Reports end-to-end caption latency,
+frame drop rate, display FPS and memory growth as JSON, which can be compared
+against a previous run with --compare. With --query_port the query server is
+attached, so its API can be tried against localhost with the stub describer.
+
+    python benchmarks/bench_pipeline.py --duration 60 --output bench.json
+    python benchmarks/bench_pipeline.py --duration 60 --compare bench.json
+    python benchmarks/bench_pipeline.py --duration 600 --query_port 8080
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+import subprocess
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.backend import set_backend
+from utils.frame_pool import FramePool
+from video_agent import LiveVideoAgent
+from utils.metrics import Metrics
+from utils.sampling import SAMPLING_POLICIES, make_sampler
+from utils.history import FrameHistory
+
+
+class SyntheticVideoSource:
+    """
+    Stand-in for camera.VideoSource producing numpy RGB frames at a fixed rate.
+    Frames come from a local video file (requires OpenCV) or are generated:
+    a gradient background with a moving block, so every frame differs slightly.
+    Like VideoSource, frames are handed to the callback in FramePool buffers.
+    """
+    def __init__(self, width=1280, height=720, framerate=30, video_file=None, static=False, num_buffers=8):
+        self.width = width
+        self.height = height
+        self.framerate = framerate
+        self.video_file = video_file
+        self.static = static
+        self.source = video_file or "synthetic://"
+
+        self.pool = FramePool(num_buffers)
+        self.frames_produced = 0
+        self.capture_time = None
+        self.running = False
+        self.thread = None
+
+        self.cap = None
+        if video_file:
+            import cv2
+            self.cap = cv2.VideoCapture(video_file)
+            if not self.cap.isOpened():
+                raise RuntimeError(f"Failed to open video file {video_file}")
+
+        x = np.linspace(0, 255, width, dtype=np.float32)
+        y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+        self.background = np.stack([np.broadcast_to(x, (height, width)),
+                                    np.broadcast_to(y, (height, width)),
+                                    np.full((height, width), 96, np.float32)], axis=-1).astype(np.uint8)
+        self.scratch = np.empty_like(self.background)  # stands in for the capture ring buffer
+
+    def capture(self):
+        if self.cap is not None:
+            import cv2
+            ok, frame = self.cap.read()
+            if not ok:  # loop the file
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, frame = self.cap.read()
+            frame = cv2.resize(frame, (self.width, self.height))
+            return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+        frame = self.scratch
+        np.copyto(frame, self.background)
+        if not self.static:
+            size = self.height // 6
+            x = (self.frames_produced * 8) % (self.width - size)
+            frame[size:2 * size, x:x + size] = 255
+        return frame
+
+    def start(self, callback, threaded=True):
+        self.running = True
+
+        def loop():
+            interval = 1.0 / self.framerate
+            next_frame = time.perf_counter()
+            while self.running:
+                start = time.perf_counter()
+                buffer = self.pool.put(self.capture())
+                self.capture_time = time.perf_counter() - start
+                self.frames_produced += 1
+                if buffer is not None:
+                    try:
+                        callback(buffer)
+                    finally:
+                        buffer.release()
+
+                next_frame += interval
+                time.sleep(max(0.0, next_frame - time.perf_counter()))
+
+        if threaded:
+            self.thread = threading.Thread(target=loop, daemon=True)
+            self.thread.start()
+        else:
+            loop()
+
+    def stop(self):
+        self.running = False
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+
+
+class StubDescriber:
+    """
+    Describer with the same interface as model.Gemma3ImageDescriber that sleeps
+    for a configurable prefill + per-token decode time instead of running a model.
+    """
+    def __init__(self, prefill=0.15, per_token=0.02, tokens=8, batch_scaling=0.3, jitter=0.1, seed=0):
+        self.model_id = "stub"
+        self.prefill = prefill
+        self.per_token = per_token
+        self.tokens = tokens
+        self.batch_scaling = batch_scaling  # extra cost per additional frame in a batch, relative to one frame
+        self.jitter = jitter
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self._timings = threading.local()
+
+    @property
+    def last_timings(self):
+        return getattr(self._timings, "value", {})
+
+    def _sleep(self, seconds):
+        with self.lock:
+            factor = 1.0 + self.jitter * self.rng.uniform(-1, 1)
+        time.sleep(seconds * factor)
+        return seconds * factor
+
+    def describe_frames(self, frames, prompts=None, max_new_tokens=16):
+        scale = 1.0 + self.batch_scaling * (len(frames) - 1)
+        tokens = min(self.tokens, max_new_tokens)
+        prefill = self._sleep(self.prefill * scale)
+        decode = self._sleep(self.per_token * tokens * scale)
+        self._timings.value = {"preprocess": 0.0, "prefill": prefill, "decode": decode, "postprocess": 0.0}
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+        return [f"stub caption {call}.{i} ({frame.shape[1]}x{frame.shape[0]})" for i, frame in enumerate(frames)]
+
+    def describe_prompts(self, frames, prompts, max_new_tokens=16):
+        prompt_lists = prompts if prompts and isinstance(prompts[0], (list, tuple)) else [prompts] * len(frames)
+        pairs = [(frame, prompt) for frame, frame_prompts in zip(frames, prompt_lists) for prompt in frame_prompts]
+        answers = iter(self.describe_frames([frame for frame, _ in pairs], [prompt for _, prompt in pairs],
+                                            max_new_tokens))
+        return [[next(answers) for _ in frame_prompts] for frame_prompts in prompt_lists]
+
+    def describe_frame(self, image, prompt=None, max_new_tokens=16, on_token=None):
+        if on_token is None:
+            return self.describe_frames([image], prompt, max_new_tokens)[0]
+
+        # streaming: emit the caption word by word over the decode time
+        tokens = min(self.tokens, max_new_tokens)
+        start = time.perf_counter()
+        prefill = self._sleep(self.prefill)
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+        words = f"stub caption {call}.0 ({image.shape[1]}x{image.shape[0]})".split()
+        for i in range(len(words)):
+            self._sleep(self.per_token * tokens / len(words))
+            on_token(" ".join(words[:i + 1]))
+        decode = time.perf_counter() - start - prefill
+        self._timings.value = {"preprocess": 0.0, "prefill": prefill, "decode": decode, "postprocess": 0.0}
+        return " ".join(words)
+
+
+class NullVideoOutput:
+    """
+    Stand-in for display.VideoOutput that only counts rendered frames.
+    """
+    def __init__(self, width=1280, height=720):
+        self.width = width
+        self.height = height
+        self.rendered = 0
+
+    def overlay_text(self, frame, text, position=(10, 30)):
+        return frame
+
+    def render(self, frame):
+        self.rendered += 1
+
+
+def rss_bytes():
+    """Resident set size of this process (Linux /proc, falls back to peak RSS)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    set_backend('cpu')  # synthetic frames are numpy arrays, even on a Jetson
+    if args.model_id:
+        from model import Gemma3ImageDescriber
+        describer = Gemma3ImageDescriber(model_id=args.model_id, device="cpu")
+    else:
+        describer = StubDescriber(prefill=args.stub_prefill, per_token=args.stub_per_token)
+
+    source = SyntheticVideoSource(args.width, args.height, args.frame_rate, video_file=args.video, static=args.static,
+                                  num_buffers=args.num_buffers or 3 * args.batch_size + 4)
+    output = NullVideoOutput(args.width, args.height) if args.display else None
+    metrics = Metrics()
+
+    agent = LiveVideoAgent(describer, source, output,
+                           prompt=args.prompt, max_tokens=args.max_tokens,
+                           save_output=False, batch_size=args.batch_size,
+                           scene_threshold=args.scene_threshold,
+                           sampler=make_sampler(args.sampling, interval=args.interval) if args.sampling != 'all' else None,
+                           metrics=metrics, stream=args.stream,
+                           display_fps=args.display_fps,
+                           history=FrameHistory(max_bytes=32 * 2**20) if args.query_port is not None else None)
+
+    query_server = None
+    if args.query_port is not None:
+        from query_server import QueryServer
+        query_server = QueryServer([agent], port=args.query_port)
+
+    memory = []
+    start = time.perf_counter()
+    agent.start()
+    if query_server is not None:
+        query_server.start()
+
+    display_thread = None
+    if output is not None:
+        display_thread = threading.Thread(target=agent.display_loop, daemon=True)
+        display_thread.start()
+
+    while time.perf_counter() - start < args.duration and agent.running:
+        memory.append((time.perf_counter() - start, rss_bytes()))
+        time.sleep(args.sample_interval)
+
+    if query_server is not None:
+        query_server.stop()
+    agent.stop()
+    elapsed = time.perf_counter() - start
+    memory.append((elapsed, rss_bytes()))
+
+    summary = metrics.summary()
+    captions = summary["counters"].get("captions", 0)
+    produced = source.frames_produced
+    mem_t = np.array([t for t, _ in memory])
+    mem_b = np.array([b for _, b in memory], dtype=np.float64)
+    slope = float(np.polyfit(mem_t, mem_b, 1)[0]) if len(memory) > 2 else 0.0
+
+    total = summary["stages"].get("total", {})
+    return {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "platform": platform.platform(),
+        "config": vars(args),
+        "duration": elapsed,
+        "frames_produced": produced,
+        "captions": captions,
+        "captions_per_second": captions / elapsed if elapsed else 0.0,
+        "frame_drop_rate": 1.0 - captions / produced if produced else 0.0,
+        "scheduler_dropped": agent.scheduler.dropped[agent.stream_id],
+        "scene_skipped": agent.scene_detector.skipped if agent.scene_detector else 0,
+        "sampling": {"policy": args.sampling,
+                     "considered": agent.sampler.considered if agent.sampler else produced,
+                     "selected": agent.sampler.selected if agent.sampler else produced},
+        "frame_pool": {"size": source.pool.size, "allocations": source.pool.allocations,
+                       "exhausted": source.pool.exhausted, "in_use_after_stop": source.pool.in_use()},
+        "caption_latency": {key: total.get(key, 0.0) for key in ("mean", "p50", "p95", "p99", "max")},
+        "display_fps": output.rendered / elapsed if output is not None and elapsed else None,
+        "memory": {
+            "start_mb": mem_b[0] / 2**20,
+            "end_mb": mem_b[-1] / 2**20,
+            "growth_mb": (mem_b[-1] - mem_b[0]) / 2**20,
+            "slope_mb_per_min": slope * 60 / 2**20,
+        },
+        "stages": summary["stages"],
+    }
+
+
+# metrics compared by --compare, and whether higher is better
+COMPARED = [
+    ("captions_per_second", True),
+    ("frame_drop_rate", False),
+    ("caption_latency.p50", False),
+    ("caption_latency.p95", False),
+    ("caption_latency.p99", False),
+    ("display_fps", True),
+    ("memory.slope_mb_per_min", False),
+]
+
+
+def lookup(results, path):
+    for key in path.split('.'):
+        results = results.get(key) if isinstance(results, dict) else None
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print relative changes against a baseline run. Returns the number of regressions
+    larger than tolerance (a fraction, e.g. 0.1 for 10%).
+    """
+    regressions = 0
+    print(f"[Compare] baseline {baseline.get('commit')} -> current {results.get('commit')}")
+    for path, higher_is_better in COMPARED:
+        old, new = lookup(baseline, path), lookup(results, path)
+        if old is None or new is None:
+            continue
+        change = (new - old) / abs(old) if old else 0.0
+        regressed = (change < -tolerance) if higher_is_better else (change > tolerance)
+        regressions += regressed
+        print(f"[Compare] {path:<26} {old:12.4f} -> {new:12.4f} ({change:+.1%}){'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the video_query pipeline (no GPU / jetson_utils needed)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds to run")
+    parser.add_argument("--frame_rate", type=int, default=30, help="Synthetic source frame rate")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--video", type=str, default=None, help="Read frames from a local video file (looped) instead of generating them")
+    parser.add_argument("--static", action="store_true", help="Generate an unchanging scene")
+    parser.add_argument("--model_id", type=str, default=None, help="Local checkpoint to run on CPU instead of the stub describer")
+    parser.add_argument("--stub_prefill", type=float, default=0.15, help="Stub describer prefill seconds")
+    parser.add_argument("--stub_per_token", type=float, default=0.02, help="Stub describer decode seconds per token")
+    parser.add_argument("--prompt", type=str, default="Describe the image precisely.")
+    parser.add_argument("--max_tokens", type=int, default=16)
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--scene_threshold", type=float, default=0.0)
+    parser.add_argument("--sampling", type=str, default="all", choices=SAMPLING_POLICIES, help="Frame sampling policy")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between frames for --sampling interval")
+    parser.add_argument("--num_buffers", type=int, default=0, help="Frame pool size (default: 3 * batch_size + 4)")
+    parser.add_argument("--stream", action="store_true", help="Stream partial captions (reports first_token latency)")
+    parser.add_argument("--display_fps", type=float, default=0, help="Display frame rate cap (0 follows the source)")
+    parser.add_argument("--no_display", dest="display", action="store_false", help="Don't run the display loop")
+    parser.add_argument("--query_port", type=int, default=None, help="Serve the query server API on this port (0 picks one)")
+    parser.add_argument("--sample_interval", type=float, default=1.0, help="Seconds between memory samples")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON results to this file (default: stdout)")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative change counted as a regression by --compare")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+        print(f"[Benchmark] Results written to {args.output}")
+    else:
+        print(json.dumps(results, indent=2, default=str))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        sys.exit(1 if compare(results, baseline, args.tolerance) else 0)
+
+
+if __name__ == "__main__":
+    main()
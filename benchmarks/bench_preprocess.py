@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Compare the HF processor image pipeline with utils.preprocess.FramePreprocessor.
+
+Times building the model inputs for one frame both ways and reports the peak
+host memory allocated per call (tracemalloc) and the largest pixel difference.
+Only the processor is loaded, not the model weights.
+
+    python benchmarks/bench_preprocess.py --model_id google/gemma-3-4b-it
+    python benchmarks/bench_preprocess.py --model_id google/gemma-3-4b-it --device cuda:0
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transformers import AutoProcessor
+from utils.preprocess import FramePreprocessor
+
+
+def build_messages(image, prompt):
+    return [{"role": "user", "content": [{"type": "image", "image": image}, {"type": "text", "text": prompt}]}]
+
+
+def measure(fn, iterations, device):
+    fn()  # warmup (and fills the text cache of the fast path)
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        if device.startswith('cuda'):
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return np.array(times), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark frame preprocessing (HF processor vs FramePreprocessor)")
+    parser.add_argument("--model_id", type=str, default="google/gemma-3-4b-it")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    processor = AutoProcessor.from_pretrained(args.model_id)
+    preprocessor = FramePreprocessor(processor, args.device, torch.bfloat16, build_messages,
+                                     add_generation_prompt=True)
+    frame = np.random.default_rng(0).integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+    prompt = "Describe the image precisely."
+
+    def hf_processor():
+        return processor.apply_chat_template(
+            build_messages(frame, prompt), add_generation_prompt=True, tokenize=True,
+            return_dict=True, return_tensors="pt"
+        ).to(args.device, dtype=torch.bfloat16)
+
+    def fast():
+        return preprocessor([frame], [prompt])
+
+    reference = hf_processor()["pixel_values"].float()
+    difference = (fast()["pixel_values"].float() - reference).abs()
+    print(f"[Preprocess] {args.width}x{args.height} -> {tuple(reference.shape)} on {args.device}, "
+          f"pixel difference max={difference.max().item():.4f} mean={difference.mean().item():.5f}")
+
+    for name, fn in (("processor", hf_processor), ("fast", fast)):
+        times, peak = measure(fn, args.iterations, args.device)
+        print(f"[Preprocess] {name:<10} mean={times.mean()*1000:7.2f}ms p95={np.percentile(times, 95)*1000:7.2f}ms "
+              f"host peak={peak/2**20:6.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,23 +3,27 @@ import threading
 import time
 import torch
 
-from jetson_utils import videoSource, videoOutput, cudaDeviceSynchronize, cudaFont, cudaMemcpy
-from utils.utils import cudaToNumpy
+from utils.backend import get_backend
+from utils.frame_pool import FramePool
 from utils.image import wrap_text
 
 class VideoSource:
     """
-    Capture frames from a camera, video file, or stream using jetson-utils.
-    Automatically skips frames while inference is still running.
+    Capture frames from a camera, video file, or stream using the active frame backend
+    (jetson-utils videoSource, or OpenCV/PyAV on the CPU backend).
     """
     def __init__(self, source="/dev/video0", return_tensors='cuda',
                  video_input_width=None, video_input_height=None, 
                  video_input_codec=None, video_input_framerate=None, 
-                 video_input_save=None, **kwargs):
+                 video_input_save=None, num_buffers=8, keyframes=False, **kwargs):
         """
         Args:
             source: Camera device, file path, or stream URL.
-            return_tensors: 'np' | 'pt' | 'cuda' — format for returned frames.
+            return_tensors: 'np' | 'pt' | 'cuda' — format for returned frames
+                            ('cuda' is the backend's native frame: cudaImage, or np.ndarray on CPU).
+            num_buffers: Size of the preallocated FramePool that start() copies frames into.
+            keyframes: Prefer a decoder that reports codec keyframes (PyAV on the CPU backend),
+                       exposed per frame as self.keyframe.
         """
 
         super().__init__(**kwargs)
@@ -40,12 +44,18 @@ class VideoSource:
         if video_input_save:
             options['save'] = video_input_save
 
+        if keyframes:
+            options['keyframes'] = True
+
         self.source = source
         self.return_tensors = return_tensors
-        self.cap = videoSource(source, options=options)  # automatically detects camera/stream type
+        self.backend = get_backend()
+        self.cap = self.backend.video_source(source, options=options)  # automatically detects camera/stream type
+        self.pool = FramePool(num_buffers, backend=self.backend)
         self.running = False
         self.thread = None
-        self._busy = False  # skip frames while inference running
+        self.capture_time = None  # seconds spent capturing + copying the latest frame
+        self.keyframe = None      # whether the latest frame is a codec keyframe (None: not reported by the source)
 
     def capture(self):
         """
@@ -56,39 +66,42 @@ class VideoSource:
 
         if frame is None:
             raise RuntimeError("Failed to capture frame from source.")
+        self.keyframe = getattr(self.cap, 'key_frame', None)
         
         if self.return_tensors == 'np':
-            frame_np = cudaToNumpy(frame)
+            frame_np = self.backend.to_numpy(frame)
             return frame_np
         elif self.return_tensors == 'pt':
-            frame_np = cudaToNumpy(frame)
+            frame_np = self.backend.to_numpy(frame)
             return torch.from_numpy(frame_np).permute(2, 0, 1).float() / 255.0
         elif self.return_tensors == 'cuda':
             return frame
         else:
             raise ValueError(f"Unsupported return_tensors: {self.return_tensors}")
 
-    def start(self, callback, threaded=True, interval=0.03):
+    def start(self, callback, threaded=True):
         """
-        Continuously capture frames and send to callback(frame),
-        skipping new frames if previous inference is still running.
+        Continuously capture frames, copy each into a buffer of self.pool and pass
+        the utils.frame_pool.FrameBuffer to callback(buffer). The source releases its
+        reference when the callback returns, so the callback must retain() buffers it
+        keeps. Frames are dropped while every pool buffer is still referenced.
+        The callback runs on the capture thread and must not block on inference;
+        LiveVideoAgent hands frames to its InferenceScheduler, which decides what to drop.
         """
         self.running = True
 
         def loop():
             while self.running:
                 try:
-                    if self._busy:
-                        _ = self.cap.Capture(timeout=300)
-                        time.sleep(interval)
+                    start = time.perf_counter()
+                    buffer = self.pool.put(self.capture())
+                    self.capture_time = time.perf_counter() - start
+                    if buffer is None:
                         continue
-
-                    frame = self.capture()
-                    self._busy = True
-                    threading.Thread(
-                        target=self._inference_thread, args=(callback, frame), daemon=True
-                    ).start()
-
+                    try:
+                        callback(buffer)
+                    finally:
+                        buffer.release()
                 except Exception as e:
                     print(f"[VideoSource] Error: {e}")
                     time.sleep(1)
@@ -99,42 +112,31 @@ class VideoSource:
         else:
             loop()
 
-    def _inference_thread(self, callback, frame):
-        """
-        Run inference in a separate thread and release busy flag after completion.
-        """
-        try:
-            safe_frame = cudaMemcpy(frame)
-            callback(safe_frame)
-        except Exception as e:
-            print(f"[VideoSource] Inference error: {e}")
-        finally:
-            self._busy = False  # ready for next frame
-
     def stop(self):
         """Stop video capture."""
         self.running = False
-        if self.thread:
+        if self.thread and self.thread is not threading.current_thread():
             self.thread.join()
-        print("[VideoSource] Stopped.")
+        print(f"[VideoSource] Stopped. Frame pool: {self.pool}")
 
 # Using display.py->PyVideoOutput instead
 class VideoOutput:
     """
-    Display frames and overlay text using jetson-utils.
+    Display frames and overlay text using jetson-utils (Jetson backend only).
     """
     def __init__(self, output_source="display://0"):
         """
         Args:
             output_source: Output display or stream (e.g., 'display://0', 'file://output.mp4')
         """
+        from jetson_utils import videoOutput
         self.output = videoOutput(output_source)
         self.running = False
-        self.font = cudaFont()
+        self.font = get_backend().font()
 
     def overlay_text(self, frame, text, position=(10, 30), color=(255, 255, 255, 255), background=None):
         """
-        Draw text on CUDA frame using jetson-utils' cudaFont (GPU overlay).
+        Draw text on the frame with the backend's font (cudaFont GPU overlay, or OpenCV on CPU).
         Uses wrap_text internally for consistent rendering with background support.
         
         Args:
@@ -162,7 +164,7 @@ class VideoOutput:
         try:
             # frame should already be a safe copy
             self.output.Render(frame)
-            cudaDeviceSynchronize()  # ← Only needed here
+            get_backend().synchronize()  # ← Only needed here
             print("[VideoOutput] Frame rendered successfully.")
             return True
         except Exception as e:
@@ -0,0 +1,137 @@
+#caption_search.py
+"""
+Search the caption index that video_query.py / offline.py build with --caption_index.
+
+    python caption_search.py --index captions.db truck
+    python caption_search.py --index captions.db truck --start 7d --rank
+    python caption_search.py --index captions.db --start "2026-10-17 08:00" --end "2026-10-17 09:00"
+    python caption_search.py --index captions.db "a person carrying a ladder" --semantic
+    python caption_search.py --index captions.db --import prompt_history.csv old_captions.jsonl
+    python caption_search.py --index captions.db --stats
+
+Times are seconds since the epoch, a date / ISO datetime, or a span before now
+(30m, 2h, 7d; write --start=-2h for the signed form). Offline timelines are
+indexed by media time (seconds into the file).
+"""
+import os
+import re
+import csv
+import json
+import time
+import argparse
+from datetime import datetime
+
+from utils.caption_index import CaptionIndex, TextEmbedder
+
+RELATIVE_TIME = re.compile(r"^-?(\d+(?:\.\d+)?)([smhd])$")
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_time(value):
+    """Seconds since the epoch from a number, a date / ISO datetime or <n><s|m|h|d> before now."""
+    if value is None:
+        return None
+    match = RELATIVE_TIME.match(value)
+    if match:
+        return time.time() - float(match.group(1)) * UNITS[match.group(2)]
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"can't parse time {value!r}, use seconds, an ISO date or e.g. 2h")
+
+
+def read_captions(path):
+    """Caption entries of a CSV or JSONL caption file."""
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith((".jsonl", ".json")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for row in csv.DictReader(f):
+                yield {key: value for key, value in row.items() if key is not None}
+
+
+def import_files(index, paths, batch_size=256):
+    for path in paths:
+        batch, count = [], 0
+        for entry in read_captions(path):
+            batch.append(entry)
+            if len(batch) >= batch_size:
+                count += index.add(batch)
+                batch = []
+        count += index.add(batch)
+        print(f"[CaptionSearch] Indexed {count} captions from {path}")
+
+
+def format_time(seconds):
+    if seconds is None:
+        return "?"
+    if seconds > 1e8:  # wall clock, else media time
+        return datetime.fromtimestamp(seconds).strftime("%Y-%m-%d %H:%M:%S")
+    return f"{seconds:10.2f}s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the caption index by text, time range or meaning")
+    parser.add_argument("query", type=str, nargs="?", default=None, help="Words that must all appear (or, with --semantic, a description)")
+    parser.add_argument("--index", type=str, required=True, help="Caption index built with --caption_index")
+    parser.add_argument("--start", type=parse_time, default=None, help="Only captions from this time on")
+    parser.add_argument("--end", type=parse_time, default=None, help="Only captions up to this time")
+    parser.add_argument("--source", type=str, default=None, help="Only captions of this source")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--rank", action="store_true", help="Best matches first (BM25) instead of newest first")
+    parser.add_argument("--raw", action="store_true", help="Pass the query to SQLite FTS5 as is (OR, NEAR, prefix*, ...)")
+    parser.add_argument("--semantic", action="store_true", help="Rank by embedding similarity (index built with --index_embedding_model)")
+    parser.add_argument("--embedding_model", type=str, default=None, help="Text encoder for --semantic / --import (default: the index's)")
+    parser.add_argument("--import", dest="import_files", type=str, nargs="+", default=None,
+                        help="Add existing CSV/JSONL caption files to the index")
+    parser.add_argument("--stats", action="store_true", help="Print what the index holds")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON lines")
+    args = parser.parse_args()
+
+    if not args.import_files and not os.path.exists(args.index):
+        parser.error(f"{args.index} doesn't exist")
+
+    embedder = None
+    embedding_model = args.embedding_model
+    if embedding_model is None and (args.semantic or args.import_files):
+        stored = CaptionIndex(args.index)
+        embedding_model = stored.meta("embedding_model")
+        stored.close()
+    if embedding_model is not None:
+        embedder = TextEmbedder(embedding_model)
+    elif args.semantic:
+        parser.error("the index holds no embeddings, build it with --index_embedding_model or pass --embedding_model")
+    index = CaptionIndex(args.index, embedder)
+
+    if args.import_files:
+        import_files(index, args.import_files)
+    if args.stats:
+        print(json.dumps(index.stats(), indent=2))
+    if args.query or args.start is not None or args.end is not None or args.source is not None:
+        if args.semantic:
+            if not args.query:
+                parser.error("--semantic needs a query")
+            results = index.semantic_search(args.query, args.start, args.end, args.source, args.limit)
+        else:
+            results = index.search(args.query, args.start, args.end, args.source, args.limit,
+                                   rank=args.rank, raw=args.raw)
+        for result in results:
+            if args.json:
+                print(json.dumps(result, ensure_ascii=False))
+                continue
+            score = f" [{result['score']:.3f}]" if "score" in result else ""
+            source = f" {result['source']}" if result["source"] else ""
+            print(f"{format_time(result['time'])}{source}{score}  {result['text']}")
+        if not results:
+            print("[CaptionSearch] No captions found")
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,7 @@
 import time
 import logging
 import torch
-from jetson_utils import cudaFont
-from utils.utils import cudaToNumpy
+from utils.backend import get_backend
 from utils.vision import PyDisplay
 from utils.image import wrap_text
 
@@ -22,14 +21,13 @@ class VideoSource:
         self.open_stream()
 
     def open_stream(self):
-        from jetson_utils import videoSource
         options = {}
         if self.width: options['width'] = self.width
         if self.height: options['height'] = self.height
         if self.framerate: options['framerate'] = self.framerate
 
         try:
-            self.stream = videoSource(self.video_input, options=options)
+            self.stream = get_backend().video_source(self.video_input, options=options)
             logging.info(f"[VideoSource] Camera {self.video_input} opened successfully")
         except Exception as e:
             logging.error(f"[VideoSource] Failed to open camera {self.video_input}: {e}")
@@ -60,7 +58,7 @@ class VideoSource:
                 if self.return_tensors == 'pt':
                     img = torch.as_tensor(img, device='cuda')
                 elif self.return_tensors == 'np':
-                    img = cudaToNumpy(img)
+                    img = get_backend().to_numpy(img)
                 elif self.return_tensors != 'cuda':
                     raise ValueError(f"return_tensors should be 'cuda', 'np', or 'pt', got {self.return_tensors}")
                 return img
@@ -77,7 +75,7 @@ class VideoOutput:
         self.display = PyDisplay(width=width, height=height)
         self.width = width
         self.height = height
-        self.font = cudaFont()
+        self.font = get_backend().font()
 
     def render(self, cuda_img):
         """Render a single frame safely."""
@@ -85,7 +83,7 @@ class VideoOutput:
 
     def overlay_text(self, frame, text, position=(10, 30)):
         """
-        Draw text on CUDA frame using jetson-utils' cudaFont (GPU overlay).
+        Draw text on the frame with the backend's font (cudaFont GPU overlay, or OpenCV on CPU).
         Uses wrap_text internally for consistent rendering with background support.
         """
         try:
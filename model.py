@@ -1,68 +1,572 @@
 #model.py
+import re
+import copy
+import time
+import threading
+import contextlib
 import torch
-from transformers import AutoProcessor, Gemma3ForConditionalGeneration, AutoModelForImageTextToText
+from transformers import AutoProcessor, AutoTokenizer, AutoModelForCausalLM
+from transformers import Gemma3ForConditionalGeneration, AutoModelForImageTextToText
+from transformers import LogitsProcessor, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+from utils.preprocess import FramePreprocessor
+from utils.embedding_cache import EmbeddingCache
+
+SYSTEM_PROMPT = "You are an open vocabulary detection agent. Output within 10 words. Do not provide additional explanations"
+
+STOP_CONDITIONS = ('sentence', 'newline')
+DECODING_MODES = ('greedy', 'prompt_lookup', 'assisted')
+
+def _expand_prompts(prompts, count, default):
+    """
+    Normalize a single prompt (or None) and a list of prompts to one prompt per frame.
+    """
+    if prompts is None or isinstance(prompts, str):
+        prompts = [prompts] * count
+    if len(prompts) != count:
+        raise ValueError(f"expected {count} prompts (one per frame), got {len(prompts)}")
+    return [default if prompt is None else prompt for prompt in prompts]
+
+class PrefillTimer(LogitsProcessor):
+    """
+    Pass-through logits processor that records when the first logits arrive,
+    i.e. when the prefill forward pass is done and decoding starts.
+    """
+    def __init__(self):
+        self.prefill_end = None
+
+    def mark(self):
+        if self.prefill_end is None:
+            self.prefill_end = time.perf_counter()
+
+    def __call__(self, input_ids, scores):
+        if self.prefill_end is None:
+            if scores.is_cuda:
+                torch.cuda.synchronize(scores.device)
+            self.mark()
+        return scores
+
+class CaptionStreamer(BaseStreamer):
+    """
+    generate() streamer that decodes the tokens produced so far and passes the
+    partial caption to on_token(text) after every step. The first put() from
+    generate() carries the prompt and is skipped.
+    """
+    def __init__(self, tokenizer, on_token, postprocess=None):
+        self.tokenizer = tokenizer
+        self.on_token = on_token
+        self.postprocess = postprocess
+        self.tokens = []
+        self.text = ""
+        self.skip_prompt = True
+
+    def add(self, token_ids):
+        """Append generated token ids (tensor or list) and report the new partial caption."""
+        if torch.is_tensor(token_ids):
+            token_ids = token_ids.flatten().tolist()
+        self.tokens.extend(token_ids)
+        text = self.tokenizer.decode(self.tokens, skip_special_tokens=True)
+        if self.postprocess is not None:
+            text = self.postprocess(text)
+        if text != self.text:
+            self.text = text
+            try:
+                self.on_token(text)
+            except Exception as e:
+                print(f"[CaptionStreamer] on_token callback failed: {e}")
+
+    def put(self, value):
+        if value.shape[0] > 1:
+            raise ValueError("CaptionStreamer only supports a batch size of 1")
+        if self.skip_prompt:
+            self.skip_prompt = False
+            return
+        self.add(value)
+
+    def end(self):
+        pass
+
+class CaptionStoppingCriteria(StoppingCriteria):
+    """
+    Ends generation as soon as every caption in the batch is complete instead of
+    running to max_new_tokens: once it ends a sentence, starts a new line, or has
+    max_words words. Only the tokens after prompt_len are checked. A token can carry
+    a few characters past the stop point, so captions are cut back with trim().
+    """
+    # ., ! or ? after a word (not "3.5") followed by whitespace or the end of the text
+    SENTENCE_END = re.compile(r'[^\W\d_][.!?]["\')\]]?(?=\s|$)')
+
+    def __init__(self, tokenizer, prompt_len, stop_on=STOP_CONDITIONS, max_words=None):
+        unknown = set(stop_on) - set(STOP_CONDITIONS)
+        if unknown:
+            raise ValueError(f"stop_on should only contain {STOP_CONDITIONS}, got {sorted(unknown)}")
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.stop_on = tuple(stop_on)
+        self.max_words = max_words
+
+    def complete(self, text):
+        text = text.lstrip()
+        if 'newline' in self.stop_on and '\n' in text:
+            return True
+        if 'sentence' in self.stop_on and self.SENTENCE_END.search(text):
+            return True
+        if self.max_words:
+            words = len(text.split())
+            # the last word only counts once something follows it, it may still be growing
+            return words > self.max_words or (words == self.max_words and not text[-1].isalnum())
+        return False
+
+    def trim(self, text):
+        text = text.strip()
+        if 'newline' in self.stop_on:
+            text = text.split('\n')[0]
+        if 'sentence' in self.stop_on:
+            match = self.SENTENCE_END.search(text)
+            if match:
+                text = text[:match.end()]
+        if self.max_words:
+            text = ' '.join(text.split()[:self.max_words]) if len(text.split()) > self.max_words else text
+        return text.strip()
+
+    def __call__(self, input_ids, scores, **kwargs):
+        texts = self.tokenizer.batch_decode(input_ids[:, self.prompt_len:], skip_special_tokens=True)
+        return torch.tensor([self.complete(text) for text in texts], dtype=torch.bool, device=input_ids.device)
+
+def _load_draft_model(draft_model_id, device):
+    """Small text-only causal LM proposing tokens for assisted decoding, and its tokenizer."""
+    draft = AutoModelForCausalLM.from_pretrained(draft_model_id, torch_dtype=torch.bfloat16, device_map=device).eval()
+    return draft, AutoTokenizer.from_pretrained(draft_model_id)
+
+def _decoding_kwargs(decoding, batch_size, model, tokenizer, draft=None, draft_tokenizer=None,
+                     num_assistant_tokens=8, max_length=None):
+    """
+    generate() arguments for the decoding mode. Assisted / prompt-lookup decoding
+    only support a batch of one, and roll rejected tokens back by cropping the KV
+    cache, which sliding-window layers can't do once max_length (prompt + new tokens)
+    exceeds their window; those cases fall back to greedy.
+    """
+    if decoding == 'greedy' or batch_size > 1:
+        return {}
+    for config in (model.config, draft.config if draft is not None else None):
+        sliding_window = getattr(config.get_text_config(), 'sliding_window', None) if config is not None else None
+        if sliding_window and max_length and max_length > sliding_window:
+            return {}
+    if decoding == 'prompt_lookup':
+        # propose continuations by matching the last n-gram against the prompt
+        return {"prompt_lookup_num_tokens": num_assistant_tokens}
+    if decoding == 'assisted':
+        kwargs = {"assistant_model": draft, "num_assistant_tokens": num_assistant_tokens}
+        if draft.config.get_text_config().vocab_size != model.config.get_text_config().vocab_size:
+            # different vocabulary: candidates are exchanged as text (universal assisted decoding)
+            kwargs.update(tokenizer=tokenizer, assistant_tokenizer=draft_tokenizer)
+        return kwargs
+    raise ValueError(f"decoding should be one of {DECODING_MODES}, got {decoding}")
+
+def _prompt_lists(prompts, count):
+    """
+    Normalize multi-prompt input to one list of prompts per frame: a list of prompts
+    is asked about every frame, a list of lists gives each frame its own prompts.
+    """
+    if prompts and isinstance(prompts[0], (list, tuple)):
+        if len(prompts) != count:
+            raise ValueError(f"expected {count} prompt lists (one per frame), got {len(prompts)}")
+        return [list(frame_prompts) for frame_prompts in prompts]
+    return [list(prompts)] * count
+
+class SharedImageFeatures:
+    """
+    Replaces a model's get_image_features() with a wrapper that, inside share(counts),
+    runs the vision tower once per distinct frame: the batch holds counts[i]
+    consecutive sequences showing frame i (one per prompt) and they all reuse its
+    embeddings. Outside share(), and in other threads, calls pass straight through.
+    Handles Gemma3 (one pixel_values row per image) and Qwen-VL (patches of all
+    images concatenated, one image_grid_thw row per image).
+
+    With an embedding cache (utils.embedding_cache.EmbeddingCache) the frames passed
+    to share() are also looked up there, and only the ones it doesn't hold are encoded.
+    """
+    def __init__(self, model, cache=None):
+        # the inner *Model owns the vision tower call in current transformers, older ones only have the outer one
+        module = getattr(model, 'model', model)
+        if not hasattr(module, 'get_image_features'):
+            module = model
+        self.original = module.get_image_features
+        module.get_image_features = self
+        self.cache = cache
+        self.local = threading.local()
+        self.encoded = 0  # frames run through the vision tower inside share()
+        self.reused = 0   # sequences that reused another sequence's (or the cache's) image embeddings
+
+    @contextlib.contextmanager
+    def share(self, counts, frames=None):
+        """
+        frames -- the distinct frames, for the embedding cache. A nested share() keeps
+        the outer grouping.
+        """
+        if getattr(self.local, 'counts', None) is not None:
+            yield
+            return
+        self.local.counts = list(counts)
+        self.local.keys = None
+        if self.cache is not None and frames is not None:
+            self.local.keys = [self.cache.key(frame) for frame in frames]
+        try:
+            yield
+        finally:
+            self.local.counts = None
+            self.local.keys = None
+
+    def __call__(self, pixel_values, *args, **kwargs):
+        counts = getattr(self.local, 'counts', None)
+        keys = getattr(self.local, 'keys', None)
+        if not counts or (max(counts) == 1 and keys is None):
+            return self.original(pixel_values, *args, **kwargs)
+
+        image_grid_thw = args[0] if args else kwargs.get('image_grid_thw')
+        images = image_grid_thw.shape[0] if image_grid_thw is not None else pixel_values.shape[0]
+        if images != sum(counts):
+            return self.original(pixel_values, *args, **kwargs)
+
+        starts = [sum(counts[:i]) for i in range(len(counts))]
+        if image_grid_thw is None:
+            inputs = [pixel_values[i:i + 1] for i in starts]
+            resolutions = [tuple(pixel_values.shape[1:])] * len(starts)
+        else:
+            patches = image_grid_thw.prod(-1).tolist()
+            offsets = [sum(patches[:i]) for i in range(len(patches))]
+            inputs = [pixel_values[offsets[i]:offsets[i] + patches[i]] for i in starts]
+            resolutions = [tuple(image_grid_thw[i].tolist()) for i in starts]
+
+        # the resolution the frame was encoded at is part of the key: the same frame
+        # at another processor setting has other embeddings
+        keys = [key + (resolution,) if key is not None else None
+                for key, resolution in zip(keys or [None] * len(starts), resolutions)]
+        features = [self.cache.get(key) if key is not None else None for key in keys]
+        missing = [i for i, feature in enumerate(features) if feature is None]
+        if missing:
+            if image_grid_thw is None:
+                encoded = self.original(torch.cat([inputs[i] for i in missing]))
+            else:
+                encoded = self.original(torch.cat([inputs[i] for i in missing]),
+                                        image_grid_thw[[starts[i] for i in missing]])
+            for i, feature in zip(missing, encoded):
+                features[i] = feature
+                if keys[i] is not None:
+                    self.cache.put(keys[i], feature)
+
+        self.encoded += len(missing)
+        self.reused += images - len(missing)
+        repeated = [feature for feature, count in zip(features, counts) for _ in range(count)]
+        return torch.stack(repeated) if image_grid_thw is None else tuple(repeated)
+
+def _stage_timings(start, preprocessed, timer, generated, finished):
+    """
+    Split a describe call into preprocess / prefill / decode / postprocess seconds.
+    """
+    prefill_end = timer.prefill_end or generated
+    return {
+        "preprocess": preprocessed - start,
+        "prefill": prefill_end - preprocessed,
+        "decode": generated - prefill_end,
+        "postprocess": finished - generated,
+    }
 
 class Gemma3ImageDescriber():
     """
     Load and configure gemma3 model
     """
-    def __init__(self, model_id="google/gemma-3-4b-it", device="cuda:0"):
+    def __init__(self, model_id="google/gemma-3-4b-it", device="cuda:0",
+                 system_prompt=SYSTEM_PROMPT, use_prefix_cache=True, fast_preprocess=True,
+                 stop_on=(), max_words=None, decoding='greedy', draft_model_id=None, num_assistant_tokens=8,
+                 embedding_cache_mb=0, embedding_cache_near=None):
         self.model_id = model_id
         self.device = device
+        self.system_prompt = system_prompt
+        self.use_prefix_cache = use_prefix_cache
+        # early stop (sentence end / newline / word count) and assisted decoding, see _generate_kwargs
+        self.stop_on = tuple(stop_on or ())
+        self.max_words = max_words
+        self.decoding = decoding
+        self.num_assistant_tokens = num_assistant_tokens
         
         # Load processor and model
         self.processor = AutoProcessor.from_pretrained(model_id)
+        self.processor.tokenizer.padding_side = "left"
         self.model = Gemma3ForConditionalGeneration.from_pretrained(
             model_id,
             torch_dtype=torch.bfloat16,
             device_map=device
-        ).cuda().eval()
-    
-    def describe_frame(self, image_path, prompt=None, max_new_tokens=16):
-        if prompt is None:
-            prompt = "Describe the image precisely. "
-        
-        messages = [
+        ).eval()
+
+        # KV cache of the tokens preceding the image (bos + system message),
+        # keyed on everything that can change those tokens
+        self.boi_token_id = self.processor.tokenizer.convert_tokens_to_ids(self.processor.boi_token)
+
+        # resize/normalize raw frames on the model device instead of through the processor's PIL pipeline
+        self.preprocessor = None
+        if fast_preprocess:
+            preprocessor = FramePreprocessor(self.processor, self.model.device, torch.bfloat16, self.build_messages)
+            self.preprocessor = preprocessor if preprocessor.supported else None
+        # (key, prefix ids, kv cache), replaced as a whole under _prefix_lock: the describer
+        # is shared by the inference workers and the query server
+        self._prefix = None
+        self._prefix_lock = threading.Lock()
+
+        self.draft_model, self.draft_tokenizer = None, None
+        if decoding == 'assisted':
+            if draft_model_id is None:
+                raise ValueError("decoding='assisted' needs a draft_model_id")
+            self.draft_model, self.draft_tokenizer = _load_draft_model(draft_model_id, device)
+
+        # several prompts about one frame share its vision tower pass (describe_prompts),
+        # and with embedding_cache_mb a frame seen before (or, with embedding_cache_near, a near duplicate) skips it
+        self.embedding_cache = (EmbeddingCache(int(embedding_cache_mb * 2**20), near_duplicates=embedding_cache_near)
+                                if embedding_cache_mb else None)
+        self.image_features = SharedImageFeatures(self.model, self.embedding_cache)
+
+        self._timings = threading.local()
+
+    @property
+    def last_timings(self):
+        """Stage timings (seconds) of the most recent describe call made from this thread."""
+        return getattr(self._timings, "value", {})
+
+    def build_messages(self, image, prompt):
+        return [
             {
                 "role": "system",
-                "content": [{"type": "text", "text": "You are an open vocabulary detection agent. Output within 10 words. Do not provide additional explanations"}]
+                "content": [{"type": "text", "text": self.system_prompt}]
             },
             {
                 "role": "user",
                 "content": [
-                    {"type": "image", "image": image_path},
+                    {"type": "image", "image": image},
                     {"type": "text", "text": prompt}
                 ]
             }
         ]
-        
-        inputs = self.processor.apply_chat_template(
+
+    def _stopping_criteria(self, prompt_len):
+        if not (self.stop_on or self.max_words):
+            return None
+        return CaptionStoppingCriteria(self.processor.tokenizer, prompt_len, self.stop_on, self.max_words)
+
+    def _generate_kwargs(self, batch_size, criteria, max_length=None):
+        kwargs = _decoding_kwargs(self.decoding, batch_size, self.model, self.processor.tokenizer,
+                                  self.draft_model, self.draft_tokenizer, self.num_assistant_tokens, max_length)
+        if criteria is not None:
+            kwargs["stopping_criteria"] = StoppingCriteriaList([criteria])
+        return kwargs
+
+    def _prepare_inputs(self, frames, prompts):
+        """
+        Model inputs for the frames, left-padded when there are several.
+        Raw arrays use the fast preprocessor, anything else the HF processor.
+        """
+        if self.preprocessor is not None and self.preprocessor.accepts(frames):
+            return self.preprocessor(frames, prompts)
+
+        messages = [self.build_messages(frame, prompt) for frame, prompt in zip(frames, prompts)]
+        return self.processor.apply_chat_template(
             messages,
             add_generation_prompt=True,
             tokenize=True,
+            padding=len(frames) > 1,
             return_dict=True,
             return_tensors="pt"
         ).to(self.device, dtype=torch.bfloat16)
+
+    def reset_prefix_cache(self):
+        """Drop the cached system-prompt KV state (rebuilt on the next frame)."""
+        with self._prefix_lock:
+            self._prefix = None
+
+    def _get_prefix_cache(self, input_ids):
+        """
+        Return (prefix_len, kv_cache) for the tokens before the first image token,
+        prefilling them once and reusing the result for every following frame.
+        Returns (0, None) if the input has no image token to split on.
+        """
+        positions = (input_ids[0] == self.boi_token_id).nonzero()
+        if len(positions) == 0:
+            return 0, None
+
+        prefix_len = int(positions[0])
+        # the user prompt comes after the image, so streams with different prompts share the prefix
+        key = (self.model_id, self.system_prompt)
+
+        with self._prefix_lock:
+            cached = self._prefix
+            if cached is None or cached[0] != key or not torch.equal(cached[1], input_ids[:, :prefix_len]):
+                prefix_ids = input_ids[:, :prefix_len].clone()
+                with torch.inference_mode():
+                    outputs = self.model(input_ids=prefix_ids, use_cache=True, logits_to_keep=1)
+                cached = self._prefix = (key, prefix_ids, outputs.past_key_values)
+
+        # the cache object is never modified in place (callers deep copy it), so it can be used unlocked
+        return prefix_len, cached[2]
+
+    def _generate_with_prefix(self, inputs, prompt, max_new_tokens, timer, streamer=None, criteria=None):
+        """
+        Prefill only the image and user tokens on top of a copy of the cached prefix,
+        then let generate() continue decoding from the populated cache.
+        Returns None when the prefix cache can't be used for these inputs.
+        Without use_prefix_cache the whole prompt is prefilled here instead, which
+        assisted decoding relies on: generate() then only sees token ids, never the
+        pixel values the text-only draft model can't take.
+        """
+        input_ids = inputs["input_ids"]
+        if self.use_prefix_cache:
+            prefix_len, prefix_kv = self._get_prefix_cache(input_ids)
+            if prefix_kv is None:
+                return None
+            cache = copy.deepcopy(prefix_kv)
+        else:
+            prefix_len, cache = 0, None
+
+        input_len = input_ids.shape[-1]
+        cache_position = torch.arange(prefix_len, input_len, device=input_ids.device)
+
+        # token_type_ids stay full length: the image attention mask indexes them by absolute position
+        outputs = self.model(
+            input_ids=input_ids[:, prefix_len:],
+            pixel_values=inputs["pixel_values"],
+            token_type_ids=inputs.get("token_type_ids"),
+            attention_mask=inputs["attention_mask"],
+            past_key_values=cache,
+            cache_position=cache_position,
+            use_cache=True,
+            logits_to_keep=1
+        )
+        next_token = outputs.logits[:, -1].argmax(dim=-1, keepdim=True)
+        sequence = torch.cat([input_ids, next_token], dim=-1)
+
+        eos_token_id = self.model.generation_config.eos_token_id
+        if not isinstance(eos_token_id, (list, tuple)):
+            eos_token_id = [eos_token_id]
+        stop = max_new_tokens <= 1 or int(next_token) in eos_token_id or \
+            (criteria is not None and bool(criteria(sequence, None).all()))
+        timer.mark()
+        if streamer is not None:
+            streamer.add(next_token)
+        if stop:
+            return sequence
+
+        return self.model.generate(
+            input_ids=sequence,
+            attention_mask=torch.ones_like(sequence),
+            past_key_values=outputs.past_key_values,
+            max_new_tokens=max_new_tokens - 1,
+            do_sample=False,
+            streamer=streamer,
+            **self._generate_kwargs(1, criteria, input_len + max_new_tokens)
+        )
+    
+    def describe_frame(self, image_path, prompt=None, max_new_tokens=16, on_token=None):
+        """
+        Caption one frame. If on_token is given, it is called with the partial
+        caption as every token is decoded; the full caption is still returned.
+        With a list of prompts, returns the list of answers (see describe_prompts).
+        """
+        if isinstance(prompt, (list, tuple)):
+            return self.describe_prompts([image_path], prompt, max_new_tokens)[0]
+        if prompt is None:
+            prompt = "Describe the image precisely. "
+        
+        start = time.perf_counter()
+        inputs = self._prepare_inputs([image_path], [prompt])
         
         input_len = inputs["input_ids"].shape[-1]
+        preprocessed = time.perf_counter()
+        timer = PrefillTimer()
+        streamer = CaptionStreamer(self.processor.tokenizer, on_token) if on_token is not None else None
+        criteria = self._stopping_criteria(input_len)
         
-        with torch.inference_mode():
-            generation = self.model.generate(
-                **inputs,
-                max_new_tokens=max_new_tokens,
-                do_sample=False
-            )
+        with torch.inference_mode(), self.image_features.share([1], [image_path]):
+            generation = None
+            if self.use_prefix_cache or self.draft_model is not None:
+                generation = self._generate_with_prefix(inputs, prompt, max_new_tokens, timer, streamer, criteria)
+            if generation is None:
+                generation = self.model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    do_sample=False,
+                    logits_processor=LogitsProcessorList([timer]),
+                    streamer=streamer,
+                    **self._generate_kwargs(1, criteria, input_len + max_new_tokens)
+                )
             generation = generation[0][input_len:]
+        generated = time.perf_counter()
         
         decoded = self.processor.decode(generation, skip_special_tokens=True)
+        if criteria is not None:
+            decoded = criteria.trim(decoded)
+        self._timings.value = _stage_timings(start, preprocessed, timer, generated, time.perf_counter())
         print(decoded)
         return decoded
 
+    def describe_frames(self, frames, prompts=None, max_new_tokens=16):
+        """
+        Caption N frames with a single left-padded generate() call.
+        prompts can be one prompt shared by all frames, or a list with one per frame.
+        Returns the N captions in the same order as the frames.
+        """
+        if len(frames) == 1:
+            return [self.describe_frame(frames[0], _expand_prompts(prompts, 1, None)[0], max_new_tokens)]
+
+        start = time.perf_counter()
+        prompts = _expand_prompts(prompts, len(frames), "Describe the image precisely. ")
+        inputs = self._prepare_inputs(frames, prompts)
+
+        input_len = inputs["input_ids"].shape[-1]
+        preprocessed = time.perf_counter()
+        timer = PrefillTimer()
+        criteria = self._stopping_criteria(input_len)
+
+        with torch.inference_mode(), self.image_features.share([1] * len(frames), frames):
+            generation = self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                logits_processor=LogitsProcessorList([timer]),
+                **self._generate_kwargs(len(frames), criteria)
+            )
+            generation = generation[:, input_len:]
+        generated = time.perf_counter()
+
+        decoded = self.processor.batch_decode(generation, skip_special_tokens=True)
+        if criteria is not None:
+            decoded = [criteria.trim(text) for text in decoded]
+        self._timings.value = _stage_timings(start, preprocessed, timer, generated, time.perf_counter())
+        return decoded
+
+    def describe_prompts(self, frames, prompts, max_new_tokens=16):
+        """
+        Ask several prompts about each frame: prompts is a list asked about every
+        frame, or one list per frame. All (frame, prompt) pairs are generated as one
+        batch, but every frame goes through the vision tower once, so the cost grows
+        with the number of prompts, not prompts x image encodings.
+        Returns one list of answers per frame, in prompt order.
+        """
+        prompt_lists = _prompt_lists(prompts, len(frames))
+        pairs = [(frame, prompt) for frame, frame_prompts in zip(frames, prompt_lists) for prompt in frame_prompts]
+        with self.image_features.share([len(frame_prompts) for frame_prompts in prompt_lists], frames):
+            answers = iter(self.describe_frames([frame for frame, _ in pairs], [prompt for _, prompt in pairs],
+                                                max_new_tokens))
+        return [[next(answers) for _ in frame_prompts] for frame_prompts in prompt_lists]
+
 #
 class QwenImageDescriber():
-    def __init__(self, model_id="Qwen/Qwen2.5-VL-7B-Instruct", device="cuda:0"):
+    def __init__(self, model_id="Qwen/Qwen2.5-VL-7B-Instruct", device="cuda:0", fast_preprocess=True,
+                 stop_on=(), max_words=None, decoding='greedy', draft_model_id=None, num_assistant_tokens=8,
+                 embedding_cache_mb=0, embedding_cache_near=None):
         self.model_id = model_id
         self.device = device
+        self.stop_on = tuple(stop_on or ())
+        self.max_words = max_words
+        self.decoding = decoding
+        self.num_assistant_tokens = num_assistant_tokens
         
         # Load processor and model
         #self.model = AutoModelForImageTextToText.from_pretrained(
@@ -78,42 +582,122 @@ class QwenImageDescriber():
         self.model.generation_config.image_token_id = pad_id
         self.model.generation_config.video_token_id = eos_id
 
-    def describe_frame(self, image_path, prompt=None, max_new_tokens=16):
+        self.preprocessor = None
+        if fast_preprocess:
+            self.preprocessor = FramePreprocessor(self.processor, self.model.device, self.model.dtype,
+                                                  self.build_messages, add_generation_prompt=False)
+
+        # a text-only draft would be handed the pixel values and M-RoPE position ids by generate()
+        if decoding == 'assisted':
+            raise ValueError("assisted decoding with a draft model is only supported for Gemma3, use decoding='prompt_lookup'")
+
+        self.embedding_cache = (EmbeddingCache(int(embedding_cache_mb * 2**20), near_duplicates=embedding_cache_near)
+                                if embedding_cache_mb else None)
+        self.image_features = SharedImageFeatures(self.model, self.embedding_cache)
+
+        self._timings = threading.local()
+
+    @property
+    def last_timings(self):
+        """Stage timings (seconds) of the most recent describe call made from this thread."""
+        return getattr(self._timings, "value", {})
+
+    def build_messages(self, image, prompt):
         system_prompt = "You are an open vocabulary detection agent. Output within 10 words. Do not provide additional explanations. "
-        if prompt is None:
-            prompt = "Describe the image precisely"
-        messages = [
+        return [
             {
                 "role": "user",
                 "content": [
                     {
                         "type": "image",
-                        "image": image_path,
+                        "image": image,
                     },
                     {"type": "text", "text": system_prompt+prompt},
                 ],
             }
         ]
 
+    @staticmethod
+    def _strip_criterion(output_text):
+        if "addCriterion" in output_text:
+            return output_text.split("addCriterion")[1]
+        return output_text
+
+    def describe_frame(self, image_path, prompt=None, max_new_tokens=16, on_token=None):
+        if isinstance(prompt, (list, tuple)):
+            return self.describe_prompts([image_path], prompt, max_new_tokens)[0]
+        output_text = self.describe_frames([image_path], prompt, max_new_tokens, on_token=on_token)[0]
+        print(output_text)
+        return output_text
+
+    def describe_prompts(self, frames, prompts, max_new_tokens=16):
+        """
+        Ask several prompts about each frame, encoding every frame once
+        (see Gemma3ImageDescriber.describe_prompts). Returns one list of answers per frame.
+        """
+        prompt_lists = _prompt_lists(prompts, len(frames))
+        pairs = [(frame, prompt) for frame, frame_prompts in zip(frames, prompt_lists) for prompt in frame_prompts]
+        with self.image_features.share([len(frame_prompts) for frame_prompts in prompt_lists], frames):
+            answers = iter(self.describe_frames([frame for frame, _ in pairs], [prompt for _, prompt in pairs],
+                                                max_new_tokens))
+        return [[next(answers) for _ in frame_prompts] for frame_prompts in prompt_lists]
+
+    def describe_frames(self, frames, prompts=None, max_new_tokens=16, on_token=None):
+        """
+        Caption N frames with a single left-padded generate() call.
+        prompts can be one prompt shared by all frames, or a list with one per frame.
+        on_token streams the partial caption and is only supported for a single frame.
+        Returns the N captions in the same order as the frames.
+        """
+        if on_token is not None and len(frames) != 1:
+            raise ValueError("on_token streaming requires a single frame")
+
+        start = time.perf_counter()
+        prompts = _expand_prompts(prompts, len(frames), "Describe the image precisely")
+
         # Preparation for inference
-        inputs = self.processor.apply_chat_template(
-            messages,
-            tokenize=True,
-            return_dict=True,
-            return_tensors="pt"
-        )
-        inputs = inputs.to(self.model.device)
+        if self.preprocessor is not None and self.preprocessor.accepts(frames):
+            inputs = self.preprocessor(frames, prompts)
+        else:
+            messages = [self.build_messages(frame, prompt) for frame, prompt in zip(frames, prompts)]
+            inputs = self.processor.apply_chat_template(
+                messages,
+                tokenize=True,
+                padding=True,
+                return_dict=True,
+                return_tensors="pt"
+            )
+            inputs = inputs.to(self.model.device)
+        preprocessed = time.perf_counter()
+        timer = PrefillTimer()
+        streamer = None
+        if on_token is not None:
+            streamer = CaptionStreamer(self.processor.tokenizer, on_token, postprocess=self._strip_criterion)
+
+        criteria = None
+        generate_kwargs = _decoding_kwargs(self.decoding, len(frames), self.model, self.processor.tokenizer,
+                                           num_assistant_tokens=self.num_assistant_tokens,
+                                           max_length=inputs["input_ids"].shape[-1] + max_new_tokens)
+        if self.stop_on or self.max_words:
+            criteria = CaptionStoppingCriteria(self.processor.tokenizer, inputs["input_ids"].shape[-1],
+                                               self.stop_on, self.max_words)
+            generate_kwargs["stopping_criteria"] = StoppingCriteriaList([criteria])
 
         # Inference: Generation of the output
-        generated_ids = self.model.generate(**inputs, max_new_tokens=max_new_tokens)
+        with self.image_features.share([1] * len(frames), frames):
+            generated_ids = self.model.generate(**inputs, max_new_tokens=max_new_tokens,
+                                                logits_processor=LogitsProcessorList([timer]),
+                                                streamer=streamer, **generate_kwargs)
+        generated = time.perf_counter()
         generated_ids_trimmed = [
-            out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
+            out_ids[len(in_ids) :] for in_ids, out_ids in zip(inputs["input_ids"], generated_ids)
         ]
-        output_text = self.processor.batch_decode(
+        output_texts = self.processor.batch_decode(
             generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
-        )[0]
-        if "addCriterion" in output_text:
-            output_text = output_text.split("addCriterion")[1]
+        )
+        output_texts = [self._strip_criterion(output_text) for output_text in output_texts]
+        if criteria is not None:
+            output_texts = [criteria.trim(output_text) for output_text in output_texts]
         
-        print(output_text)
-        return output_text
\ No newline at end of file
+        self._timings.value = _stage_timings(start, preprocessed, timer, generated, time.perf_counter())
+        return output_texts
@@ -0,0 +1,374 @@
+#offline.py
+"""
+Offline captioning of video files as fast as the model allows.
+
+Unlike the live pipeline, no frame is skipped because the model is busy: a
+FrameReader thread decodes ahead (PyAV, or OpenCV without it), samples frames by
+stride, interval or explicit timestamps, and queues them; the main thread batches
+them into the describer while the next frames decode. Captions are written as a
+timeline keyed by media time (seconds from the start of the file).
+
+    python offline.py --source video.mp4 --interval 1.0 --batch_size 4 --output_file video.jsonl
+"""
+import os
+import math
+import time
+import queue
+import argparse
+import threading
+
+from utils.caption_writer import CaptionWriter
+from utils.metrics import Metrics
+
+TIMELINE_FIELDS = ["source", "media_time", "frame", "description"]
+
+
+def timeline_fields(prompt=None):
+    """Timeline columns: one answer column per prompt when several prompts are asked."""
+    if isinstance(prompt, (list, tuple)) and len(prompt) > 1:
+        return TIMELINE_FIELDS[:-1] + list(prompt)
+    return TIMELINE_FIELDS
+
+
+def single_prompt(prompts):
+    """--prompt values (nargs='+') as one prompt string, or the list when there are several."""
+    return prompts[0] if len(prompts) == 1 else list(prompts)
+
+# seek instead of decoding through gaps longer than this (seconds) when sampling explicit timestamps
+SEEK_GAP = 10.0
+
+
+class FrameReader(threading.Thread):
+    """
+    Decode-ahead thread. Puts (media_time, frame_index, frame) tuples of the sampled
+    frames (HxWx3 uint8 RGB numpy arrays) on self.queue, then None when done.
+    The queue is bounded, so decoding stays at most prefetch frames ahead of inference.
+
+    Parameters:
+
+      path (str) -- video file
+      stride (int) -- keep every stride-th decoded frame
+      interval (float) -- keep one frame every interval seconds of media time (overrides stride)
+      timestamps (list) -- keep the first frame at or after each of these media times (overrides both)
+      prefetch (int) -- sampled frames decoded ahead of inference
+      start, end (float) -- media time range to read, end excluded (so adjacent ranges don't overlap)
+    """
+    def __init__(self, path, stride=1, interval=None, timestamps=None, prefetch=16, start=0.0, end=None):
+        super().__init__(daemon=True)
+        self.path = path
+        self.stride = max(1, stride)
+        self.interval = interval
+        self.timestamps = sorted(timestamps) if timestamps else None
+        self.start_time = start or 0.0
+        self.end_time = end
+        self.queue = queue.Queue(maxsize=max(1, prefetch))
+
+        self.decoded = 0
+        self.selected = 0
+        self.media_time = 0.0   # media time of the last decoded frame
+        self.fps = None
+        self.error = None
+        self.running = True
+
+        # interval samples fall on multiples of interval, whatever the start, so time shards line up
+        self._next_time = math.ceil(self.start_time / interval) * interval if interval else self.start_time
+        self._targets = [t for t in (self.timestamps or []) if t >= self.start_time]
+
+    def stop(self):
+        self.running = False
+        while True:  # unblock a put() waiting on a full queue
+            try:
+                self.queue.get(block=False)
+            except queue.Empty:
+                break
+
+    def _select(self, media_time, index):
+        if media_time < self.start_time:
+            return False
+        if self.timestamps is not None:
+            if not self._targets or media_time < self._targets[0]:
+                return False
+            while self._targets and self._targets[0] <= media_time:
+                self._targets.pop(0)
+            return True
+        if self.interval:
+            if media_time < self._next_time:
+                return False
+            while self._next_time <= media_time:
+                self._next_time += self.interval
+            return True
+        return index % self.stride == 0
+
+    def _done(self, media_time):
+        if self.end_time is not None and media_time >= self.end_time:
+            return True
+        return self.timestamps is not None and not self._targets
+
+    def _seek_target(self, media_time):
+        # media time worth seeking to instead of decoding up to it, or None
+        if self._targets and self._targets[0] - media_time > SEEK_GAP:
+            return self._targets[0]
+        if self.start_time - media_time > SEEK_GAP:
+            return self.start_time
+        return None
+
+    def _emit(self, media_time, index, frame):
+        self.selected += 1
+        while self.running:
+            try:
+                self.queue.put((media_time, index, frame), timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _read_pyav(self):
+        import av
+        with av.open(self.path) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = 'AUTO'
+            self.fps = float(stream.average_rate or 0) or None
+
+            seek = self._seek_target(0.0)
+            while self.running:
+                if seek is not None:
+                    container.seek(int(seek / stream.time_base), stream=stream, backward=True)
+                restarted, seek = seek is not None, None
+
+                for frame in container.decode(stream):
+                    if not self.running:
+                        return
+                    if frame.pts is None:
+                        continue
+                    media_time = float(frame.pts * stream.time_base)
+                    index = int(round(media_time * self.fps)) if (restarted and self.fps) else self.decoded
+                    self.decoded += 1
+                    self.media_time = media_time
+                    if self._done(media_time):
+                        return
+                    if self._select(media_time, index):
+                        # only sampled frames are converted to RGB
+                        self._emit(media_time, index, frame.to_ndarray(format='rgb24'))
+                    seek = self._seek_target(media_time)
+                    if seek is not None:
+                        break
+                else:
+                    return
+
+    def _read_opencv(self):
+        import cv2
+        cap = cv2.VideoCapture(self.path)
+        if not cap.isOpened():
+            raise RuntimeError(f"Failed to open {self.path}")
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or None
+        try:
+            index = 0
+            while self.running:
+                seek = self._seek_target(self.media_time)
+                if seek is not None:
+                    cap.set(cv2.CAP_PROP_POS_MSEC, seek * 1000)
+                    index = int(round(seek * self.fps)) if self.fps else index
+                if not cap.grab():  # grab() without retrieve() skips the color conversion
+                    return
+                media_time = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+                self.decoded += 1
+                self.media_time = media_time
+                if self._done(media_time):
+                    return
+                if self._select(media_time, index):
+                    ok, frame = cap.retrieve()
+                    if ok:
+                        self._emit(media_time, index, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                index += 1
+        finally:
+            cap.release()
+
+    def run(self):
+        try:
+            try:
+                import av  # noqa: F401
+                self._read_pyav()
+            except ImportError:
+                self._read_opencv()
+        except Exception as e:
+            self.error = e
+            print(f"[FrameReader] Error decoding {self.path}: {e}")
+        finally:
+            self.running = False
+            self.queue.put(None)
+
+
+def run_offline(describer, path, prompt=None, max_tokens=16, batch_size=4,
+                caption_writer=None, metrics=None, **sampling):
+    """
+    Caption one video file. sampling is passed to FrameReader (stride, interval,
+    timestamps, prefetch, start, end). Entries go to caption_writer (if given).
+    With a list of prompts every frame gets one answer per prompt (describe_prompts),
+    written to one column per prompt (see timeline_fields).
+    Returns a report dict with frame counts, media duration and throughput.
+    """
+    prompts = prompt if isinstance(prompt, (list, tuple)) and len(prompt) > 1 else None
+    metrics = metrics or Metrics()
+    reader = FrameReader(path, **sampling)
+    start = time.perf_counter()
+    reader.start()
+
+    captioned = 0
+    finished = False
+    try:
+        while not finished:
+            batch = []
+            while len(batch) < batch_size:
+                item = reader.queue.get()
+                if item is None:
+                    finished = True
+                    break
+                batch.append(item)
+            if not batch:
+                break
+
+            frames = [frame for _, _, frame in batch]
+            if prompts is not None:
+                descriptions = describer.describe_prompts(frames, prompts, max_tokens)
+            else:
+                descriptions = describer.describe_frames(frames, prompt, max_tokens)
+            metrics.observe_all(getattr(describer, 'last_timings', {}))
+            metrics.record_captions(len(descriptions))
+            captioned += len(descriptions)
+
+            for (media_time, index, _), description in zip(batch, descriptions):
+                if caption_writer is not None:
+                    entry = {"source": path, "media_time": round(media_time, 3), "frame": index}
+                    if prompts is not None:
+                        entry.update(zip(prompts, description))
+                    else:
+                        entry["description"] = description
+                    caption_writer.write(entry)
+
+            elapsed = time.perf_counter() - start
+            print(f"[Offline] {os.path.basename(path)} t={batch[-1][0]:.1f}s captioned={captioned} "
+                  f"({captioned / elapsed:.2f} frames/s, decode {reader.decoded / elapsed:.1f} frames/s)")
+    finally:
+        reader.stop()
+        reader.join(timeout=5)
+
+    elapsed = time.perf_counter() - start
+    report = {
+        "source": path,
+        "frames_decoded": reader.decoded,
+        "frames_captioned": captioned,
+        "media_duration": reader.media_time,
+        "elapsed": elapsed,
+        "captioned_fps": captioned / elapsed if elapsed else 0.0,
+        "decode_fps": reader.decoded / elapsed if elapsed else 0.0,
+        "realtime_factor": reader.media_time / elapsed if elapsed else 0.0,
+        "error": str(reader.error) if reader.error else None,
+    }
+    print(f"[Offline] {path}: {captioned} frames captioned out of {reader.decoded} decoded "
+          f"({reader.media_time:.1f}s of video) in {elapsed:.1f}s -> {report['captioned_fps']:.2f} captioned frames/s, "
+          f"{report['realtime_factor']:.2f}x realtime")
+    return report
+
+
+def add_sampling_args(parser):
+    parser.add_argument("--stride", type=int, default=1, help="Caption every N-th decoded frame")
+    parser.add_argument("--interval", type=float, default=None, help="Caption one frame every N seconds of video (overrides --stride; live mode: period of --sampling interval)")
+    parser.add_argument("--timestamps", type=str, default=None, help="Comma separated media times (seconds) to caption (overrides --stride/--interval)")
+    parser.add_argument("--prefetch", type=int, default=16, help="Sampled frames decoded ahead of inference")
+    parser.add_argument("--start", type=float, default=0.0, help="Media time to start at (seconds)")
+    parser.add_argument("--end", type=float, default=None, help="Media time to stop at (seconds)")
+
+
+def sampling_kwargs(args):
+    timestamps = [float(t) for t in args.timestamps.split(',')] if args.timestamps else None
+    return dict(stride=args.stride, interval=args.interval, timestamps=timestamps,
+                prefetch=args.prefetch, start=args.start, end=args.end)
+
+
+def add_decoding_args(parser):
+    parser.add_argument("--stop_on", type=str, nargs="*", default=[], choices=["sentence", "newline"],
+                        help="End a caption early at the first sentence end and/or newline")
+    parser.add_argument("--max_words", type=int, default=None, help="End a caption early after this many words")
+    parser.add_argument("--decoding", type=str, default="greedy", choices=["greedy", "prompt_lookup", "assisted"],
+                        help="Speculative decoding for single frames: prompt-lookup, or a draft model (--draft_model_id, Gemma3 only)")
+    parser.add_argument("--draft_model_id", type=str, default=None, help="Small text model proposing tokens for --decoding assisted (e.g. google/gemma-3-1b-it)")
+    parser.add_argument("--num_assistant_tokens", type=int, default=8, help="Tokens proposed per step by --decoding prompt_lookup / assisted")
+    parser.add_argument("--embedding_cache_mb", type=float, default=0,
+                        help="Memory for cached vision encoder outputs, reused when the same frame is asked about again (0 disables)")
+    parser.add_argument("--embedding_cache_near", type=int, default=None,
+                        help="Also reuse the embeddings of a cached frame whose 16x16 difference hash is within this many bits (of 256); off by default")
+
+
+def decoding_kwargs(args):
+    return dict(stop_on=args.stop_on, max_words=args.max_words, decoding=args.decoding,
+                draft_model_id=args.draft_model_id, num_assistant_tokens=args.num_assistant_tokens,
+                embedding_cache_mb=args.embedding_cache_mb, embedding_cache_near=args.embedding_cache_near)
+
+
+def add_index_args(parser):
+    parser.add_argument("--caption_index", type=str, default=None,
+                        help="SQLite caption index (full-text + time) updated as captions are written, searched with caption_search.py")
+    parser.add_argument("--index_embedding_model", type=str, default=None,
+                        help="Also index caption embeddings of this text encoder (e.g. sentence-transformers/all-MiniLM-L6-v2) for caption_search.py --semantic")
+
+
+def open_caption_index(args):
+    """The CaptionIndex of --caption_index, None without it."""
+    if not args.caption_index:
+        return None
+    from utils.caption_index import CaptionIndex, TextEmbedder
+    embedder = TextEmbedder(args.index_embedding_model) if args.index_embedding_model else None
+    return CaptionIndex(args.caption_index, embedder)
+
+
+def load_describer(model_id, fast_preprocess=True, device="cuda:0", **options):
+    """options: describer decoding and embedding cache settings, see decoding_kwargs()."""
+    if "gemma" in model_id:
+        from model import Gemma3ImageDescriber
+        return Gemma3ImageDescriber(model_id=model_id, device=device, fast_preprocess=fast_preprocess, **options)
+    elif "Qwen" in model_id:
+        from model import QwenImageDescriber
+        return QwenImageDescriber(model_id=model_id, device=device, fast_preprocess=fast_preprocess, **options)
+    raise ValueError(f"Unsupported model {model_id}, use a Gemma3 or Qwen VLM")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Caption video files offline as fast as the model allows")
+    parser.add_argument("--source", type=str, nargs="+", required=True, help="Video file(s)")
+    parser.add_argument("--model_id", type=str, default="google/gemma-3-4b-it")
+    parser.add_argument("--prompt", type=str, nargs="+", default=["Describe the image precisely within 10 words."],
+                        help="Prompt(s); several prompts are all asked about every frame, one column each")
+    parser.add_argument("--max_tokens", type=int, default=16)
+    parser.add_argument("--batch_size", type=int, default=4, help="Frames per describer call")
+    parser.add_argument("--output_file", type=str, default="timeline.jsonl", help="Caption timeline (.jsonl or .csv)")
+    parser.add_argument("--no_fast_preprocess", dest="fast_preprocess", action="store_false")
+    add_sampling_args(parser)
+    add_decoding_args(parser)
+    add_index_args(parser)
+    args = parser.parse_args()
+
+    describer = load_describer(args.model_id, args.fast_preprocess, **decoding_kwargs(args))
+    prompt = single_prompt(args.prompt)
+    caption_index = open_caption_index(args)
+    caption_writer = CaptionWriter(args.output_file, fieldnames=timeline_fields(prompt), flush_every=32, flush_interval=2.0,
+                                   index=caption_index)
+    caption_writer.start()
+    metrics = Metrics()
+
+    try:
+        for path in args.source:
+            run_offline(describer, path, prompt, args.max_tokens, args.batch_size,
+                        caption_writer=caption_writer, metrics=metrics, **sampling_kwargs(args))
+    except KeyboardInterrupt:
+        print("\n[INFO] Interrupted by user")
+    finally:
+        caption_writer.close()
+        print(metrics.report())
+        if describer.embedding_cache is not None:
+            print(f"[Offline] Embedding cache: {describer.embedding_cache}")
+        if caption_index is not None:
+            print(f"[Offline] Caption index: {caption_index}")
+            caption_index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,461 @@
+#query_server.py
+"""
+Interactive query server: a small asyncio HTTP API, run from a daemon thread, to
+talk to the live agents while they caption.
+
+  GET  /captions  -- Server-Sent Events stream of every caption (event: caption),
+                     prompt change (event: prompt) and answered question (event: answer)
+  GET  /prompt    -- current prompt of every source
+  POST /prompt    -- {"prompt": "..." or [...], "source": optional} changes the captioning prompt
+  POST /ask       -- {"question": "..." or [...], "source": optional, and "time": capture time
+                     (seconds since the epoch, as in the caption file) or "ago": seconds back;
+                     neither asks about the latest frame}. Answers the question(s).
+  GET  /history   -- ?start=&end=&source= captions kept in the agent's frame history
+                     (start/end in seconds since the epoch, or "seconds" back from now)
+  POST /rerun     -- {"prompt": ..., "seconds": 30 (or "start"/"end"), "source", "max_frames"}
+                     captions the history frames of that time range again with another prompt
+
+Questions arriving while the model is busy are coalesced: the next model call
+answers all of them with one describe_prompts() batch, where questions about the
+same frame share its image encoding and duplicates are asked once. Model calls go
+through the agents' InferenceScheduler, so they take turns with the captioning.
+Every client address is rate limited; behind a reverse proxy listed in
+trusted_proxies, the X-Client-Id header it sets names the client instead.
+
+    curl -N http://127.0.0.1:8080/captions
+    curl -d '{"question": "Is anyone wearing a helmet?"}' http://127.0.0.1:8080/ask
+    curl -d '{"prompt": "Count the people."}' http://127.0.0.1:8080/prompt
+    curl -d '{"prompt": "Did a truck pass?", "seconds": 30}' http://127.0.0.1:8080/rerun
+"""
+import json
+import time
+import asyncio
+import threading
+from urllib.parse import parse_qs
+
+QUERY_STREAM_ID = "query_server"
+RERUN_STREAM_ID = "query_server/rerun"
+MAX_BODY = 64 * 1024
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 429: "Too Many Requests", 503: "Service Unavailable"}
+
+
+class RateLimiter:
+    """
+    Token bucket per client: rate requests per second on average, bursts of up to
+    burst requests.
+    """
+    def __init__(self, rate=2.0, burst=5):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}   # client -> (tokens, last update)
+
+    def allow(self, client):
+        """Returns (allowed, seconds until the next request would be allowed)."""
+        now = time.monotonic()
+        tokens, last = self.buckets.get(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if len(self.buckets) > 1024:
+            # forget clients whose bucket has refilled anyway
+            self.buckets = {key: value for key, value in self.buckets.items()
+                            if value[0] + (now - value[1]) * self.rate < self.burst}
+        if tokens < 1.0:
+            self.buckets[client] = (tokens, now)
+            return False, (1.0 - tokens) / self.rate
+        self.buckets[client] = (tokens - 1.0, now)
+        return True, 0.0
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class QueryServer:
+    """
+    Parameters:
+
+      agents (list) -- LiveVideoAgents to serve, keyed by their stream_id; the first is the default source
+      host (str), port (int) -- address to listen on (port 0 picks a free one)
+      rate (float), burst (int) -- per-client rate limit, see RateLimiter
+      trusted_proxies (list) -- peer addresses whose X-Client-Id header is trusted to name the client
+                                (others are limited by their address; the header is chosen by the client)
+      max_batch (int) -- questions answered by one model call at most
+      max_tokens (int) -- answer length (default: the first agent's max_tokens)
+      max_frames (int) -- frames captioned by one /rerun at most (longer ranges are thinned out)
+    """
+    def __init__(self, agents, host="127.0.0.1", port=8080, rate=2.0, burst=5, max_batch=8, max_tokens=None,
+                 max_frames=64, trusted_proxies=()):
+        self.agents = {agent.stream_id: agent for agent in agents}
+        self.default = agents[0]
+        self.describer = self.default.describer
+        self.scheduler = self.default.scheduler
+        self.host = host
+        self.port = port
+        self.limiter = RateLimiter(rate, burst)
+        self.trusted_proxies = set(trusted_proxies or ())
+        self.max_batch = max(1, max_batch)
+        self.max_tokens = max_tokens or self.default.max_tokens
+        self.max_frames = max_frames
+
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.started = threading.Event()
+        self.subscribers = set()   # asyncio.Queue per /captions client
+        self.questions = []        # (agent, frame_time, frame, question, future) waiting for the model
+        self.wakeup = None
+        self.rerun_lock = None
+
+        self.asked = 0
+        self.model_calls = 0
+        self.rate_limited = 0
+
+        self.scheduler.register(QUERY_STREAM_ID, on_drop=self._fail_batch)
+        self.scheduler.register(RERUN_STREAM_ID, on_drop=self._fail_rerun)
+        for agent in agents:
+            agent.add_listener(self._on_caption)
+
+    # ---- lifecycle (caller's thread) ----
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self.started.wait(timeout=10)
+        print(f"[QueryServer] Serving on http://{self.host}:{self.port} (/captions, /prompt, /ask, /history, /rerun)")
+        return self
+
+    def stop(self):
+        if self.loop is None or not self.loop.is_running():
+            return
+        self.loop.call_soon_threadsafe(self._shutdown)
+        self.thread.join(timeout=5)
+        print(f"[QueryServer] {self.asked} question(s) answered by {self.model_calls} model call(s), "
+              f"{self.rate_limited} request(s) rate limited")
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._serve())
+        except Exception as e:
+            print(f"[QueryServer] Failed: {e}")
+        finally:
+            self.started.set()
+            self.loop.close()
+
+    async def _serve(self):
+        self.wakeup = asyncio.Event()
+        self.rerun_lock = asyncio.Lock()
+        self.stopping = asyncio.Event()
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        worker = asyncio.ensure_future(self._answer_loop())
+        self.started.set()
+        await self.stopping.wait()
+        self.server.close()
+        worker.cancel()
+        for subscriber in list(self.subscribers):
+            self._put(subscriber, None)  # ends the event streams
+        await asyncio.sleep(0.1)
+
+    def _shutdown(self):
+        self.stopping.set()
+
+    # ---- captions (inference thread) ----
+
+    def _on_caption(self, entry):
+        if self.loop is not None and self.loop.is_running():
+            self._call(self._publish, "caption", dict(entry))
+
+    def _publish(self, event, data):
+        message = f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode()
+        for subscriber in self.subscribers:
+            self._put(subscriber, message)
+
+    @staticmethod
+    def _put(subscriber, message):
+        if subscriber.full():
+            subscriber.get_nowait()  # slow client: drop its oldest message
+        subscriber.put_nowait(message)
+
+    def _call(self, callback, *args):
+        """Run callback on the event loop, from another thread. False once the server is gone."""
+        try:
+            self.loop.call_soon_threadsafe(callback, *args)
+            return True
+        except RuntimeError:  # loop closed
+            return False
+
+    # ---- questions ----
+
+    async def _answer_loop(self):
+        """Answer the waiting questions, one model call at a time."""
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            while self.questions:
+                batch, self.questions = self.questions[:self.max_batch], self.questions[self.max_batch:]
+                done = self.loop.create_future()
+                if not self.scheduler.submit(QUERY_STREAM_ID, self._answer_batch, batch, done):
+                    continue  # dropped, _fail_batch has failed the questions
+                await asyncio.wait([done])
+
+    def _answer_batch(self, batch, done):
+        """
+        Runs on a scheduler worker. Questions about the same frame (same source and
+        capture time) are grouped, and repeated questions asked once.
+        """
+        try:
+            groups = {}
+            for agent, frame_time, frame, question, future in batch:
+                frame_group = groups.setdefault((agent.stream_id, frame_time), (frame, []))
+                if question not in frame_group[1]:
+                    frame_group[1].append(question)
+            keys = list(groups)
+            results = self.describer.describe_prompts([groups[key][0] for key in keys],
+                                                      [groups[key][1] for key in keys], self.max_tokens)
+            self.model_calls += 1
+            answers = {(key, question): answer
+                       for key, answers in zip(keys, results)
+                       for question, answer in zip(groups[key][1], answers)}
+            outcome = [(future, answers[((agent.stream_id, frame_time), question)], None)
+                       for agent, frame_time, frame, question, future in batch]
+        except Exception as e:
+            print(f"[QueryServer] Failed to answer {len(batch)} question(s): {e}")
+            outcome = [(future, None, e) for *_, future in batch]
+        self._call(self._resolve, outcome, done)
+
+    def _fail_batch(self, batch, done):
+        error = RuntimeError("inference is not running")
+        self._call(self._resolve, [(future, None, error) for *_, future in batch], done)
+
+    @staticmethod
+    def _resolve(outcome, done):
+        for future, answer, error in outcome:
+            if future.done():
+                continue  # client went away
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(answer)
+        if not done.done():
+            done.set_result(None)
+
+    async def ask(self, agent, question, timestamp=None):
+        """Answer a question about the agent's frame closest to timestamp (default: the latest)."""
+        frame_time, frame = agent.frame_at(timestamp)
+        if frame is None:
+            raise HTTPError(503, "no frame captured yet")
+        future = self.loop.create_future()
+        self.questions.append((agent, frame_time, frame, question, future))
+        self.wakeup.set()
+        answer = await future
+        self.asked += 1
+        return frame_time, answer
+
+    async def rerun(self, agent, prompt, start=None, end=None, limit=None):
+        """
+        Caption the agent's history frames between start and end again with prompt,
+        one batch_size job at a time, so captioning keeps its turns in between.
+        One rerun runs at a time.
+        """
+        if agent.history is None:
+            raise HTTPError(400, "this source keeps no frame history")
+        frames = agent.history.frames(start, end, limit=min(limit or self.max_frames, self.max_frames))
+        entries = []
+        async with self.rerun_lock:
+            for i in range(0, len(frames), agent.batch_size):
+                done = self.loop.create_future()
+                self.scheduler.submit(RERUN_STREAM_ID, self._rerun_batch, agent, prompt,
+                                      frames[i:i + agent.batch_size], done)
+                batch = await done
+                entries.extend(batch)
+                for entry in batch:
+                    self._publish("rerun", entry)
+        return entries
+
+    def _rerun_batch(self, agent, prompt, frames, done):
+        try:
+            self._call(self._settle, done, agent.rerun(prompt, frames=frames, max_tokens=self.max_tokens), None)
+            self.model_calls += 1
+        except Exception as e:
+            self._call(self._settle, done, None, e)
+
+    def _fail_rerun(self, agent, prompt, frames, done):
+        self._call(self._settle, done, None, RuntimeError("inference is not running"))
+
+    @staticmethod
+    def _settle(future, result, error):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    # ---- HTTP ----
+
+    @staticmethod
+    def _time_range(body):
+        """start, end (seconds since the epoch) from start/end, or the last 'seconds'."""
+        try:
+            if body.get("seconds") is not None:
+                return time.time() - float(body["seconds"]), None
+            start, end = body.get("start"), body.get("end")
+            return (float(start) if start is not None else None), (float(end) if end is not None else None)
+        except (TypeError, ValueError):
+            raise HTTPError(400, "start, end and seconds must be numbers")
+
+    def _agent(self, body):
+        source = body.get("source")
+        if source is None:
+            return self.default
+        if source not in self.agents:
+            raise HTTPError(404, f"unknown source {source}, one of {list(self.agents)}")
+        return self.agents[source]
+
+    async def _route(self, method, path, body):
+        if path == "/prompt":
+            if method == "GET":
+                return {"prompt": {stream_id: agent.prompt for stream_id, agent in self.agents.items()}}
+            if method != "POST":
+                raise HTTPError(405, "use GET or POST")
+            agents = list(self.agents.values()) if body.get("source") is None else [self._agent(body)]
+            try:
+                for agent in agents:
+                    agent.set_prompt(body.get("prompt"))
+            except ValueError as e:
+                raise HTTPError(400, str(e))
+            self._publish("prompt", {"prompt": body.get("prompt"), "sources": [agent.stream_id for agent in agents]})
+            return {"prompt": {agent.stream_id: agent.prompt for agent in agents}}
+
+        if path == "/ask":
+            if method != "POST":
+                raise HTTPError(405, "use POST")
+            questions = body.get("question")
+            if not questions or not isinstance(questions, (str, list)):
+                raise HTTPError(400, "question must be a string or a list of strings")
+            agent = self._agent(body)
+            timestamp = float(body["time"]) if body.get("time") is not None else None
+            if timestamp is None and body.get("ago") is not None:
+                timestamp = time.time() - float(body["ago"])
+            start = time.perf_counter()
+            single = isinstance(questions, str)
+            replies = await asyncio.gather(*(self.ask(agent, question, timestamp)
+                                             for question in ([questions] if single else questions)))
+            answers = [answer for _, answer in replies]
+            result = {"source": agent.stream_id, "frame_time": replies[0][0],
+                      "question": questions, "answer": answers[0] if single else answers,
+                      "latency": time.perf_counter() - start}
+            self._publish("answer", result)
+            return result
+
+        if path == "/history":
+            if method != "GET":
+                raise HTTPError(405, "use GET")
+            agent = self._agent(body)
+            if agent.history is None:
+                raise HTTPError(400, "this source keeps no frame history")
+            start, end = self._time_range(body)
+            return {"source": agent.stream_id, "captions": agent.history.captions_between(start, end)}
+
+        if path == "/rerun":
+            if method != "POST":
+                raise HTTPError(405, "use POST")
+            prompt = body.get("prompt")
+            if not prompt or not isinstance(prompt, (str, list)):
+                raise HTTPError(400, "prompt must be a string or a list of strings")
+            agent = self._agent(body)
+            start, end = self._time_range(body)
+            try:
+                limit = int(body["max_frames"]) if body.get("max_frames") is not None else None
+            except (TypeError, ValueError):
+                raise HTTPError(400, "max_frames must be a number")
+            begin = time.perf_counter()
+            entries = await self.rerun(agent, prompt, start, end, limit)
+            return {"source": agent.stream_id, "prompt": prompt, "captions": entries,
+                    "latency": time.perf_counter() - begin}
+
+        raise HTTPError(404, f"no route {path}")
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            method, path, _ = request.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            path, _, query = path.partition("?")
+
+            client = (writer.get_extra_info("peername") or ("?",))[0]
+            if client in self.trusted_proxies and headers.get("x-client-id"):
+                client = "id:" + headers["x-client-id"]
+            allowed, retry_after = self.limiter.allow(client)
+            if not allowed:
+                self.rate_limited += 1
+                raise HTTPError(429, "rate limit exceeded", {"Retry-After": f"{retry_after:.0f}" if retry_after >= 1 else "1"})
+
+            if method == "GET" and path == "/captions":
+                await self._stream(writer)
+                return
+
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY:
+                raise HTTPError(413, "request body too large")
+            body = {name: values[-1] for name, values in parse_qs(query).items()}
+            if length:
+                try:
+                    body = json.loads(await reader.readexactly(length))
+                except ValueError:
+                    raise HTTPError(400, "body must be JSON")
+                if not isinstance(body, dict):
+                    raise HTTPError(400, "body must be a JSON object")
+            self._respond(writer, 200, await self._route(method, path, body))
+        except HTTPError as e:
+            self._respond(writer, e.status, {"error": str(e)}, e.headers)
+        except (ValueError, asyncio.IncompleteReadError):
+            self._respond(writer, 400, {"error": "malformed request"})
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            print(f"[QueryServer] Request failed: {e}")
+            self._respond(writer, 503, {"error": str(e)})
+        finally:
+            try:
+                await writer.drain()
+                writer.close()
+            except (ConnectionError, RuntimeError):
+                pass
+
+    @staticmethod
+    def _respond(writer, status, data, headers=None):
+        body = json.dumps(data, default=str).encode()
+        head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", "Content-Type: application/json",
+                f"Content-Length: {len(body)}", "Connection: close"]
+        head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+
+    async def _stream(self, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                     b"Connection: keep-alive\r\n\r\n")
+        subscriber = asyncio.Queue(maxsize=64)
+        self.subscribers.add(subscriber)
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.get(), timeout=15.0)
+                except asyncio.TimeoutError:
+                    message = b": keep-alive\n\n"
+                if message is None:
+                    break
+                writer.write(message)
+                await writer.drain()
+        finally:
+            self.subscribers.discard(subscriber)
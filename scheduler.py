@@ -0,0 +1,175 @@
+#scheduler.py
+import time
+import threading
+import traceback
+
+BACKPRESSURE_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+class InferenceScheduler:
+    """
+    Long-lived inference worker(s) shared by one or more video streams.
+
+    Every stream owns a single latest-frame slot. What happens when a new job
+    arrives while the stream's slot is still occupied depends on the policy:
+
+      * drop_oldest -- the waiting job is replaced by the new one (freshest frame wins)
+      * drop_newest -- the new job is discarded and the waiting one is kept
+      * block       -- submit() waits until a worker has taken the waiting job
+
+    Workers serve the streams round-robin so a fast camera can't starve the others.
+    A job is popped by exactly one worker, and a stream never has more than one job
+    running at a time, so each inference has a single owner. Jobs that are discarded
+    instead (by the policy or by stop()) are passed to the stream's on_drop(*args),
+    e.g. to release the frame buffers they hold.
+    """
+    def __init__(self, num_workers=1, policy='drop_oldest'):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"policy should be one of {BACKPRESSURE_POLICIES}, got {policy}")
+
+        self.num_workers = max(1, num_workers)
+        self.policy = policy
+
+        self.stream_ids = []   # round-robin order (registration order)
+        self.pending = {}      # stream_id -> (handler, args, submit time)
+        self.active = set()    # stream_ids currently being served
+        self.served = {}       # stream_id -> number of jobs run
+        self.dropped = {}      # stream_id -> number of jobs discarded by the backpressure policy
+        self.last_wait = {}    # stream_id -> queueing delay (seconds) of the most recent job
+        self.total_wait = {}   # stream_id -> summed queueing delay
+        self.max_wait = {}     # stream_id -> worst queueing delay
+        self.on_drop = {}      # stream_id -> callback(*args) for discarded jobs
+        self.next_index = 0
+
+        self.cond = threading.Condition()
+        self.running = False
+        self.threads = []
+
+    def register(self, stream_id, on_drop=None):
+        with self.cond:
+            self.on_drop[stream_id] = on_drop
+            if stream_id not in self.stream_ids:
+                self.stream_ids.append(stream_id)
+                self.served[stream_id] = 0
+                self.dropped[stream_id] = 0
+                self.last_wait[stream_id] = 0.0
+                self.total_wait[stream_id] = 0.0
+                self.max_wait[stream_id] = 0.0
+
+    def submit(self, stream_id, handler, *args):
+        """
+        Put handler(*args) in the stream's slot, applying the backpressure policy
+        if the slot is occupied. Returns True if the job was accepted.
+        Jobs submitted while the scheduler isn't running are dropped.
+        """
+        accepted = True
+        dropped = None
+        with self.cond:
+            if stream_id not in self.served:
+                raise KeyError(f"stream {stream_id} was not registered with the scheduler")
+
+            if stream_id in self.pending:
+                if self.policy == 'drop_newest':
+                    self.dropped[stream_id] += 1
+                    accepted = False
+                elif self.policy == 'block':
+                    while stream_id in self.pending and self.running:
+                        self.cond.wait()
+                else:
+                    self.dropped[stream_id] += 1
+                    dropped = self.pending.pop(stream_id)[1]
+
+            if not self.running:
+                accepted = False
+
+            if accepted:
+                self.pending[stream_id] = (handler, args, time.perf_counter())
+                self.cond.notify_all()
+
+        if dropped is not None:
+            self._drop(stream_id, dropped)
+        if not accepted:
+            self._drop(stream_id, args)
+        return accepted
+
+    def _drop(self, stream_id, args):
+        on_drop = self.on_drop.get(stream_id)
+        if on_drop is not None:
+            try:
+                on_drop(*args)
+            except Exception as e:
+                print(f"[InferenceScheduler] Error in on_drop for {stream_id}: {e}")
+
+    def is_busy(self, stream_id):
+        """True if the stream has a job waiting or running."""
+        with self.cond:
+            return stream_id in self.pending or stream_id in self.active
+
+    def _next_job(self):
+        # caller holds self.cond
+        for offset in range(len(self.stream_ids)):
+            index = (self.next_index + offset) % len(self.stream_ids)
+            stream_id = self.stream_ids[index]
+            if stream_id in self.pending and stream_id not in self.active:
+                self.next_index = index + 1
+                return stream_id, self.pending.pop(stream_id)
+        return None, None
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                stream_id, job = self._next_job()
+                while job is None and self.running:
+                    self.cond.wait()
+                    stream_id, job = self._next_job()
+                if job is None:
+                    return
+
+                handler, args, submitted = job
+                wait = time.perf_counter() - submitted
+                self.active.add(stream_id)
+                self.last_wait[stream_id] = wait
+                self.total_wait[stream_id] += wait
+                self.max_wait[stream_id] = max(self.max_wait[stream_id], wait)
+                self.cond.notify_all()  # wake submitters blocked on this slot
+
+            try:
+                handler(*args)
+            except Exception as e:
+                print(f"[InferenceScheduler] Error serving {stream_id}: {e}")
+                traceback.print_exc()
+            finally:
+                with self.cond:
+                    self.active.discard(stream_id)
+                    self.served[stream_id] += 1
+                    self.cond.notify_all()
+
+    def start(self):
+        with self.cond:
+            if self.running:
+                return self
+            self.running = True
+        self.threads = [
+            threading.Thread(target=self._worker, daemon=True)
+            for _ in range(self.num_workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        with self.cond:
+            if not self.running:
+                return
+            self.running = False
+            pending, self.pending = self.pending, {}
+            self.cond.notify_all()
+        for stream_id, (handler, args, submitted) in pending.items():
+            self._drop(stream_id, args)
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=1)
+        for stream_id in self.stream_ids:
+            served = self.served[stream_id]
+            mean_wait = self.total_wait[stream_id] / served if served else 0.0
+            print(f"[InferenceScheduler] {stream_id}: served={served} dropped={self.dropped[stream_id]} "
+                  f"queue_wait mean={mean_wait*1000:.1f}ms max={self.max_wait[stream_id]*1000:.1f}ms")
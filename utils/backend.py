@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Frame backends: where frames are captured, copied, annotated and synchronized.
+
+  * jetson -- jetson_utils (videoSource, cudaMemcpy, cudaFont), frames are cudaImage
+  * cpu    -- OpenCV (or PyAV) capture, NumPy copies and OpenCV/PIL text, frames are np.ndarray
+
+The backend is chosen once at startup with set_backend() ('auto' picks jetson when
+jetson_utils is importable), and everything else asks get_backend() at runtime, so
+importing the modules never imports jetson_utils or initializes CUDA by itself.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+BACKENDS = ('auto', 'jetson', 'cpu')
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def set_backend(name='auto'):
+    """
+    Select the frame backend ('auto', 'jetson' or 'cpu') and return it.
+    """
+    global _backend
+
+    if name not in BACKENDS:
+        raise ValueError(f"backend should be one of {BACKENDS}, got {name}")
+
+    if name == 'auto':
+        try:
+            import jetson_utils  # noqa: F401
+            name = 'jetson'
+        except ImportError:
+            name = 'cpu'
+
+    with _backend_lock:
+        _backend = JetsonBackend() if name == 'jetson' else CPUBackend()
+
+    logging.info(f"[Backend] Using {_backend.name} backend")
+    return _backend
+
+
+def get_backend():
+    """
+    Return the active backend, selecting one automatically on first use.
+    """
+    if _backend is None:
+        return set_backend('auto')
+    return _backend
+
+
+class JetsonBackend:
+    """
+    jetson_utils backend: CUDA mapped-memory frames, GPU copies and cudaFont overlays.
+    """
+    name = 'jetson'
+
+    def __init__(self):
+        import jetson_utils
+        self.jetson_utils = jetson_utils
+
+    def video_source(self, uri, options=None):
+        options = dict(options or {})
+        options.pop('keyframes', None)  # jetson_utils doesn't report keyframes
+        return self.jetson_utils.videoSource(uri, options=options)
+
+    def copy(self, frame):
+        return self.jetson_utils.cudaMemcpy(frame)
+
+    def alloc_like(self, frame):
+        return self.jetson_utils.cudaAllocMapped(width=frame.width, height=frame.height, format=frame.format)
+
+    def copy_into(self, dst, src):
+        self.jetson_utils.cudaMemcpy(dst, src)
+
+    def to_numpy(self, frame):
+        from utils.utils import cudaToNumpy
+        return cudaToNumpy(frame)
+
+    def font(self):
+        return self.jetson_utils.cudaFont()
+
+    def synchronize(self):
+        self.jetson_utils.cudaDeviceSynchronize()
+
+
+class CPUBackend:
+    """
+    CPU backend: frames are HxWx3 uint8 RGB numpy arrays.
+    """
+    name = 'cpu'
+
+    def video_source(self, uri, options=None):
+        if (options or {}).get('keyframes') and not uri.startswith('/dev/video'):
+            # only the PyAV decoder reports which frames are keyframes
+            try:
+                return PyAVVideoSource(uri, options)
+            except ImportError:
+                pass
+        try:
+            import cv2  # noqa: F401
+            return OpenCVVideoSource(uri, options)
+        except ImportError:
+            return PyAVVideoSource(uri, options)
+
+    def copy(self, frame):
+        return np.array(frame, copy=True)
+
+    def alloc_like(self, frame):
+        return np.empty_like(frame)
+
+    def copy_into(self, dst, src):
+        np.copyto(dst, src)
+
+    def to_numpy(self, frame):
+        return np.asarray(frame)
+
+    def font(self):
+        return CPUFont()
+
+    def synchronize(self):
+        pass
+
+
+class OpenCVVideoSource:
+    """
+    cv2.VideoCapture wrapper with the subset of the jetson_utils.videoSource API used here.
+    Accepts V4L2 devices (/dev/video0), files and network streams (rtsp://, http://).
+    """
+    def __init__(self, uri, options=None):
+        import cv2
+        self.cv2 = cv2
+        options = options or {}
+
+        if uri.startswith('/dev/video') and uri[len('/dev/video'):].isdigit():
+            self.cap = cv2.VideoCapture(int(uri[len('/dev/video'):]))
+        else:
+            self.cap = cv2.VideoCapture(uri)
+
+        if not self.cap.isOpened():
+            raise RuntimeError(f"[OpenCVVideoSource] Failed to open {uri}")
+
+        if options.get('width'):
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, options['width'])
+        if options.get('height'):
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, options['height'])
+        if options.get('framerate'):
+            self.cap.set(cv2.CAP_PROP_FPS, options['framerate'])
+
+    def Capture(self, format='rgb8', timeout=1000):
+        ok, frame = self.cap.read()
+        if not ok:
+            return None
+        return self.cv2.cvtColor(frame, self.cv2.COLOR_BGR2RGB)
+
+    def GetFrameRate(self):
+        return self.cap.get(self.cv2.CAP_PROP_FPS)
+
+    def IsStreaming(self):
+        return self.cap.isOpened()
+
+    def Close(self):
+        self.cap.release()
+
+
+class PyAVVideoSource:
+    """
+    PyAV (FFmpeg) decoder with the subset of the jetson_utils.videoSource API used here.
+    key_frame tells whether the last captured frame was a codec keyframe.
+    """
+    def __init__(self, uri, options=None):
+        import av
+        self.container = av.open(uri)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = 'AUTO'
+        self.frames = self.container.decode(self.stream)
+        self.key_frame = None
+
+    def Capture(self, format='rgb8', timeout=1000):
+        try:
+            frame = next(self.frames)
+        except StopIteration:
+            return None
+        self.key_frame = bool(frame.key_frame)
+        return frame.to_ndarray(format='rgb24')
+
+    def GetFrameRate(self):
+        return float(self.stream.average_rate or 0)
+
+    def IsStreaming(self):
+        return True
+
+    def Close(self):
+        self.container.close()
+
+
+class CPUFont:
+    """
+    Text overlay on numpy frames with the cudaFont interface (OverlayText, colors as RGBA tuples),
+    so utils.image.wrap_text works unchanged on the CPU backend.
+
+    OverlayLines() rasterizes a block of lines once into a premultiplied RGB + alpha bitmap,
+    cached by its text and colors, so redrawing the same caption on every frame is a single
+    alpha blend of the block region.
+    """
+    White = (255, 255, 255, 255)
+    Black = (0, 0, 0, 255)
+    Gray40 = (40, 40, 40, 180)
+
+    def __init__(self, size=32, cache_size=16):
+        self.size = size
+        try:
+            import cv2
+            self.cv2 = cv2
+            self.scale = size / 32.0 * 0.9
+        except ImportError:
+            self.cv2 = None
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # (lines, color, background, line_spacing, padding) -> overlay bitmap
+        self.rasterized = 0
+
+    def TextExtents(self, text):
+        """Returns (width, height) of the rendered text in pixels."""
+        if self.cv2 is not None:
+            (width, height), baseline = self.cv2.getTextSize(text, self.cv2.FONT_HERSHEY_SIMPLEX, self.scale, 2)
+            return width, height + baseline
+        return int(len(text) * self.size * 0.55), self.size
+
+    def OverlayText(self, image, text='', x=5, y=5, color=White, background=None, padding=5):
+        """
+        Draw text with its top-left corner at (x, y), optionally over an alpha-blended background box.
+        """
+        return self.OverlayLines(image, (text,), x=x, y=y, color=color, background=background, padding=padding)
+
+    def OverlayLines(self, image, lines, x=5, y=5, color=White, background=None, line_spacing=38, padding=5):
+        """
+        Draw lines of text starting at (x, y), line_spacing pixels apart, each optionally over
+        an alpha-blended background box. Returns the y-coordinate below the last line.
+        """
+        lines = tuple(lines)
+        if not lines:
+            return y
+
+        key = (lines, tuple(color), tuple(background) if background is not None else None, line_spacing, padding)
+        overlay = self.cache.get(key)
+        if overlay is None:
+            overlay = self._rasterize(*key)
+            self.cache[key] = overlay
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(key)
+
+        self._composite(image, overlay, x - padding, y - padding)
+        return y + len(lines) * line_spacing
+
+    def _text_mask(self, text, width, height):
+        # antialiased coverage (0-255) of the text, top-left aligned in a width x height box
+        if self.cv2 is not None:
+            mask = np.zeros((height, width), dtype=np.uint8)
+            text_height = self.TextExtents(text)[1]
+            self.cv2.putText(mask, text, (0, text_height - text_height // 4), self.cv2.FONT_HERSHEY_SIMPLEX,
+                             self.scale, 255, 2, self.cv2.LINE_AA)
+            return mask
+        from PIL import Image, ImageDraw
+        mask = Image.new('L', (width, height), 0)
+        ImageDraw.Draw(mask).text((0, 0), text, fill=255)
+        return np.asarray(mask)
+
+    def _rasterize(self, lines, color, background, line_spacing, padding):
+        """
+        Render the lines into (premultiplied RGB, alpha), both uint16 HxWx1/HxWx3 arrays
+        whose top-left corner corresponds to (x - padding, y - padding).
+        """
+        extents = [self.TextExtents(line) for line in lines]
+        width = max(w for w, _ in extents) + 2 * padding
+        height = (len(lines) - 1) * line_spacing + extents[-1][1] + 2 * padding
+
+        rgb = np.zeros((height, width, 3), dtype=np.float32)
+        alpha = np.zeros((height, width, 1), dtype=np.float32)
+        text_rgb = np.array(color[:3], dtype=np.float32)
+        text_alpha = (color[3] if len(color) > 3 else 255) / 255.0
+
+        for n, (line, (w, h)) in enumerate(zip(lines, extents)):
+            top = n * line_spacing
+            box = (slice(top, top + h + 2 * padding), slice(0, w + 2 * padding))
+            if background is not None:
+                box_alpha = (background[3] if len(background) > 3 else 255) / 255.0
+                rgb[box] = np.array(background[:3], dtype=np.float32)
+                alpha[box] = box_alpha
+
+            coverage = np.zeros((height, width, 1), dtype=np.float32)
+            coverage[top + padding:top + padding + h, padding:padding + w, 0] = self._text_mask(line, w, h) / 255.0
+            coverage *= text_alpha
+            rgb = text_rgb * coverage + rgb * (1.0 - coverage)
+            alpha = coverage + alpha * (1.0 - coverage)
+
+        self.rasterized += 1
+        premultiplied = np.rint(rgb * alpha).astype(np.uint16)
+        return premultiplied, np.rint(alpha * 255).astype(np.uint16)
+
+    @staticmethod
+    def _composite(image, overlay, x, y):
+        # image = image * (1 - alpha) + premultiplied, clipped to the image bounds
+        premultiplied, alpha = overlay
+        height, width = alpha.shape[:2]
+        img_h, img_w = image.shape[:2]
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(img_w, x + width), min(img_h, y + height)
+        if x1 <= x0 or y1 <= y0:
+            return
+
+        src = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+        region = image[y0:y1, x0:x1, :3]
+        a = alpha[src]
+        blended = (region.astype(np.uint16) * (255 - a) + 127) // 255 + premultiplied[src]
+        np.copyto(region, np.minimum(blended, 255).astype(image.dtype))
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from utils.scene import difference_hash
+
+
+class CaptionCache:
+    """
+    LRU cache of captions keyed by (perceptual frame hash, prompt, max_tokens, model_id),
+    so recurring views (PTZ patrol loops, looped test files) skip the VLM entirely.
+
+    Parameters:
+
+      max_size (int) -- maximum number of captions kept, least recently used are evicted
+      ttl (float) -- seconds before an entry expires (None keeps entries until evicted)
+      path (str) -- optional JSON file the cache is loaded from and saved to, so it survives restarts
+    """
+    def __init__(self, max_size=1024, ttl=None, path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.entries = OrderedDict()   # key -> (caption, created timestamp)
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.path and os.path.isfile(self.path):
+            self.load()
+
+    @staticmethod
+    def key(image, prompt, max_tokens, model_id):
+        return (difference_hash(image), prompt, max_tokens, model_id)
+
+    def get(self, key):
+        """
+        Return the cached caption for key, or None on a miss.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[1] > self.ttl:
+                del self.entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, caption, timestamp=None):
+        with self.lock:
+            self.entries[key] = (caption, timestamp or time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def load(self):
+        """
+        Load entries from self.path, skipping any that have already expired.
+        """
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                records = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"[CaptionCache] Failed to load {self.path}: {e}")
+            return
+
+        now = time.time()
+        for record in records[-self.max_size:]:
+            if self.ttl is not None and now - record["timestamp"] > self.ttl:
+                continue
+            key = (record["hash"], record["prompt"], record["max_tokens"], record["model_id"])
+            self.put(key, record["caption"], record["timestamp"])
+
+        logging.info(f"[CaptionCache] Loaded {len(self.entries)} captions from {self.path}")
+
+    def save(self):
+        """
+        Write entries to self.path (least recently used first), replacing the file atomically.
+        """
+        if not self.path:
+            return
+
+        with self.lock:
+            records = [
+                {"hash": key[0], "prompt": key[1], "max_tokens": key[2], "model_id": key[3],
+                 "caption": caption, "timestamp": timestamp}
+                for key, (caption, timestamp) in self.entries.items()
+            ]
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(records, f)
+        os.replace(tmp_path, self.path)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return (f"size={len(self.entries)}/{self.max_size} hits={self.hits} misses={self.misses} "
+                f"hit_rate={self.hit_rate:.1%} evictions={self.evictions}")
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+import json
+import sqlite3
+import logging
+import threading
+
+import numpy as np
+
+# entry keys that aren't caption text (the rest of a multi-prompt entry are the answers, keyed by prompt)
+METADATA_FIELDS = ("timeframe", "source", "media_time", "frame", "prompt",
+                   "inference_time", "queue_wait", "batch_size")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captions (id INTEGER PRIMARY KEY, time REAL, source TEXT, text TEXT, entry TEXT);
+CREATE INDEX IF NOT EXISTS captions_time ON captions(time);
+CREATE TABLE IF NOT EXISTS segments (id INTEGER PRIMARY KEY, level INTEGER, ids BLOB, vectors BLOB);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def caption_text(entry):
+    """The searchable text of a caption entry: its description, or its answers joined with ' | '."""
+    if "description" in entry:
+        return str(entry["description"] or "")
+    return " | ".join(str(value) for key, value in entry.items()
+                      if key not in METADATA_FIELDS and isinstance(value, str))
+
+
+def fts_query(text):
+    """Every word of text as a quoted FTS5 term (all must match), so punctuation isn't parsed as syntax."""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+class TextEmbedder:
+    """
+    Sentence embeddings from a Hugging Face encoder (e.g. sentence-transformers/all-MiniLM-L6-v2):
+    mean pooled over the tokens and L2 normalized, so a dot product is the cosine similarity.
+    """
+    def __init__(self, model_id="sentence-transformers/all-MiniLM-L6-v2", device="cpu", batch_size=64):
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+        self.torch = torch
+        self.model_id = model_id
+        self.device = device
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+        self.model = AutoModel.from_pretrained(model_id).to(device).eval()
+
+    def encode(self, texts):
+        torch = self.torch
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            inputs = self.tokenizer(texts[i:i + self.batch_size], padding=True, truncation=True,
+                                    max_length=128, return_tensors="pt").to(self.device)
+            with torch.inference_mode():
+                hidden = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(1) / mask.sum(1).clamp(min=1e-9)
+            vectors.append(torch.nn.functional.normalize(pooled, dim=-1).float().cpu().numpy())
+        return np.concatenate(vectors) if vectors else np.zeros((0, 0), np.float32)
+
+
+class CaptionIndex:
+    """
+    Searchable caption store in one SQLite file, filled incrementally (see
+    CaptionWriter's index argument): a time index, an FTS5 full-text index of the
+    caption text (LIKE matching when SQLite lacks FTS5) and, with an embedder,
+    caption embeddings for semantic search.
+
+    Embeddings are appended as small segments, one per add() batch, so a write never
+    rewrites what is already stored. Once a level holds fanout segments they are
+    merged into one segment of the next level, which keeps the number of segments a
+    search scans small. Segments stop growing at max_segment vectors, so a caption is
+    rewritten a bounded number of times and the write cost per caption stays constant
+    however large the index gets. WAL mode lets the search CLI read while the agent writes.
+
+    Parameters:
+
+      path (str) -- SQLite database file, created if missing
+      embedder (TextEmbedder) -- optional, enables semantic search and embeds every added caption
+      fanout (int) -- segments per level before they are merged
+      max_segment (int) -- vectors per segment at most, larger merges are skipped
+    """
+    def __init__(self, path, embedder=None, fanout=8, max_segment=2**16):
+        self.path = path
+        self.embedder = embedder
+        self.fanout = max(2, fanout)
+        self.max_segment = max_segment
+        self.lock = threading.Lock()
+        self.segments = {}   # segment id -> (caption ids, vectors), loaded for searches
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        try:
+            self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS captions_fts "
+                            "USING fts5(text, content='captions', content_rowid='id')")
+            self.fts = True
+        except sqlite3.OperationalError:
+            logging.warning("[CaptionIndex] SQLite was built without FTS5, text search falls back to LIKE")
+            self.fts = False
+
+        if embedder is not None:
+            stored = self.meta("embedding_model")
+            if stored is None:
+                self.db.execute("INSERT INTO meta VALUES ('embedding_model', ?)", (embedder.model_id,))
+            elif stored != embedder.model_id:
+                raise ValueError(f"{path} holds {stored} embeddings, can't add {embedder.model_id} ones")
+        self.db.commit()
+
+    def meta(self, key):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def add(self, entries):
+        """Index caption entries (dicts with 'timeframe' or 'media_time'), in one transaction."""
+        rows = []
+        for entry in entries:
+            timestamp = entry.get("timeframe", entry.get("media_time"))
+            rows.append((float(timestamp) if timestamp not in (None, "") else None, entry.get("source"),
+                         caption_text(entry), json.dumps(entry, default=str)))
+        if not rows:
+            return 0
+        vectors = self.embedder.encode([row[2] for row in rows]) if self.embedder is not None else None
+
+        with self.lock, self.db:
+            ids = []
+            for row in rows:
+                caption_id = self.db.execute("INSERT INTO captions (time, source, text, entry) VALUES (?, ?, ?, ?)",
+                                             row).lastrowid
+                if self.fts:
+                    self.db.execute("INSERT INTO captions_fts (rowid, text) VALUES (?, ?)", (caption_id, row[2]))
+                ids.append(caption_id)
+            if vectors is not None:
+                self._add_segment(0, np.array(ids, np.int64), vectors.astype(np.float32))
+                self._compact()
+        return len(rows)
+
+    def _add_segment(self, level, ids, vectors):
+        # caller holds self.lock and the transaction
+        self.db.execute("INSERT INTO segments (level, ids, vectors) VALUES (?, ?, ?)",
+                        (level, ids.tobytes(), vectors.tobytes()))
+
+    def _compact(self):
+        """Merge every level that has reached fanout segments into one segment of the next level."""
+        level = 0
+        while True:
+            sizes = self.db.execute("SELECT id, LENGTH(ids) / 8 FROM segments WHERE level = ? ORDER BY id LIMIT ?",
+                                    (level, self.fanout)).fetchall()
+            if len(sizes) < self.fanout or sum(size for _, size in sizes) > self.max_segment:
+                return
+            rows = self.db.execute(f"SELECT id, ids, vectors FROM segments WHERE id IN ({','.join('?' * len(sizes))}) "
+                                   "ORDER BY id", [segment_id for segment_id, _ in sizes]).fetchall()
+            ids = np.concatenate([np.frombuffer(row[1], np.int64) for row in rows])
+            vectors = np.concatenate([np.frombuffer(row[2], np.float32) for row in rows])
+            self.db.execute(f"DELETE FROM segments WHERE id IN ({','.join('?' * len(rows))})", [row[0] for row in rows])
+            self._add_segment(level + 1, ids, vectors)
+            level += 1
+
+    def _load_segments(self):
+        # caller holds self.lock
+        stored = {row[0]: row[1] for row in self.db.execute("SELECT id, level FROM segments")}
+        for segment_id in list(self.segments):
+            if segment_id not in stored:
+                del self.segments[segment_id]   # merged away since
+        for segment_id in stored:
+            if segment_id not in self.segments:
+                ids, vectors = self.db.execute("SELECT ids, vectors FROM segments WHERE id = ?", (segment_id,)).fetchone()
+                ids = np.frombuffer(ids, np.int64)
+                self.segments[segment_id] = (ids, np.frombuffer(vectors, np.float32).reshape(len(ids), -1))
+        return list(self.segments.values())
+
+    def _filters(self, start, end, source):
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("c.time >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("c.time <= ?")
+            params.append(end)
+        if source is not None:
+            clauses.append("c.source = ?")
+            params.append(source)
+        return clauses, params
+
+    @staticmethod
+    def _result(row, score=None):
+        result = {"id": row[0], "time": row[1], "source": row[2], "text": row[3], "entry": json.loads(row[4])}
+        if score is not None:
+            result["score"] = score
+        return result
+
+    def search(self, query=None, start=None, end=None, source=None, limit=20, rank=False, raw=False):
+        """
+        Captions matching query (all its words; raw passes FTS5 syntax through) in the
+        time range (seconds, inclusive; None is unbounded), newest first or, with rank,
+        best match first. Without a query, the captions of the time range.
+        """
+        clauses, params = self._filters(start, end, source)
+        select = "SELECT c.id, c.time, c.source, c.text, c.entry FROM captions c"
+        order = "c.time DESC"
+        if query and self.fts:
+            select += " JOIN captions_fts f ON f.rowid = c.id"
+            clauses.insert(0, "captions_fts MATCH ?")
+            params.insert(0, query if raw else fts_query(query))
+            if rank:
+                order = "bm25(captions_fts)"
+        elif query:
+            for word in query.split():
+                clauses.append("c.text LIKE ?")
+                params.append(f"%{word}%")
+        sql = select + (" WHERE " + " AND ".join(clauses) if clauses else "") + f" ORDER BY {order} LIMIT ?"
+        with self.lock:
+            rows = self.db.execute(sql, params + [limit]).fetchall()
+        return [self._result(row) for row in rows]
+
+    def semantic_search(self, query, start=None, end=None, source=None, limit=20):
+        """Captions closest in meaning to query (cosine similarity of the embeddings), best first."""
+        if self.embedder is None:
+            raise ValueError("semantic search needs an embedder")
+        vector = self.embedder.encode([query])[0]
+        clauses, params = self._filters(start, end, source)
+        with self.lock:
+            segments = self._load_segments()
+            allowed = None
+            if clauses:
+                allowed = np.array([row[0] for row in self.db.execute(
+                    "SELECT c.id FROM captions c WHERE " + " AND ".join(clauses), params)], np.int64)
+        if not segments:
+            return []
+        ids = np.concatenate([segment_ids for segment_ids, _ in segments])
+        scores = np.concatenate([vectors @ vector for _, vectors in segments])
+        if allowed is not None:
+            keep = np.isin(ids, allowed)
+            ids, scores = ids[keep], scores[keep]
+        best = np.argsort(-scores)[:limit]
+        with self.lock:
+            rows = {row[0]: row for row in self.db.execute(
+                f"SELECT id, time, source, text, entry FROM captions WHERE id IN ({','.join('?' * len(best))})",
+                [int(ids[i]) for i in best])}
+        return [self._result(rows[int(ids[i])], float(scores[i])) for i in best if int(ids[i]) in rows]
+
+    def stats(self):
+        with self.lock:
+            captions, first, last = self.db.execute("SELECT COUNT(*), MIN(time), MAX(time) FROM captions").fetchone()
+            segments = self.db.execute("SELECT level, COUNT(*), SUM(LENGTH(ids)) / 8 FROM segments "
+                                       "GROUP BY level ORDER BY level").fetchall()
+        return {"captions": captions, "first": first, "last": last, "fts": self.fts,
+                "embedding_model": self.meta("embedding_model"),
+                "segments": {level: {"count": count, "vectors": vectors} for level, count, vectors in segments}}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def __str__(self):
+        stats = self.stats()
+        span = f" over {(stats['last'] - stats['first']) / 3600:.1f}h" if stats["captions"] else ""
+        segments = sum(level["count"] for level in stats["segments"].values())
+        return f"{self.path}: {stats['captions']} captions{span}, {segments} embedding segment(s)"
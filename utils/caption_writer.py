@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+import os
+import csv
+import json
+import time
+import queue
+import logging
+import threading
+
+CAPTION_FORMATS = ('csv', 'jsonl')
+
+
+class CaptionWriter(threading.Thread):
+    """
+    Append caption entries to a CSV or JSONL file from a dedicated thread, so the
+    inference workers only pay for a queue.put(). Entries are written in batches,
+    whenever flush_every entries are waiting or flush_interval seconds have passed,
+    and anything still queued is written by close().
+
+    Parameters:
+
+      path (str) -- output file, appended to if it already exists
+      format (str) -- 'csv' or 'jsonl' (default: inferred from the file extension)
+      fieldnames (list) -- CSV columns; keys not listed are left out of CSV rows
+                           (JSONL lines always contain every key, e.g. latency fields)
+      flush_every (int) -- write once this many entries are waiting
+      flush_interval (float) -- write waiting entries at least this often (seconds)
+      index (CaptionIndex) -- optional utils.caption_index.CaptionIndex every written batch is added to
+    """
+    def __init__(self, path, format=None, fieldnames=("timeframe", "description"),
+                 flush_every=5, flush_interval=1.0, index=None):
+        super().__init__(daemon=True)
+
+        if format is None:
+            format = 'jsonl' if path.endswith(('.jsonl', '.json')) else 'csv'
+        if format not in CAPTION_FORMATS:
+            raise ValueError(f"format should be one of {CAPTION_FORMATS}, got {format}")
+
+        self.path = path
+        self.format = format
+        self.fieldnames = list(fieldnames)
+        self.flush_every = max(1, flush_every)
+        self.flush_interval = flush_interval
+        self.index = index
+
+        self.queue = queue.Queue()
+        self.written = 0
+        self._closed = False
+        self._file = None
+        self._csv = None
+
+    def write(self, entry):
+        """Queue one entry (dict) for writing. Never blocks on file I/O."""
+        if self._closed:
+            logging.warning(f"[CaptionWriter] Dropping entry written after close(): {entry}")
+            return
+        self.queue.put(entry)
+
+    def close(self, timeout=5.0):
+        """Flush everything still queued and close the file."""
+        if self._closed:
+            return
+        self._closed = True
+        self.queue.put(None)
+        if self.is_alive():
+            self.join(timeout=timeout)
+        else:
+            self._drain()  # never started, write synchronously
+
+    def _open(self):
+        file_exists = os.path.isfile(self.path) and os.path.getsize(self.path) > 0
+        self._file = open(self.path, mode='a', newline='', encoding='utf-8')
+        if self.format == 'csv':
+            self._csv = csv.DictWriter(self._file, fieldnames=self.fieldnames, extrasaction='ignore')
+            if not file_exists:
+                self._csv.writeheader()
+
+    def _flush(self, entries):
+        if not entries:
+            return
+        try:
+            if self._file is None:
+                self._open()
+            for entry in entries:
+                if self._csv is not None:
+                    self._csv.writerow(entry)
+                else:
+                    self._file.write(json.dumps(entry, default=str) + '\n')
+            self._file.flush()
+            self.written += len(entries)
+        except Exception as e:
+            print(f"[CaptionWriter] Failed to write {len(entries)} entries to {self.path}: {e}")
+        if self.index is not None:
+            try:
+                self.index.add(entries)
+            except Exception as e:
+                print(f"[CaptionWriter] Failed to index {len(entries)} entries in {self.index.path}: {e}")
+
+    def _drain(self):
+        entries = []
+        while True:
+            try:
+                entry = self.queue.get(block=False)
+            except queue.Empty:
+                break
+            if entry is not None:
+                entries.append(entry)
+        self._flush(entries)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def run(self):
+        entries = []
+        last_flush = time.monotonic()
+
+        while True:
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                entry = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                entry = False
+
+            if entry is None:  # close() sentinel
+                break
+            if entry is not False:
+                entries.append(entry)
+
+            if len(entries) >= self.flush_every or (entries and time.monotonic() - last_flush >= self.flush_interval):
+                self._flush(entries)
+                entries = []
+                last_flush = time.monotonic()
+            elif not entries:
+                last_flush = time.monotonic()
+
+        self._flush(entries)
+        self._drain()
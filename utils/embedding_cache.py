@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.scene import difference_hash
+
+
+class EmbeddingCache:
+    """
+    LRU cache of vision tower outputs keyed by (frame content digest, frame size,
+    encoded input resolution), so a frame asked about again (a follow-up question,
+    a new prompt) skips the image encoder. Unlike utils.caption_cache.CaptionCache
+    it is prompt independent, and it is bounded by the bytes of the embeddings held
+    rather than the number of entries.
+
+    Reusing the embeddings of a merely similar frame is opt-in: with near_duplicates
+    a miss falls back to the cached frame of the same size whose 16x16 difference
+    hash is within that many bits (of 256), so a static scene is encoded once. Keep
+    it small: a live question ("is anyone at the door now?") answered from an
+    older, similar frame can miss a small change.
+
+    Parameters:
+
+      max_bytes (int) -- memory kept for embeddings (on the model device), least recently used are evicted
+      near_duplicates (int) -- max Hamming distance of a reused near-duplicate frame's hash (None: exact frames only)
+      hash_size (int) -- difference hash grid for near_duplicates (hash_size**2 bits)
+    """
+    def __init__(self, max_bytes=256 * 2**20, near_duplicates=None, hash_size=16):
+        self.max_bytes = max_bytes
+        self.near_duplicates = near_duplicates
+        self.hash_size = hash_size
+        self.entries = OrderedDict()   # key -> embeddings tensor
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, image):
+        """
+        Frame part of the key: (content digest, HxW, perceptual hash or None), or None
+        for inputs that can't be hashed (file paths).
+        """
+        if isinstance(image, str):
+            return None
+        image = np.ascontiguousarray(image)
+        if image.ndim < 2:
+            return None
+        digest = hashlib.blake2b(image.data, digest_size=16).digest()
+        phash = None
+        if self.near_duplicates is not None:
+            phash = int(difference_hash(image, hash_size=self.hash_size), 16)
+        return (digest, image.shape[:2], phash)
+
+    def _near(self, key):
+        # caller holds self.lock; most recently used entry of the same size and resolution within the distance
+        _, shape, phash, resolution = key
+        for cached in reversed(self.entries):
+            if cached[1] == shape and cached[3] == resolution and cached[2] is not None \
+                    and bin(cached[2] ^ phash).count("1") <= self.near_duplicates:
+                return cached
+        return None
+
+    def get(self, key):
+        """
+        Return the cached embeddings for key (frame key + resolution), or None on a miss.
+        """
+        with self.lock:
+            embeddings = self.entries.get(key)
+            if embeddings is None and self.near_duplicates is not None and key[2] is not None:
+                near = self._near(key)
+                if near is not None:
+                    embeddings = self.entries[near]
+                    self.entries.move_to_end(near)
+                    self.near_hits += 1
+                    return embeddings
+            if embeddings is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return embeddings
+
+    def put(self, key, embeddings):
+        # a copy, so a slice doesn't keep its whole batch alive (and the byte count stays true)
+        embeddings = embeddings.detach().clone()
+        size = embeddings.numel() * embeddings.element_size()
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous.numel() * previous.element_size()
+            self.entries[key] = embeddings
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.numel() * evicted.element_size()
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.near_hits + self.misses
+        return (self.hits + self.near_hits) / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return (f"size={len(self.entries)} bytes={self.bytes / 2**20:.1f}/{self.max_bytes / 2**20:.1f}MB "
+                f"hits={self.hits} near_hits={self.near_hits} misses={self.misses} hit_rate={self.hit_rate:.1%} evictions={self.evictions}")
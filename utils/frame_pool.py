@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+import time
+import threading
+
+import numpy as np
+import torch
+
+from utils.backend import get_backend
+
+
+class FrameBuffer:
+    """
+    One preallocated frame of a FramePool. Whoever keeps the buffer past the call
+    that handed it over takes a reference with retain() and gives it back with
+    release(); the pool only overwrites buffers nobody references.
+
+      image -- the frame (cudaImage, np.ndarray or torch.Tensor, like the captured frames)
+      generation -- increases every time the buffer is refilled, so a stale view can be detected
+      timestamp -- time.time() when the frame was copied in (capture time)
+    """
+    __slots__ = ('pool', 'index', 'image', 'refcount', 'generation', 'timestamp')
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.image = None
+        self.refcount = 0
+        self.generation = 0
+        self.timestamp = None
+
+    def retain(self):
+        self.pool._retain(self)
+        return self
+
+    def release(self):
+        self.pool._release(self)
+
+    def __repr__(self):
+        return f"FrameBuffer(index={self.index}, generation={self.generation}, refcount={self.refcount})"
+
+
+class FramePool:
+    """
+    Fixed ring of frame buffers shared by capture, inference and display, so frames
+    are copied into memory allocated once instead of a new image per frame.
+
+    put() copies a captured frame into the next unreferenced buffer and returns it
+    holding one reference for the caller. If every buffer is still referenced the
+    frame is dropped (put() returns None) rather than allocating, so memory stays
+    flat; size the pool for the most frames held at once (latest frame, pending
+    and in-flight batches, the display copy).
+
+    Parameters:
+
+      size (int) -- number of buffers in the ring
+      backend -- frame backend used to allocate / copy native frames (default: the active one)
+    """
+    def __init__(self, size=8, backend=None):
+        self.size = max(1, size)
+        self.backend = backend or get_backend()
+        self.buffers = [FrameBuffer(self, index) for index in range(self.size)]
+        self.next_index = 0
+        self.generation = 0
+        self.allocations = 0  # buffers (re)allocated, stays at <= size once frames have a fixed shape
+        self.exhausted = 0    # frames dropped because every buffer was referenced
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _layout(frame):
+        return (type(frame), tuple(frame.shape), getattr(frame, 'format', getattr(frame, 'dtype', None)))
+
+    def allocate(self, frame):
+        """A new, uninitialized frame with the same type, shape and format as frame."""
+        if isinstance(frame, np.ndarray):
+            return np.empty_like(frame)
+        if isinstance(frame, torch.Tensor):
+            return torch.empty_like(frame)
+        return self.backend.alloc_like(frame)
+
+    def copy_into(self, dst, src):
+        if isinstance(dst, np.ndarray):
+            np.copyto(dst, src)
+        elif isinstance(dst, torch.Tensor):
+            dst.copy_(src)
+        else:
+            self.backend.copy_into(dst, src)
+        return dst
+
+    def put(self, frame):
+        """
+        Copy frame into a free buffer. Returns the FrameBuffer with one reference
+        held by the caller, or None if all buffers are in use.
+        """
+        with self.lock:
+            for offset in range(self.size):
+                buffer = self.buffers[(self.next_index + offset) % self.size]
+                if buffer.refcount == 0:
+                    break
+            else:
+                self.exhausted += 1
+                return None
+
+            self.next_index = buffer.index + 1
+            self.generation += 1
+            buffer.generation = self.generation
+            buffer.timestamp = time.time()
+            buffer.refcount = 1
+
+        # the buffer is exclusively ours now, copy outside the lock
+        if buffer.image is None or self._layout(buffer.image) != self._layout(frame):
+            buffer.image = self.allocate(frame)
+            self.allocations += 1
+        self.copy_into(buffer.image, frame)
+        return buffer
+
+    def in_use(self):
+        with self.lock:
+            return sum(1 for buffer in self.buffers if buffer.refcount)
+
+    def _retain(self, buffer):
+        with self.lock:
+            if buffer.refcount <= 0:
+                raise RuntimeError(f"retain() on a released {buffer}")
+            buffer.refcount += 1
+
+    def _release(self, buffer):
+        with self.lock:
+            if buffer.refcount <= 0:
+                raise RuntimeError(f"release() on an unreferenced {buffer}")
+            buffer.refcount -= 1
+
+    def __str__(self):
+        return (f"{self.size} buffers, {self.in_use()} in use, {self.allocations} allocations, "
+                f"{self.exhausted} frames dropped (pool exhausted)")
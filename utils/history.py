@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+import os
+import bisect
+import threading
+from collections import deque
+
+import numpy as np
+
+
+def downscale(image, size, out=None):
+    """
+    Resize an HxWxC uint8 image so its longest side is size (never upscaled), into out if given.
+    OpenCV area interpolation when available, else nearest-neighbour indexing.
+    """
+    height, width = image.shape[:2]
+    scale = min(1.0, size / max(height, width))
+    shape = (max(1, round(height * scale)), max(1, round(width * scale)))
+    if out is None:
+        out = np.empty(shape + image.shape[2:], dtype=np.uint8)
+    try:
+        import cv2
+        cv2.resize(image, (out.shape[1], out.shape[0]), dst=out, interpolation=cv2.INTER_AREA)
+    except ImportError:
+        rows = (np.arange(out.shape[0]) * height // out.shape[0])[:, None]
+        cols = np.arange(out.shape[1]) * width // out.shape[1]
+        out[...] = image[rows, cols]
+    return out
+
+
+class FrameHistory:
+    """
+    Rolling history of recent frames (downscaled) and captions with their timestamps,
+    for time-range queries ("captions between t0 and t1") and for captioning the
+    last N seconds again with another prompt.
+
+    Frames live in a preallocated ring of max_bytes; with a spill_path, frames
+    leaving the RAM ring move to a memory-mapped ring of spill_bytes on disk instead
+    of being dropped. Both rings are fixed size, so the history can't grow: the
+    oldest frames (and captions beyond max_captions) are overwritten.
+
+    Parameters:
+
+      max_bytes (int) -- RAM for frames
+      size (int) -- longest side of the kept frames in pixels
+      interval (float) -- keep at most one frame per this many seconds (0 keeps every frame offered)
+      max_captions (int) -- caption entries kept
+      spill_path (str) -- file for the on-disk ring (None keeps frames in RAM only)
+      spill_bytes (int) -- size of the on-disk ring
+    """
+    def __init__(self, max_bytes=64 * 2**20, size=448, interval=0.5, max_captions=4096,
+                 spill_path=None, spill_bytes=1024 * 2**20):
+        self.max_bytes = max_bytes
+        self.size = size
+        self.interval = interval
+        self.spill_path = spill_path
+        self.spill_bytes = spill_bytes if spill_path else 0
+
+        self.captions = deque(maxlen=max_captions)
+        self.lock = threading.Lock()
+
+        # allocated with the first frame, once the frame shape is known
+        self.shape = None
+        self.ram = None
+        self.disk = None
+        self.timestamps = deque()   # timestamp of every kept frame, oldest first
+        self.count = 0              # frames added so far; frame n is in slot n % capacity of its ring
+        self.last_time = None
+
+    def _allocate(self, image):
+        self.shape = downscale(image, self.size).shape
+        frame_bytes = int(np.prod(self.shape))
+        ram_frames = max(1, self.max_bytes // frame_bytes)
+        self.ram = np.empty((ram_frames,) + self.shape, dtype=np.uint8)
+        if self.spill_path and self.spill_bytes >= frame_bytes:
+            self.disk = np.memmap(self.spill_path, dtype=np.uint8, mode='w+',
+                                  shape=(self.spill_bytes // frame_bytes,) + self.shape)
+        print(f"[FrameHistory] Keeping {ram_frames} frames of {self.shape[1]}x{self.shape[0]} in RAM"
+              + (f" and {len(self.disk)} in {self.spill_path}" if self.disk is not None else ""))
+
+    @property
+    def capacity(self):
+        return (len(self.ram) if self.ram is not None else 0) + (len(self.disk) if self.disk is not None else 0)
+
+    def due(self, timestamp):
+        """Whether a frame captured at timestamp would be kept (the interval has passed)."""
+        return self.last_time is None or timestamp - self.last_time >= self.interval
+
+    def add_frame(self, image, timestamp):
+        """Keep a downscaled copy of an HxWx3 uint8 frame. Returns False if it came before the interval passed."""
+        with self.lock:
+            if not self.due(timestamp):
+                return False
+            if self.ram is None:
+                self._allocate(image)
+            elif image.shape[2:] != self.shape[2:]:
+                return False
+            self.last_time = timestamp
+
+            n = self.count
+            slot = self.ram[n % len(self.ram)]
+            if n >= len(self.ram):
+                # frame n - len(ram) leaves the RAM ring: spill it, or forget it
+                evicted = n - len(self.ram)
+                if self.disk is not None:
+                    self.disk[evicted % len(self.disk)] = slot
+                else:
+                    self.timestamps.popleft()
+            if len(self.timestamps) >= self.capacity:
+                self.timestamps.popleft()
+            if image.shape == self.shape:
+                np.copyto(slot, image)
+            else:
+                downscale(image, self.size, out=slot)
+            self.timestamps.append(timestamp)
+            self.count += 1
+            return True
+
+    def add_caption(self, entry):
+        """Keep a caption entry (dict with a 'timeframe' timestamp)."""
+        with self.lock:
+            self.captions.append(entry)
+
+    def _frame(self, n):
+        # caller holds self.lock
+        if n >= self.count - len(self.ram):
+            return self.ram[n % len(self.ram)]
+        return self.disk[n % len(self.disk)]
+
+    def frames(self, start=None, end=None, limit=None):
+        """
+        (timestamp, frame) of the kept frames captured between start and end
+        (seconds since the epoch, inclusive; None is unbounded), oldest first,
+        evenly thinned out to at most limit frames. Frames are copies.
+        """
+        with self.lock:
+            timestamps = list(self.timestamps)
+            first = self.count - len(timestamps)
+            lo = 0 if start is None else bisect.bisect_left(timestamps, start)
+            hi = len(timestamps) if end is None else bisect.bisect_right(timestamps, end)
+            indices = range(lo, hi)
+            if limit is not None and len(indices) > limit:
+                indices = np.linspace(lo, hi - 1, limit).round().astype(int)
+            return [(timestamps[i], np.array(self._frame(first + i))) for i in indices]
+
+    def frame_at(self, timestamp):
+        """(timestamp, frame copy) of the kept frame closest to timestamp, (None, None) if there is none."""
+        with self.lock:
+            timestamps = list(self.timestamps)
+            if not timestamps:
+                return None, None
+            i = bisect.bisect_left(timestamps, timestamp)
+            if i == len(timestamps) or (i > 0 and timestamp - timestamps[i - 1] < timestamps[i] - timestamp):
+                i -= 1
+            return timestamps[i], np.array(self._frame(self.count - len(timestamps) + i))
+
+    def captions_between(self, start=None, end=None):
+        """Caption entries whose timeframe is between start and end (inclusive; None is unbounded), in time order."""
+        with self.lock:
+            entries = list(self.captions)
+        return sorted((entry for entry in entries
+                       if (start is None or entry["timeframe"] >= start) and (end is None or entry["timeframe"] <= end)),
+                      key=lambda entry: entry["timeframe"])
+
+    @property
+    def nbytes(self):
+        """Bytes allocated for frames: RAM, and the on-disk ring."""
+        return (self.ram.nbytes if self.ram is not None else 0), (self.disk.nbytes if self.disk is not None else 0)
+
+    def close(self):
+        """Free the frames and delete the spill file."""
+        with self.lock:
+            self.ram = self.disk = None
+            self.timestamps.clear()
+            self.count = 0
+        if self.spill_path and os.path.exists(self.spill_path):
+            os.remove(self.spill_path)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __str__(self):
+        ram, disk = self.nbytes
+        span = self.timestamps[-1] - self.timestamps[0] if len(self.timestamps) > 1 else 0.0
+        return (f"frames={len(self.timestamps)}/{self.capacity} ({span:.1f}s) captions={len(self.captions)} "
+                f"ram={ram / 2**20:.1f}MB disk={disk / 2**20:.1f}MB")
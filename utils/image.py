@@ -1,15 +1,21 @@
 #!/usr/bin/env python3
 # Reference: https://github.com/dusty-nv/jetson-utils/blob/master/python/jetson_utils/types/image.py
 import io
+import functools
 import PIL
+import PIL.Image
 import logging
 import torch
 import requests
 import numpy as np
-from jetson_utils import cudaImage, cudaFromNumpy
 
+try:
+    from jetson_utils import cudaImage, cudaFromNumpy
+    ImageTypes = (PIL.Image.Image, np.ndarray, torch.Tensor, cudaImage)
+except ImportError:  # CPU backend, no cudaImage type
+    cudaImage = cudaFromNumpy = None
+    ImageTypes = (PIL.Image.Image, np.ndarray, torch.Tensor)
 
-ImageTypes = (PIL.Image.Image, np.ndarray, torch.Tensor, cudaImage)
 ImageExtensions = ('.png', '.jpg', '.jpeg', '.tiff', '.bmp', '.gif')
 
 
@@ -24,7 +30,7 @@ def image_size(image):
     """
     Returns the dimensions of the image as a tuple (height, width, channels)
     """
-    if isinstance(image, (cudaImage, np.ndarray, torch.Tensor)):
+    if isinstance(image, (np.ndarray, torch.Tensor)) or (cudaImage is not None and isinstance(image, cudaImage)):
         return image.shape
     elif isinstance(image, PIL.Image.Image):
         return image.size
@@ -59,6 +65,9 @@ def cuda_image(image):
     if not is_image(image):
         raise TypeError(f"expected an image of type {ImageTypes} (was {type(image)})")
         
+    if cudaImage is None:
+        raise RuntimeError("cuda_image() requires jetson_utils (Jetson backend)")
+
     if isinstance(image, cudaImage):
         return image
         
@@ -83,7 +92,7 @@ def torch_image(image):
     """
     Convert the image to a type that is compatible with PyTorch (torch.Tensor, ndarray, PIL.Image)
     """
-    if isinstance(image, cudaImage):
+    if cudaImage is not None and isinstance(image, cudaImage):
         return torch.as_tensor(image, device='cuda')
     elif is_image(image):
         return image 
@@ -113,29 +122,46 @@ def torch_image_format(tensor):
     
     raise ValueError(f"PyTorch tensor should have 1, 3, or 4 image channels (has {channels})")
 
+@functools.lru_cache(maxsize=256)
+def wrap_lines(text, line_length):
+    """
+    Split text into lines of about line_length characters at word boundaries.
+    Cached, since the same caption is wrapped again for every rendered frame.
+    """
+    lines = []
+    current_line = ""
+
+    for word in text.split():
+        if len(current_line) + len(word) <= line_length:
+            current_line = current_line + word + " "
+        else:
+            if current_line.strip():
+                lines.append(current_line.strip())
+            current_line = word + " "
+
+    if current_line.strip():
+        lines.append(current_line.strip())
+    return tuple(lines)
+
+
 def wrap_text(font, image, text='', x=5, y=5, **kwargs):
     """"
-    Utility for cudaFont that draws text on a image with word wrapping.
+    Utility for cudaFont (or the CPU backend's font) that draws text on a image with word wrapping.
     Returns the new y-coordinate after the text wrapping was applied.
+    Fonts with OverlayLines() (the CPU backend's) draw the whole block from a cached bitmap.
     """
     text_color=kwargs.get("color", font.White) 
     background_color=kwargs.get("background", font.Gray40)
     line_spacing = kwargs.get("line_spacing", 38)
-    line_length = kwargs.get("line_length", image.width // 16)
+    line_length = kwargs.get("line_length", image.shape[1] // 16)
 
-    text = text.split()
-    current_line = ""
+    lines = wrap_lines(text, line_length)
 
-    for n, word in enumerate(text):
-        if len(current_line) + len(word) <= line_length:
-            current_line = current_line + word + " "
-            
-            if n == len(text) - 1:
-                font.OverlayText(image, text=current_line, x=x, y=y, color=text_color, background=background_color)
-                return y + line_spacing
-        else:
-            current_line = current_line.strip()
-            font.OverlayText(image, text=current_line, x=x, y=y, color=text_color, background=background_color)
-            current_line = word + " "
-            y=y+line_spacing
-    return y
\ No newline at end of file
+    if hasattr(font, 'OverlayLines'):
+        return font.OverlayLines(image, lines, x=x, y=y, color=text_color, background=background_color,
+                                 line_spacing=line_spacing)
+
+    for line in lines:
+        font.OverlayText(image, text=line, x=x, y=y, color=text_color, background=background_color)
+        y=y+line_spacing
+    return y
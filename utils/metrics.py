@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+import json
+import math
+import time
+import logging
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Pipeline stages timed for every caption
+STAGES = ('capture', 'queue_wait', 'preprocess', 'prefill', 'decode', 'postprocess', 'total')
+
+
+class StreamingHistogram:
+    """
+    Fixed-memory latency histogram with log-spaced buckets (~4% relative error),
+    good for percentiles over days-long runs without keeping every sample.
+
+    Parameters:
+
+      min_value (float) -- smallest resolved value in seconds (anything below lands in the first bucket)
+      max_value (float) -- largest resolved value in seconds (anything above lands in the last bucket)
+      buckets_per_decade (int) -- resolution of the buckets
+    """
+    def __init__(self, min_value=1e-5, max_value=1e3, buckets_per_decade=60):
+        self.min_value = min_value
+        self.buckets_per_decade = buckets_per_decade
+        self.num_buckets = int(math.ceil(math.log10(max_value / min_value) * buckets_per_decade)) + 1
+        self.counts = [0] * self.num_buckets
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def _bucket(self, value):
+        if value <= self.min_value:
+            return 0
+        return min(self.num_buckets - 1, int(math.log10(value / self.min_value) * self.buckets_per_decade))
+
+    def _bucket_value(self, index):
+        # geometric midpoint of the bucket
+        return self.min_value * 10 ** ((index + 0.5) / self.buckets_per_decade)
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[self._bucket(value)] += 1
+            self.count += 1
+            self.sum += value
+            self.min = min(self.min, value)
+            self.max = max(self.max, value)
+
+    def percentile(self, q):
+        """
+        Approximate q-th percentile (0-100), or 0.0 if nothing was observed yet.
+        """
+        with self.lock:
+            if self.count == 0:
+                return 0.0
+            target = q / 100.0 * self.count
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= target and count:
+                    return min(max(self._bucket_value(index), self.min), self.max)
+            return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class Metrics:
+    """
+    Collects per-stage latency histograms and caption throughput for the pipeline.
+    Shared by all agents of a run; all methods are thread-safe.
+    """
+    def __init__(self, window=30.0):
+        self.histograms = {stage: StreamingHistogram() for stage in STAGES}
+        self.counters = {}
+        self.window = window              # seconds used for the recent throughput
+        self.events = deque(maxlen=10000) # completion times of recent captions
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        if seconds is None:
+            return
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, StreamingHistogram())
+        histogram.observe(seconds)
+
+    def observe_all(self, timings):
+        for stage, seconds in timings.items():
+            self.observe(stage, seconds)
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_captions(self, count=1):
+        now = time.time()
+        with self.lock:
+            self.counters["captions"] = self.counters.get("captions", 0) + count
+            self.events.extend([now] * count)
+
+    def throughput(self):
+        """Captions per second over the recent window."""
+        now = time.time()
+        with self.lock:
+            while self.events and now - self.events[0] > self.window:
+                self.events.popleft()
+            elapsed = min(self.window, now - self.start_time)
+            return len(self.events) / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        with self.lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+        return {
+            "uptime": time.time() - self.start_time,
+            "throughput": self.throughput(),
+            "counters": counters,
+            "stages": {stage: histogram.summary() for stage, histogram in histograms.items() if histogram.count},
+        }
+
+    def overlay_text(self):
+        """One-line summary for the display overlay."""
+        total = self.histograms['total']
+        decode = self.histograms['decode']
+        return (f"{self.throughput():.2f} cap/s | total p50 {total.percentile(50)*1000:.0f}ms "
+                f"p95 {total.percentile(95)*1000:.0f}ms | decode p50 {decode.percentile(50)*1000:.0f}ms")
+
+    def report(self):
+        """Multi-line human readable summary (printed on stop / after a benchmark)."""
+        summary = self.summary()
+        lines = [f"[Metrics] {summary['counters'].get('captions', 0)} captions in {summary['uptime']:.1f}s, "
+                 f"{summary['throughput']:.2f} captions/s (last {self.window:.0f}s)"]
+        for stage, stats in summary["stages"].items():
+            lines.append(f"[Metrics] {stage:<12} n={stats['count']:<6} mean={stats['mean']*1000:8.1f}ms "
+                         f"p50={stats['p50']*1000:8.1f}ms p95={stats['p95']*1000:8.1f}ms p99={stats['p99']*1000:8.1f}ms")
+        return "\n".join(lines)
+
+    def prometheus_text(self, prefix="video_query"):
+        """Render the metrics in the Prometheus text exposition format."""
+        summary = self.summary()
+        lines = [
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        for stage, stats in summary["stages"].items():
+            for key, quantile in (("p50", "0.5"), ("p95", "0.95"), ("p99", "0.99")):
+                lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {stats[key]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {stats["mean"] * stats["count"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        for name, value in summary["counters"].items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        lines.append(f"# TYPE {prefix}_captions_per_second gauge")
+        lines.append(f"{prefix}_captions_per_second {summary['throughput']:.4f}")
+        lines.append(f"# TYPE {prefix}_uptime_seconds gauge")
+        lines.append(f"{prefix}_uptime_seconds {summary['uptime']:.1f}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Serve metrics over HTTP from a daemon thread:
+    /metrics in Prometheus text format and /metrics.json as JSON.
+    """
+    def __init__(self, metrics, port=9100, host="127.0.0.1"):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    body = json.dumps(metrics.summary()).encode()
+                    content_type = "application/json"
+                elif self.path.startswith("/metrics"):
+                    body = metrics.prometheus_text().encode()
+                    content_type = "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(f"[MetricsServer] {format % args}")
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        print(f"[MetricsServer] Serving metrics on http://{self.host}:{self.port}/metrics")
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
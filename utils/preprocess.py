@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Fast frame preprocessing that bypasses the AutoProcessor image pipeline.
+
+The HF processors convert every frame to PIL, resize and normalize it on the host
+in float32 and copy the result to the device. FramePreprocessor instead views the
+frame as a uint8 tensor (no copy for NumPy arrays and CUDA images), moves it to the
+model device once, and resizes + rescales + normalizes it there in a single pass,
+producing pixel_values in the model dtype. The text side (input_ids, attention_mask,
+token_type_ids) does not depend on the pixels, so it is built once per prompt by
+running the processor on a blank image and reused afterwards.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# PIL resample codes used by the HF image processors -> torch interpolation modes
+_RESAMPLE_MODES = {0: 'nearest', 2: 'bilinear', 3: 'bicubic'}
+
+
+def frame_tensor(frame, device):
+    """
+    View an HxWx3 uint8 frame (np.ndarray, torch.Tensor or CUDA array such as a
+    jetson_utils cudaImage) as a tensor on device, copying only if it lives elsewhere.
+    """
+    if isinstance(frame, torch.Tensor):
+        tensor = frame
+    elif isinstance(frame, np.ndarray):
+        tensor = torch.from_numpy(np.ascontiguousarray(frame))
+    elif hasattr(frame, '__cuda_array_interface__'):
+        tensor = torch.as_tensor(frame, device='cuda')
+    else:
+        raise TypeError(f"expected an HxWx3 np.ndarray, torch.Tensor or CUDA image (was {type(frame)})")
+
+    if tensor.dim() != 3 or tensor.shape[-1] < 3:
+        raise ValueError(f"expected an HxWx3 frame, got shape {tuple(tensor.shape)}")
+    return tensor[..., :3].to(device, non_blocking=True)
+
+
+class FramePreprocessor:
+    """
+    Turns frames + prompts into model inputs for Gemma3 and Qwen2-VL style processors.
+
+    Parameters:
+
+      processor -- the model's AutoProcessor (used for its config and to tokenize the prompts)
+      device (str) -- device the model runs on
+      dtype (torch.dtype) -- dtype of the produced pixel_values
+      build_messages (callable) -- (image, prompt) -> chat messages, as in the describers
+      add_generation_prompt (bool) -- passed through to apply_chat_template
+      text_cache_size (int) -- tokenized prompts kept, least recently used are evicted
+    """
+    def __init__(self, processor, device, dtype, build_messages, add_generation_prompt=True, text_cache_size=64):
+        self.processor = processor
+        self.image_processor = processor.image_processor
+        self.device = device
+        self.dtype = dtype
+        self.build_messages = build_messages
+        self.add_generation_prompt = add_generation_prompt
+        self.text_cache_size = text_cache_size
+
+        ip = self.image_processor
+        self.qwen = hasattr(ip, 'merge_size') and hasattr(ip, 'temporal_patch_size')
+        self.mode = _RESAMPLE_MODES.get(int(getattr(ip, 'resample', 2)), 'bilinear')
+
+        # rescale + normalize folded into one multiply-add: x * scale + offset
+        mean = torch.tensor(ip.image_mean if ip.do_normalize else [0.0, 0.0, 0.0], dtype=torch.float32)
+        std = torch.tensor(ip.image_std if ip.do_normalize else [1.0, 1.0, 1.0], dtype=torch.float32)
+        rescale = ip.rescale_factor if ip.do_rescale else 1.0
+        self.scale = (rescale / std).view(1, 3, 1, 1).to(device)
+        self.offset = (-mean / std).view(1, 3, 1, 1).to(device)
+
+        # (prompt, image key) -> single-frame text inputs; bounded, every free-text question is a new prompt
+        self._text_cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def supported(self):
+        """False for processor settings this path doesn't reproduce (it then shouldn't be used)."""
+        return not getattr(self.image_processor, 'do_pan_and_scan', False)
+
+    @staticmethod
+    def accepts(frames):
+        """True if every frame is a raw array (file paths, URLs and PIL images go through the processor)."""
+        return all(isinstance(frame, (np.ndarray, torch.Tensor)) or hasattr(frame, '__cuda_array_interface__')
+                   for frame in frames)
+
+    def _target_size(self, height, width):
+        ip = self.image_processor
+        if self.qwen:
+            from transformers.models.qwen2_vl.image_processing_qwen2_vl import smart_resize
+            min_pixels = getattr(ip, 'min_pixels', None) or ip.size['shortest_edge']
+            max_pixels = getattr(ip, 'max_pixels', None) or ip.size['longest_edge']
+            return smart_resize(height, width, factor=ip.patch_size * ip.merge_size,
+                                min_pixels=min_pixels, max_pixels=max_pixels)
+        return ip.size['height'], ip.size['width']
+
+    def _normalize(self, tensor, size):
+        # NHWC uint8 -> NCHW model dtype, resized to size
+        x = tensor.permute(0, 3, 1, 2)
+        if x.device.type != 'cpu':
+            x = x.float()  # CUDA kernels don't resize uint8; on CPU the uint8 (channels-last) kernel is ~10x faster
+        if tuple(x.shape[-2:]) != tuple(size):
+            x = F.interpolate(x, size=size, mode=self.mode, align_corners=False,
+                              antialias=self.mode != 'nearest')
+        return x.float().mul_(self.scale).add_(self.offset).to(self.dtype)
+
+    def _patchify(self, x):
+        # Qwen2-VL: (1, C, H, W) -> (grid_h * grid_w, C * temporal * patch * patch), same layout as the HF processor
+        ip = self.image_processor
+        patch, merge, temporal = ip.patch_size, ip.merge_size, ip.temporal_patch_size
+        channels, height, width = x.shape[1:]
+        grid_h, grid_w = height // patch, width // patch
+        x = x.expand(temporal, -1, -1, -1)
+        x = x.reshape(1, temporal, channels, grid_h // merge, merge, patch, grid_w // merge, merge, patch)
+        x = x.permute(0, 3, 6, 4, 7, 2, 1, 5, 8)
+        return x.reshape(grid_h * grid_w, channels * temporal * patch * patch), (1, grid_h, grid_w)
+
+    def _text_inputs(self, prompt, height, width):
+        """Tokenized prompt for one frame, cached; Qwen's token count depends on the frame size."""
+        key = (prompt, (height, width) if self.qwen else None)
+        with self._lock:
+            cached = self._text_cache.get(key)
+            if cached is not None:
+                self._text_cache.move_to_end(key)
+                return cached
+
+        blank = np.zeros((height, width, 3), dtype=np.uint8)
+        inputs = self.processor.apply_chat_template(
+            self.build_messages(blank, prompt),
+            add_generation_prompt=self.add_generation_prompt,
+            tokenize=True,
+            return_dict=True,
+            return_tensors="pt"
+        )
+        cached = {name: inputs[name][0] for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in inputs}
+        with self._lock:
+            self._text_cache[key] = cached
+            self._text_cache.move_to_end(key)
+            while len(self._text_cache) > self.text_cache_size:
+                self._text_cache.popitem(last=False)
+        logging.debug(f"[FramePreprocessor] Cached text inputs for {key}")
+        return cached
+
+    def _collate(self, texts):
+        # left-pad the cached single-frame text inputs into a batch
+        length = max(len(text['input_ids']) for text in texts)
+        pad_id = self.processor.tokenizer.pad_token_id or 0
+        batch = {}
+        for name in texts[0]:
+            pad = pad_id if name == 'input_ids' else 0
+            batch[name] = torch.stack([
+                F.pad(text[name], (length - len(text[name]), 0), value=pad) for text in texts
+            ]).to(self.device)
+        return batch
+
+    def __call__(self, frames, prompts):
+        """
+        Build the model inputs for N frames (HxWx3 uint8, RGB) and N prompts.
+        Returns a dict with input_ids, attention_mask, pixel_values (and token_type_ids
+        or image_grid_thw depending on the model), all on the model device.
+        """
+        texts = []
+        pixels = []
+        grids = []
+        # the same frame object repeated (several prompts about one frame) is only resized once
+        unique = {}
+        index = [unique.setdefault(id(frame), len(unique)) for frame in frames]
+        distinct = [frames[index.index(i)] for i in range(len(unique))]
+
+        with torch.inference_mode():
+            if not self.qwen and len(set(tuple(frame.shape) for frame in frames)) == 1:
+                # same-sized frames: one stacked resize for the whole batch
+                batch = torch.stack([frame_tensor(frame, self.device) for frame in distinct])
+                x = self._normalize(batch, self._target_size(*batch.shape[1:3]))
+                pixels.append(x if len(distinct) == len(frames) else x[index])
+                texts = [self._text_inputs(prompt, *batch.shape[1:3]) for prompt in prompts]
+            else:
+                processed = {}
+                for frame, i, prompt in zip(frames, index, prompts):
+                    if i not in processed:
+                        tensor = frame_tensor(frame, self.device)
+                        height, width = tensor.shape[:2]
+                        x = self._normalize(tensor.unsqueeze(0), self._target_size(height, width))
+                        grid = None
+                        if self.qwen:
+                            x, grid = self._patchify(x)
+                        processed[i] = (x, grid, height, width)
+                    x, grid, height, width = processed[i]
+                    if self.qwen:
+                        grids.append(grid)
+                    pixels.append(x)
+                    texts.append(self._text_inputs(prompt, height, width))
+
+        inputs = self._collate(texts)
+        inputs['pixel_values'] = torch.cat(pixels)
+        if self.qwen:
+            inputs['image_grid_thw'] = torch.tensor(grids, device=self.device)
+        return inputs
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+import os
+import time
+import queue
+import logging
+import threading
+import subprocess
+from fractions import Fraction
+
+import numpy as np
+
+from utils.frame_pool import FramePool
+
+SUBTITLE_FORMATS = ('srt', 'vtt')
+
+
+def format_timestamp(seconds, format='srt'):
+    """00:01:02,345 (SRT) or 00:01:02.345 (WebVTT)"""
+    milliseconds = int(round(max(0.0, seconds) * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    separator = ',' if format == 'srt' else '.'
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+
+class SubtitleWriter:
+    """
+    Writes captions as SRT or WebVTT cues. A cue lasts from its caption's timestamp
+    until the next caption (at most max_duration seconds), so it is written once the
+    next caption arrives or the file is closed. Timestamps are seconds from the start
+    of the video file.
+    """
+    def __init__(self, path, format='srt', max_duration=10.0):
+        if format not in SUBTITLE_FORMATS:
+            raise ValueError(f"format should be one of {SUBTITLE_FORMATS}, got {format}")
+        self.path = path
+        self.format = format
+        self.max_duration = max_duration
+        self.file = open(path, 'w', encoding='utf-8')
+        self.cues = 0
+        self.pending = None  # (start, text) of the caption still on screen
+        if format == 'vtt':
+            self.file.write("WEBVTT\n\n")
+
+    def add(self, text, timestamp):
+        if self.pending is not None:
+            self._write(*self.pending, end=max(timestamp, self.pending[0]))
+        self.pending = (timestamp, text)
+
+    def _write(self, start, text, end):
+        end = min(end, start + self.max_duration)
+        if end <= start or not text.strip():
+            return
+        self.cues += 1
+        if self.format == 'srt':
+            self.file.write(f"{self.cues}\n")
+        self.file.write(f"{format_timestamp(start, self.format)} --> {format_timestamp(end, self.format)}\n"
+                        f"{text.strip()}\n\n")
+        self.file.flush()
+
+    def close(self, end):
+        if self.pending is not None:
+            self._write(*self.pending, end=end)
+            self.pending = None
+        self.file.close()
+
+
+class VideoRecorder(threading.Thread):
+    """
+    Encode frames to video from a dedicated thread. write() copies the frame into a
+    preallocated buffer and queues it with its timestamp, so the display thread never
+    waits on the encoder; when the bounded queue is full the frame is dropped, which
+    the timestamps absorb (the output is variable frame rate).
+
+    Frames are encoded with PyAV when it's installed (exact per-frame timestamps), or
+    piped to the ffmpeg CLI, which stamps frames with their arrival time.
+
+    Parameters:
+
+      path (str) -- output file; with segments, '_000', '_001', ... is inserted before the extension
+      fps (float) -- nominal frame rate (stream rate hint; the real timing comes from the timestamps)
+      codec (str) -- encoder, e.g. libx264, or a hardware one such as h264_nvenc / h264_v4l2m2m
+      queue_size (int) -- frames waiting for the encoder before new ones are dropped
+      segment_duration (float) -- start a new file every this many seconds (0 = one file)
+      subtitles (str) -- 'srt' or 'vtt' to write captions to a subtitle file next to each video
+      encoder (str) -- 'auto', 'pyav' or 'ffmpeg'
+    """
+    def __init__(self, path, fps=30, codec='libx264', queue_size=8, segment_duration=0,
+                 subtitles=None, encoder='auto'):
+        super().__init__(daemon=True)
+
+        if subtitles is not None and subtitles not in SUBTITLE_FORMATS:
+            raise ValueError(f"subtitles should be one of {SUBTITLE_FORMATS}, got {subtitles}")
+        if encoder == 'auto':
+            try:
+                import av  # noqa: F401
+                encoder = 'pyav'
+            except ImportError:
+                encoder = 'ffmpeg'
+
+        self.path = path
+        self.fps = fps
+        self.codec = codec
+        self.segment_duration = segment_duration
+        self.subtitles = subtitles
+        self.encoder = encoder
+
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.pool = FramePool(queue_size + 1)
+        self.written = 0
+        self.dropped = 0
+        self.segments = []
+        self._closed = False
+        self._lock = threading.Lock()  # guards segment switches against add_caption()
+
+        self._segment_start = None
+        self._last_timestamp = None
+        self._last_pts = -1
+        self._subtitle_writer = None
+        self._carried_caption = None  # caption still on screen when a segment ends, repeated in the next one
+        self._container = None
+        self._stream = None
+        self._process = None
+
+    def write(self, frame, timestamp=None):
+        """Queue a copy of an HxWx3 uint8 RGB frame. Returns False if it was dropped."""
+        if self._closed:
+            return False
+        buffer = self.pool.put(frame)
+        if buffer is None:
+            self.dropped += 1
+            return False
+        try:
+            self.queue.put((buffer, time.time() if timestamp is None else timestamp), block=False)
+        except queue.Full:
+            buffer.release()
+            self.dropped += 1
+            return False
+        return True
+
+    def add_caption(self, text, timestamp=None):
+        """Start a subtitle cue at timestamp (wall-clock seconds, like the frame timestamps)."""
+        if self.subtitles is None or self._closed:
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            if self._subtitle_writer is not None:
+                self._subtitle_writer.add(text, max(0.0, timestamp - self._segment_start))
+
+    def close(self, timeout=10.0):
+        """Encode everything still queued and finalize the file(s)."""
+        if self._closed:
+            return
+        self._closed = True
+        self.queue.put((None, None))
+        if self.is_alive():
+            self.join(timeout=timeout)
+        print(f"[VideoRecorder] {self.written} frames written to {len(self.segments)} file(s), {self.dropped} dropped")
+
+    def _drain(self):
+        while True:
+            try:
+                buffer, _ = self.queue.get(block=False)
+            except queue.Empty:
+                return
+            if buffer is not None:
+                buffer.release()
+
+    def _segment_path(self, extension=None):
+        root, ext = os.path.splitext(self.path)
+        if self.segment_duration:
+            root = f"{root}_{len(self.segments):03d}"
+        return root + (extension or ext or '.mp4')
+
+    def _open(self, frame, timestamp):
+        path = self._segment_path()
+        height, width = frame.shape[:2]
+
+        if self.encoder == 'pyav':
+            import av
+            self._container = av.open(path, mode='w')
+            self._stream = self._container.add_stream(self.codec, rate=Fraction(self.fps).limit_denominator(1000))
+            self._stream.width = width
+            self._stream.height = height
+            self._stream.pix_fmt = 'yuv420p'
+            self._stream.codec_context.time_base = Fraction(1, 1000)
+        else:
+            self._process = subprocess.Popen([
+                'ffmpeg', '-y', '-loglevel', 'error',
+                '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}',
+                '-use_wallclock_as_timestamps', '1',
+                '-i', '-',
+                '-an', '-fps_mode', 'vfr',
+                '-vcodec', self.codec, '-pix_fmt', 'yuv420p',
+                path
+            ], stdin=subprocess.PIPE)
+
+        with self._lock:
+            self._segment_start = timestamp
+            self._last_pts = -1
+            if self.subtitles is not None:
+                self._subtitle_writer = SubtitleWriter(self._segment_path('.' + self.subtitles), self.subtitles)
+                if self._carried_caption is not None:
+                    self._subtitle_writer.add(self._carried_caption, 0.0)
+        self.segments.append(path)
+        logging.info(f"[VideoRecorder] Recording to {path}")
+
+    def _close_segment(self):
+        if self._container is not None:
+            for packet in self._stream.encode():
+                self._container.mux(packet)
+            self._container.close()
+            self._container = self._stream = None
+        if self._process is not None:
+            self._process.stdin.close()
+            self._process.wait()
+            self._process = None
+        with self._lock:
+            if self._subtitle_writer is not None:
+                pending = self._subtitle_writer.pending
+                self._carried_caption = pending[1] if pending is not None else None
+                self._subtitle_writer.close(end=self._last_timestamp - self._segment_start)
+                self._subtitle_writer = None
+
+    def _encode(self, frame, timestamp):
+        if self._segment_start is None or (self.segment_duration and
+                                           timestamp - self._segment_start >= self.segment_duration):
+            if self._segment_start is not None:
+                self._close_segment()
+            self._open(frame, timestamp)
+
+        if self._container is not None:
+            import av
+            video_frame = av.VideoFrame.from_ndarray(frame, format='rgb24')
+            # millisecond timestamps relative to the segment start, kept strictly increasing
+            pts = max(int(round((timestamp - self._segment_start) * 1000)), self._last_pts + 1)
+            video_frame.pts = pts
+            video_frame.time_base = Fraction(1, 1000)
+            self._last_pts = pts
+            for packet in self._stream.encode(video_frame):
+                self._container.mux(packet)
+        else:
+            self._process.stdin.write(memoryview(np.ascontiguousarray(frame)))
+        self._last_timestamp = timestamp
+        self.written += 1
+
+    def run(self):
+        while True:
+            buffer, timestamp = self.queue.get()
+            if buffer is None:  # close() sentinel
+                break
+            try:
+                self._encode(buffer.image, timestamp)
+            except Exception as e:
+                if self._segment_start is None:
+                    # couldn't open the output (missing encoder / ffmpeg); stop recording instead of retrying per frame
+                    print(f"[VideoRecorder] Failed to open {self._segment_path()}, recording disabled: {e}")
+                    self._closed = True
+                    buffer.release()
+                    self._drain()
+                    return
+                print(f"[VideoRecorder] Failed to encode frame: {e}")
+            buffer.release()
+
+        try:
+            if self._segment_start is not None:
+                self._close_segment()
+        except Exception as e:
+            print(f"[VideoRecorder] Failed to finalize {self.segments[-1]}: {e}")
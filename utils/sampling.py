@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+import numpy as np
+
+from utils.scene import thumbnail
+
+SAMPLING_POLICIES = ('all', 'interval', 'motion', 'keyframe', 'adaptive')
+
+
+class SamplingPolicy:
+    """
+    Decides which captured frames are offered to the VLM. select() is called once
+    per frame on the capture thread, so policies only look at cheap thumbnails.
+    Counts the frames considered and selected.
+    """
+    name = 'all'
+
+    def __init__(self):
+        self.considered = 0
+        self.selected = 0
+
+    def select(self, image, timestamp, keyframe=None):
+        """
+        image -- HxWxC numpy frame, timestamp -- capture time in seconds,
+        keyframe -- True/False if the decoder reports it, else None.
+        """
+        self.considered += 1
+        if self._select(image, timestamp, keyframe):
+            self.selected += 1
+            return True
+        return False
+
+    def _select(self, image, timestamp, keyframe):
+        return True
+
+    @property
+    def selection_rate(self):
+        return self.selected / self.considered if self.considered else 0.0
+
+    def __str__(self):
+        return f"{self.name}: considered={self.considered} selected={self.selected} ({self.selection_rate:.1%})"
+
+
+class IntervalSampler(SamplingPolicy):
+    """One frame every interval seconds."""
+    name = 'interval'
+
+    def __init__(self, interval=1.0):
+        super().__init__()
+        self.interval = interval
+        self.last_time = None
+
+    def _select(self, image, timestamp, keyframe):
+        if self.last_time is not None and timestamp - self.last_time < self.interval:
+            return False
+        self.last_time = timestamp
+        return True
+
+
+class MotionSampler(SamplingPolicy):
+    """
+    Frames where something moves: the mean absolute difference between consecutive
+    frame thumbnails is above threshold. min_interval keeps continuous motion from
+    selecting every frame.
+    """
+    name = 'motion'
+
+    def __init__(self, threshold=0.02, min_interval=0.0, size=32):
+        super().__init__()
+        self.threshold = threshold
+        self.min_interval = min_interval
+        self.size = size
+        self.previous = None
+        self.last_time = None
+
+    def _select(self, image, timestamp, keyframe):
+        thumb = thumbnail(image, self.size)
+        previous, self.previous = self.previous, thumb
+        if previous is not None and previous.shape == thumb.shape:
+            if np.abs(thumb - previous).mean() < self.threshold:
+                return False
+        if self.last_time is not None and timestamp - self.last_time < self.min_interval:
+            return False
+        self.last_time = timestamp
+        return True
+
+
+class KeyframeSampler(SamplingPolicy):
+    """
+    Codec keyframes only (I-frames, which encoders also insert at scene cuts).
+    Sources that don't report keyframes (cameras, OpenCV, jetson_utils) fall back to
+    one frame every fallback_interval seconds.
+    """
+    name = 'keyframe'
+
+    def __init__(self, fallback_interval=2.0):
+        super().__init__()
+        self.fallback = IntervalSampler(fallback_interval)
+        self.warned = False
+
+    def _select(self, image, timestamp, keyframe):
+        if keyframe is not None:
+            return keyframe
+        if not self.warned:
+            print(f"[KeyframeSampler] Source doesn't report keyframes, sampling every {self.fallback.interval}s instead")
+            self.warned = True
+        return self.fallback._select(image, timestamp, keyframe)
+
+
+class AdaptiveSampler(SamplingPolicy):
+    """
+    Spends more inference on busy scenes. The scene entropy (Shannon entropy of the
+    thumbnail's grey-level histogram, 0-1) plus the motion since the previous frame
+    sets the sampling interval between max_interval (flat, static scene) and
+    min_interval (detailed or changing scene). A frame whose entropy jumps above its
+    running average by more than jump is selected right away.
+    """
+    name = 'adaptive'
+
+    def __init__(self, min_interval=0.25, max_interval=4.0, jump=0.1, size=32, bins=32, smoothing=0.9):
+        super().__init__()
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jump = jump
+        self.size = size
+        self.bins = bins
+        self.smoothing = smoothing
+        self.average = None   # running average of the entropy
+        self.previous = None
+        self.last_time = None
+        self.interval = max_interval
+
+    def entropy(self, thumb):
+        histogram = np.bincount(np.minimum((thumb * self.bins).astype(np.int32), self.bins - 1).ravel(),
+                                minlength=self.bins).astype(np.float32)
+        p = histogram[histogram > 0] / histogram.sum()
+        return float(-(p * np.log2(p)).sum() / np.log2(self.bins))
+
+    def _select(self, image, timestamp, keyframe):
+        thumb = thumbnail(image, self.size)
+        entropy = self.entropy(thumb)
+        motion = 0.0
+        if self.previous is not None and self.previous.shape == thumb.shape:
+            motion = float(np.abs(thumb - self.previous).mean())
+        self.previous = thumb
+
+        rising = self.average is not None and entropy - self.average > self.jump
+        self.average = entropy if self.average is None else \
+            self.smoothing * self.average + (1 - self.smoothing) * entropy
+
+        # activity in [0, 1]: scene detail plus motion (~0.1 mean difference counts as very busy)
+        activity = min(1.0, entropy + 10 * motion)
+        self.interval = self.max_interval - (self.max_interval - self.min_interval) * activity
+
+        if not rising and self.last_time is not None and timestamp - self.last_time < self.interval:
+            return False
+        self.last_time = timestamp
+        return True
+
+    def __str__(self):
+        return f"{super().__str__()} interval={self.interval:.2f}s"
+
+
+def make_sampler(policy='all', interval=1.0, motion_threshold=0.02, min_interval=0.25, max_interval=4.0):
+    """Build a sampling policy by name (one of SAMPLING_POLICIES)."""
+    if policy == 'all':
+        return SamplingPolicy()
+    if policy == 'interval':
+        return IntervalSampler(interval)
+    if policy == 'motion':
+        return MotionSampler(motion_threshold, min_interval=min_interval)
+    if policy == 'keyframe':
+        return KeyframeSampler(fallback_interval=interval)
+    if policy == 'adaptive':
+        return AdaptiveSampler(min_interval=min_interval, max_interval=max_interval)
+    raise ValueError(f"policy should be one of {SAMPLING_POLICIES}, got {policy}")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import numpy as np
+
+
+def thumbnail(image, size=32):
+    """
+    Cheap grayscale thumbnail of an HWC image using strided sampling (no filtering).
+    Returns a float32 array of roughly (size, size) with values in [0, 1].
+    """
+    image = np.asarray(image)
+    step_y = max(1, image.shape[0] // size)
+    step_x = max(1, image.shape[1] // size)
+    small = image[::step_y, ::step_x]
+
+    if small.ndim == 3:
+        small = small[..., :3].mean(axis=2, dtype=np.float32)
+    else:
+        small = small.astype(np.float32)
+
+    if image.dtype == np.uint8:
+        small /= 255.0
+    return small
+
+
+def difference_hash(image, hash_size=8):
+    """
+    Perceptual difference hash (dHash) of an image, returned as a hex string
+    (16 characters for the default 8x8 hash).
+    The image is reduced to a (hash_size, hash_size+1) grid of block means and each bit
+    records whether brightness increases from one column to the next, so re-encoding
+    noise and small exposure changes map to the same hash.
+    """
+    small = thumbnail(image, size=hash_size * 8)
+    rows = small.shape[0] // hash_size * hash_size
+    cols = small.shape[1] // (hash_size + 1) * (hash_size + 1)
+    blocks = small[:rows, :cols].reshape(hash_size, rows // hash_size, hash_size + 1, cols // (hash_size + 1))
+    grid = blocks.mean(axis=(1, 3))
+
+    bits = (grid[:, 1:] > grid[:, :-1]).flatten()
+    return np.packbits(bits).tobytes().hex()
+
+
+class SceneChangeDetector:
+    """
+    Decide whether a frame differs enough from the last accepted frame to be worth
+    running the VLM on. Frames are compared as downscaled grayscale thumbnails using
+    the mean absolute pixel difference, so the check costs microseconds per frame.
+
+    Parameters:
+
+      threshold (float) -- mean absolute difference in [0, 1] above which the scene
+                           counts as changed (e.g. 0.02 ~ 5 grey levels on average)
+      size (int) -- approximate thumbnail side length in pixels
+    """
+    def __init__(self, threshold=0.02, size=32):
+        self.threshold = threshold
+        self.size = size
+        self.reference = None
+        self.considered = 0
+        self.skipped = 0
+
+    def changed(self, image):
+        """
+        Returns True if the image differs from the reference frame (or there is none yet),
+        in which case it becomes the new reference. Returns False for unchanged frames.
+        """
+        thumb = thumbnail(image, self.size)
+        self.considered += 1
+
+        if self.reference is not None and self.reference.shape == thumb.shape:
+            if np.abs(thumb - self.reference).mean() < self.threshold:
+                self.skipped += 1
+                return False
+
+        self.reference = thumb
+        return True
+
+    def reset(self):
+        """Forget the reference frame, so the next frame always counts as changed."""
+        self.reference = None
+
+    @property
+    def skip_rate(self):
+        return self.skipped / self.considered if self.considered else 0.0
+
+    def __str__(self):
+        return f"considered={self.considered} skipped={self.skipped} skip_rate={self.skip_rate:.1%}"
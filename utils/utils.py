@@ -1,7 +1,6 @@
 # Reference: https://github.com/dusty-nv/jetson-utils/blob/master/python/jetson_utils/cuda/array.py
 import numpy as np
 import ctypes as C
-from jetson_utils import cudaFont
 
 def dtype_to_ctype(dtype):
     if dtype == np.uint8:
@@ -25,6 +24,9 @@ def cudaToNumpy(frame, shape=None, dtype=np.uint8):
     import numpy as np
     import ctypes as C
 
+    if isinstance(frame, np.ndarray):
+        return frame
+
     # Extract the CUDA pointer from the frame
     # The field might be `ptr` or `image.ptr` depending on your version
     if hasattr(frame, "ptr"):
@@ -45,10 +47,11 @@ def cudaToNumpy(frame, shape=None, dtype=np.uint8):
 
 def cudaDrawText(image, text, position=(10, 10), color=None):
     """
-    Draw text on a CUDA image using jetson_utils.cudaFont.
+    Draw text on an image using the active backend's font (jetson_utils.cudaFont on Jetson).
     Automatically creates a font object if not already defined.
     """
-    _font = cudaFont()  
+    from utils.backend import get_backend
+    _font = get_backend().font()
     color = _font.White
 
     try:
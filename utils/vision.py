@@ -1,7 +1,6 @@
 import numpy as np
 import pygame
-from jetson_utils import cudaDeviceSynchronize
-from utils.utils import cudaToNumpy
+from utils.backend import get_backend
 
 class PyDisplay:
     def __init__(self, width=1280, height=720):
@@ -10,18 +9,32 @@ class PyDisplay:
         self.width = width
         self.height = height
         self.clock = pygame.time.Clock()
+        self.surface = None  # reused for frames that don't match the window size
 
     def render(self, cuda_img):
-        img = cudaToNumpy(cuda_img)
-        cudaDeviceSynchronize()
+        """
+        Copy the frame into the window surface in place and flip it. Pacing is left
+        to the caller (LiveVideoAgent.display_loop), so render() never sleeps.
+        """
+        backend = get_backend()
+        img = backend.to_numpy(cuda_img)
+        backend.synchronize()
 
         # Convert to 8-bit RGB for Pygame
         if img.dtype != np.uint8:
             img = (img*255).astype(np.uint8)
 
         # UYVY or other formats may need conversion
-        # Using RGB for now
-        surf = pygame.surfarray.make_surface(np.flipud(np.rot90(img)))
-        self.screen.blit(surf, (0,0))
+        # Using RGB for now; surfarray is indexed (x, y), swapaxes is a view, not a copy
+        pixels = img[..., :3].swapaxes(0, 1)
+        if pixels.shape[:2] == self.screen.get_size():
+            pygame.surfarray.blit_array(self.screen, pixels)
+        else:
+            if self.surface is None or self.surface.get_size() != pixels.shape[:2]:
+                self.surface = pygame.Surface(pixels.shape[:2], depth=24)
+            pygame.surfarray.blit_array(self.surface, pixels)
+            self.screen.blit(self.surface, (0, 0))
+
         pygame.display.flip()
-        self.clock.tick(60)
+        pygame.event.pump()  # keep the window responsive
+        self.clock.tick()    # frame timing only (self.clock.get_fps()), no frame cap
@@ -1,14 +1,15 @@
 #video_agent.py
 import threading
 import time
-from jetson_utils import cudaMemcpy
-from utils.utils import cudaToNumpy
+from utils.backend import get_backend
+from utils.scene import SceneChangeDetector
+from scheduler import InferenceScheduler
+from utils.caption_writer import CaptionWriter
+from utils.metrics import Metrics
+from utils.recorder import VideoRecorder
 import numpy as np
 from PIL import Image
-import subprocess
 import queue
-import csv
-import os
 
 class LiveVideoAgent:
     def __init__(self, describer, video_source, video_output, 
@@ -16,152 +17,504 @@ class LiveVideoAgent:
                  prompt=None, max_tokens=16,
                  save_output = True, output_file = "prompt_history.csv",
                  save_video = False, video_path = "output.mp4",
-                 on_server = None):
+                 on_server = None, batch_size = 1,
+                 scheduler = None, source_id = None,
+                 scene_threshold = 0.0, caption_cache = None,
+                 backpressure = 'drop_oldest', caption_writer = None,
+                 output_format = None, flush_every = 5, flush_interval = 1.0,
+                 metrics = None, benchmark = None, show_metrics = False,
+                 stream = False, display_fps = 0,
+                 segment_duration = 0, subtitles = None, video_codec = 'libx264',
+                 sampler = None, history = None, caption_index = None):
         
         self.describer = describer
+        self.backend = get_backend()
         self.video_source = video_source
         self.video_output = video_output
         self.prompt_history = prompt_history or []
         self.skip_during_inference = skip_during_inference
-        self.prompt = prompt
+        # several prompts are all asked about every frame, sharing its image encoding (describe_prompts)
+        self.prompt = self._normalize_prompt(prompt)
         self.max_tokens = max_tokens
         self.save_output = save_output
         self.save_video = save_video
         self.on_server = on_server
-        self.catch_time = []
-        self.i=1
+        self.batch_size = max(1, batch_size)
+        self.pending_frames = []  # (timestamp, FrameBuffer) collected until a full batch is ready
+        # Persistent inference worker(s); shared when several sources use one describer,
+        # otherwise the agent runs its own single-worker scheduler
+        self.owns_scheduler = scheduler is None
+        self.scheduler = scheduler or InferenceScheduler(num_workers=1, policy=backpressure)
+        self.source_id = source_id
+        self.stream_id = source_id if source_id is not None else "default"
+        self.scheduler.register(self.stream_id, on_drop=self._drop_batch)
+        # utils.sampling policy choosing which frames are offered to the VLM (None: every frame)
+        self.sampler = sampler
+        # skip inference (and keep the previous caption) while the scene is unchanged
+        self.scene_detector = SceneChangeDetector(scene_threshold) if scene_threshold > 0 else None
+        self.caption_cache = caption_cache  # optional utils.caption_cache.CaptionCache in front of the describer
+        # Latency histograms / throughput (shared between agents when passed in)
+        self.owns_metrics = metrics is None
+        self.metrics = metrics or Metrics()
+        self.show_metrics = show_metrics
+        self.benchmark = benchmark  # stop after this many inferences and print the metrics
+        self.inferences = 0
+        # show partial captions on the display while tokens decode (single-frame inference only)
+        self.stream_requested = stream
+        self.stream = stream and self.batch_size == 1 and self.prompts is None
+        # callbacks(entry) for every caption, e.g. query_server.QueryServer subscribers
+        self.listeners = []
+        # optional utils.history.FrameHistory of recent frames and captions, for time-range queries and reruns
+        self.history = history
 
+        # Captions are written by a background CaptionWriter thread (shared when several sources write one file)
+        self.owns_caption_writer = caption_writer is None
+        self.caption_writer = caption_writer
         if self.save_output:
             self.prompt_history_file = output_file
+            if self.caption_writer is None:
+                # one CSV column per prompt with several prompts
+                answers = self.prompts or ["description"]
+                fieldnames = ["timeframe"] + answers
+                if self.source_id is not None:
+                    fieldnames = ["timeframe", "source"] + answers
+                self.caption_writer = CaptionWriter(output_file, format=output_format, fieldnames=fieldnames,
+                                                    flush_every=flush_every, flush_interval=flush_interval,
+                                                    index=caption_index)
+        # Rendered frames are encoded by a background VideoRecorder thread with their capture timestamps;
+        # with subtitles the captions go to an SRT/WebVTT track instead of being burned in
+        self.recorder = None
         if self.save_video:
             self.video_path = video_path
-            self.fps = 15 # Adjust if needed
-            self.ffmpeg_process = None
+            self.subtitles = subtitles
+            self.recorder = VideoRecorder(video_path, fps=display_fps or 30, codec=video_codec,
+                                          segment_duration=segment_duration, subtitles=subtitles)
+        # display renders whenever a new frame or caption arrives, at most display_fps times per second (0 follows the camera)
+        self.display_fps = display_fps
+        self.display_event = threading.Event()
 
+        # running: the loops should keep going (cleared by stop(), or by the worker when a benchmark is done);
+        # started: stop() still has to tear down, which happens once, on the thread that calls it
         self.running = False
-        self.inference_thread = None
+        self.started = False
+        self.stop_lock = threading.Lock()
 
-        self.latest_cuda_frame = None
+        self.latest_frame = None   # FrameBuffer of the newest frame, referenced until replaced
+        self.render_frame = None   # preallocated display surface the caption is drawn on
         self.last_caption = "Loading..."
+        self.rendered_generation = None  # (frame generation, caption) last drawn by display_loop
+        self.recorded_generation = None  # frame generation last written to a subtitled recording
         self.frame_queue = queue.Queue(maxsize=2)
         self.frame_lock = threading.Lock()
 
         self.display_thread = None
     
-    def on_frame(self, frame):
-        if frame is None:
+    @staticmethod
+    def _normalize_prompt(prompt):
+        if isinstance(prompt, (list, tuple)):
+            return list(prompt) if len(prompt) > 1 else prompt[0]
+        return prompt
+
+    @property
+    def prompts(self):
+        """The prompt list with several prompts, else None."""
+        prompt = self.prompt
+        return prompt if isinstance(prompt, list) else None
+
+    def set_prompt(self, prompt):
+        """
+        Change the prompt (or prompts) from the next inference on. CSV columns are
+        fixed when the file is opened, so with CSV output the answer columns can't change.
+        """
+        prompt = self._normalize_prompt(prompt)
+        if not prompt:
+            raise ValueError("prompt must not be empty")
+        columns = prompt if isinstance(prompt, list) else ["description"]
+        if self.save_output and self.caption_writer.format == 'csv':
+            missing = [column for column in columns if column not in self.caption_writer.fieldnames]
+            if missing:
+                raise ValueError(f"CSV output has fixed columns, can't add {missing}")
+        self.prompt = prompt
+        self.stream = self.stream_requested and self.batch_size == 1 and not isinstance(prompt, list)
+        print(f"[LiveVideoAgent] Prompt set to {prompt!r}")
+
+    def add_listener(self, callback):
+        """Call callback(entry) with every caption entry (from the inference thread)."""
+        self.listeners.append(callback)
+
+    def frame_at(self, timestamp=None):
+        """
+        (timestamp, numpy copy) of the latest frame, or of the frame closest to
+        timestamp among the latest one and the history's. (None, None) before the first frame.
+        """
+        with self.frame_lock:
+            buffer = self.latest_frame.retain() if self.latest_frame is not None else None
+        kept_time, kept = (None, None)
+        if self.history is not None and timestamp is not None:
+            kept_time, kept = self.history.frame_at(timestamp)
+        if buffer is not None:
+            try:
+                if kept is None or abs(buffer.timestamp - timestamp) <= abs(kept_time - timestamp):
+                    return buffer.timestamp, np.array(self.backend.to_numpy(buffer.image))
+            finally:
+                buffer.release()
+        return kept_time, kept
+
+    def rerun(self, prompt, start=None, end=None, frames=None, max_tokens=None):
+        """
+        Caption frames of the history again with another prompt (or prompts): the
+        frames captured between start and end, or the given (timestamp, frame) pairs,
+        in batches of batch_size. Returns one entry per frame, like the caption entries.
+        """
+        if frames is None:
+            if self.history is None:
+                raise ValueError("rerun needs a frame history")
+            frames = self.history.frames(start, end)
+        prompt = self._normalize_prompt(prompt)
+        max_tokens = max_tokens or self.max_tokens
+        entries = []
+        for i in range(0, len(frames), self.batch_size):
+            batch = frames[i:i + self.batch_size]
+            images = [frame for _, frame in batch]
+            if isinstance(prompt, list):
+                results = self.describer.describe_prompts(images, prompt, max_tokens)
+            else:
+                results = self.describer.describe_frames(images, prompt, max_tokens)
+            for (timestamp, _), result in zip(batch, results):
+                entry = {"timeframe": timestamp}
+                if isinstance(prompt, list):
+                    entry.update(zip(prompt, result))
+                else:
+                    entry.update(description=result, prompt=prompt)
+                if self.source_id is not None:
+                    entry["source"] = self.source_id
+                entries.append(entry)
+        return entries
+
+    def on_frame(self, buffer):
+        """
+        Capture callback, gets a utils.frame_pool.FrameBuffer from the VideoSource.
+        References are taken for the display (latest frame) and for every frame
+        waiting in a batch; they are released when replaced, inferred or dropped.
+        """
+        if buffer is None:
             return
 
         try:
+            self.metrics.observe('capture', getattr(self.video_source, 'capture_time', None))
+            released = []
+            sampled = self._sample(buffer)  # capture thread only, so outside frame_lock
+
             with self.frame_lock:
-                self.latest_cuda_frame = frame
+                if self.latest_frame is not None:
+                    released.append(self.latest_frame)
+                self.latest_frame = buffer.retain()
+
+                batch = None
+                if sampled:
+                    # keep only the most recent batch_size frames while inference is running
+                    self.pending_frames.append((time.time(), buffer.retain()))
+                    trimmed = [pending for _, pending in self.pending_frames[:-self.batch_size]]
+                    self.pending_frames = self.pending_frames[-self.batch_size:]
+                    if trimmed and self.scene_detector is not None:
+                        self.scene_detector.reset()  # a trimmed frame may have been the scene change
+                    released.extend(trimmed)
+
+                    if len(self.pending_frames) == self.batch_size:
+                        batch, self.pending_frames = self.pending_frames, []
 
-            if self.inference_thread is None or not self.inference_thread.is_alive():
-                self.inference_thread = threading.Thread(
-                    target=self._run_inference,
-                    args=(frame,),
-                    daemon=True
-                )
-                self.inference_thread.start()
+            for old in released:
+                old.release()
+            self.display_event.set()
+
+            if self.history is not None and self.history.due(buffer.timestamp):
+                self.history.add_frame(self.backend.to_numpy(buffer.image), buffer.timestamp)
+
+            # the scheduler's latest-frame slot applies the backpressure policy
+            # (batches it discards come back through _release_batch)
+            if batch is not None and not self.running:
+                self._release_batch(batch)  # benchmark finished, waiting for stop()
+            elif batch is not None:
+                self.scheduler.submit(self.stream_id, self._run_inference, batch)
 
         except Exception as e:
             print(f"[LiveVideoAgent] ERROR: {e}")
 
-    def _run_inference(self, cuda_frame):
+    def _sample(self, buffer):
+        """Sampling policy, then scene gating: whether this frame is offered to the VLM."""
+        if self.sampler is None and self.scene_detector is None:
+            return True
+        image = self.backend.to_numpy(buffer.image)
+        if self.sampler is not None:
+            self.metrics.increment('frames_considered')
+            if not self.sampler.select(image, buffer.timestamp, getattr(self.video_source, 'keyframe', None)):
+                return False
+            self.metrics.increment('frames_selected')
+        return self.scene_detector is None or self.scene_detector.changed(image)
+
+    def _release_batch(self, batch):
+        for _, buffer in batch:
+            buffer.release()
+
+    def _drop_batch(self, batch):
+        """
+        Scheduler callback for a batch discarded by the backpressure policy. Scene gating
+        took its frames as the new reference, so the detector is reset: otherwise the rest
+        of a scene whose first frame was dropped would count as unchanged and never be captioned.
+        """
+        if self.scene_detector is not None:
+            self.scene_detector.reset()
+        self._release_batch(batch)
+
+    def _run_inference(self, batch):
         try:
-            np_frame = cudaToNumpy(cuda_frame)
+            timestamps = [timestamp for timestamp, _ in batch]
+            np_frames = [self.backend.to_numpy(buffer.image) for _, buffer in batch]
             #np_frame = Image.fromarray(np_frame,'RGB')
+            prompt = self.prompt  # set_prompt() may change it meanwhile
             cur_time = time.time()
-            description = self.describer.describe_frame(np_frame,self.prompt,self.max_tokens)
-            print(f"[{self.i}/100]","Inference time: {:.2f}s".format(time.time() - cur_time))
-            self.catch_time.append(time.time() - cur_time)
-            self.i += 1
-            if len(self.catch_time)==100:
-                print("[PROCESS STOPPING] Average inference time: {:.2f}s".format(np.mean(self.catch_time)))
-                self.stop()
-            self.last_caption = description
-            self.prompt_history.append({"timeframe": time.time(), "description": description})
-
-            # Save to CSV every 5 new entries
-            if len(self.prompt_history) % 5 == 0:
-                if (self.save_output):
-                    file_exists = os.path.isfile(self.prompt_history_file)
-                    with open(self.prompt_history_file, mode='a', newline='', encoding='utf-8') as f:
-                        writer = csv.DictWriter(f, fieldnames=["timeframe", "description"])
-                        if not file_exists:
-                            writer.writeheader()
-                        for entry in self.prompt_history[-5:]:  
-                            writer.writerow(entry)
-                self.prompt_history = [] # Clear written history
+            descriptions, timings = self._describe(np_frames, min(timestamps), prompt)
+            inference_time = time.time() - cur_time
+            queue_wait = self.scheduler.last_wait[self.stream_id]
+            self.inferences += 1
+
+            progress = f"{self.inferences}/{self.benchmark}" if self.benchmark else f"{self.inferences}"
+            print(f"[{progress}]","Inference time: {:.2f}s".format(inference_time), f"({len(np_frames)} frames)",
+                  "queue wait: {:.1f}ms".format(queue_wait * 1000))
+
+            self.metrics.observe('queue_wait', queue_wait)
+            self.metrics.observe_all(timings)
+            self.metrics.observe('total', time.time() - min(timestamps))  # oldest frame arrival -> caption
+            self.metrics.record_captions(len(descriptions))
+
+            self.set_caption(self.caption_text(descriptions[-1], prompt))
+            if self.recorder is not None:
+                self.recorder.add_caption(self.caption_text(descriptions[-1], prompt), timestamps[-1])
+            for timestamp, description in zip(timestamps, descriptions):
+                entry = {"timeframe": timestamp}
+                if isinstance(prompt, list):
+                    entry.update(zip(prompt, description))
+                else:
+                    entry["description"] = description
+                    entry["prompt"] = prompt  # JSONL only, the prompt can change at runtime
+                if self.source_id is not None:
+                    entry["source"] = self.source_id
+                # latency fields only appear in JSONL output
+                entry["inference_time"] = inference_time
+                entry["queue_wait"] = queue_wait
+                entry["batch_size"] = len(np_frames)
+                self.prompt_history.append(entry)
+                if self.history is not None:
+                    self.history.add_caption(entry)
+                if self.save_output:
+                    self.caption_writer.write(entry)
+                for listener in self.listeners:
+                    try:
+                        listener(entry)
+                    except Exception as e:
+                        print(f"[LiveVideoAgent] Listener error: {e}")
+            del self.prompt_history[:-5]  # only the most recent captions are kept in memory
+
+            if self.benchmark and self.inferences >= self.benchmark and self.running:
+                # only signal: the owner's stop() tears down (and joins this worker) from its own thread
+                print(f"[Benchmark] Finished {self.inferences} inferences")
+                self.running = False
+                self.display_event.set()
 
         except Exception as e:
             print(f"[Error in inference]: {e}")
             import traceback
             traceback.print_exc()
+        finally:
+            self._release_batch(batch)
+
+    def caption_text(self, description, prompt=None):
+        """Displayed caption: the description, or 'prompt: answer' pairs with several prompts."""
+        prompt = self.prompt if prompt is None else prompt
+        if not isinstance(prompt, list):
+            return description
+        return " | ".join(f"{question} {answer}" for question, answer in zip(prompt, description))
+
+    def set_caption(self, caption):
+        """Update the caption shown on the display and wake up the render loop."""
+        self.last_caption = caption
+        self.display_event.set()
+
+    def _stream_callback(self, captured):
+        """
+        on_token callback for streaming mode: shows the partial caption right away
+        and records the first token's latency since the frame was captured.
+        """
+        first = [True]
+
+        def on_token(text):
+            if first[0]:
+                first[0] = False
+                self.metrics.observe('first_token', time.time() - captured)
+            self.set_caption(text)
+
+        return on_token
+
+    def _describe(self, np_frames, captured=None, prompt=None):
+        """
+        Caption the frames, answering from the caption cache where possible
+        and batching the remaining frames into one describer call.
+        Returns the captions and the describer's stage timings ({} if it wasn't called).
+        """
+        prompt = self.prompt if prompt is None else prompt
+        descriptions = [None] * len(np_frames)
+        keys = [None] * len(np_frames)
+
+        if self.caption_cache is not None:
+            cache_prompt = "\n".join(prompt) if isinstance(prompt, list) else prompt
+            for i, np_frame in enumerate(np_frames):
+                keys[i] = self.caption_cache.key(np_frame, cache_prompt, self.max_tokens, self.describer.model_id)
+                descriptions[i] = self.caption_cache.get(keys[i])
+
+        misses = [i for i, description in enumerate(descriptions) if description is None]
+        if misses and isinstance(prompt, list):
+            # one list of answers per frame
+            results = self.describer.describe_prompts([np_frames[i] for i in misses], prompt, self.max_tokens)
+        elif len(misses) == 1 and self.stream:
+            results = [self.describer.describe_frame(np_frames[misses[0]],prompt,self.max_tokens,
+                                                     on_token=self._stream_callback(captured or time.time()))]
+        elif len(misses) == 1:
+            results = [self.describer.describe_frame(np_frames[misses[0]],prompt,self.max_tokens)]
+        elif misses:
+            results = self.describer.describe_frames([np_frames[i] for i in misses],prompt,self.max_tokens)
+        else:
+            results = []
+
+        for i, description in zip(misses, results):
+            descriptions[i] = description
+            if self.caption_cache is not None:
+                self.caption_cache.put(keys[i], description)
+
+        timings = getattr(self.describer, 'last_timings', {}) if misses else {}
+        return descriptions, timings
 
     def display_loop(self):
+        """
+        Render the latest frame with its caption every time a new frame or caption
+        arrives, paced to display_fps when it is set. Frames that haven't changed
+        since the last render are not drawn again.
+        """
         print("[Display] started")
+        interval = 1.0 / self.display_fps if self.display_fps else 0.0
+        next_render = time.perf_counter()
 
         while self.running:
+            if not self.display_event.wait(timeout=1.0):
+                if self.latest_frame is None:
+                    print("[Display] Cannot find valid frame to render")
+                continue
+            if not self.running:
+                break
+
+            if interval:
+                delay = next_render - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)  # events arriving meanwhile are folded into this render
+                next_render = max(next_render + interval, time.perf_counter())
+            self.display_event.clear()
+
             frame_to_render = None
 
             with self.frame_lock:
-                if self.latest_cuda_frame is not None:
-                    try:
-                        frame_to_render = cudaMemcpy(self.latest_cuda_frame)
-                        caption = self.last_caption or "Loading..."
-                    except Exception as e:
-                        print(f"[Display] Failed to copy frame: {e}")
-                        frame_to_render = None
+                buffer = self.latest_frame.retain() if self.latest_frame is not None else None
+                caption = self.last_caption or "Loading..."
+
+            timestamp = generation = None
+            if buffer is not None:
+                try:
+                    if (buffer.generation, caption) == self.rendered_generation and not self.show_metrics:
+                        continue
+                    self.rendered_generation = (buffer.generation, caption)
+                    timestamp, generation = buffer.timestamp, buffer.generation
+
+                    # the caption is drawn on a private surface, never on the shared frame buffer
+                    image = buffer.image
+                    if self.render_frame is None or tuple(self.render_frame.shape) != tuple(image.shape):
+                        self.render_frame = self.video_source.pool.allocate(image)
+                    frame_to_render = self.video_source.pool.copy_into(self.render_frame, image)
+                except Exception as e:
+                    print(f"[Display] Failed to copy frame: {e}")
+                    frame_to_render = None
+                finally:
+                    buffer.release()
 
             if frame_to_render is not None:
                 try:
+                    if self.recorder is not None and self.subtitles and generation != self.recorded_generation:
+                        # clean frame, before the overlay; a caption-only update doesn't change it
+                        self.recorder.write(self.backend.to_numpy(frame_to_render), timestamp)
+                        self.recorded_generation = generation
+
                     annotated = self.video_output.overlay_text(frame_to_render, caption, position=(10, 30))
+                    if self.show_metrics:
+                        annotated = self.video_output.overlay_text(annotated, self.metrics.overlay_text(),
+                                                                   position=(10, frame_to_render.shape[0] - 40))
                     self.video_output.render(annotated)
+                    self.metrics.increment('frames_rendered')
 
-                    if self.save_video and self.ffmpeg_process:
-                        try:
-                            np_frame = cudaToNumpy(annotated)
-                            self.ffmpeg_process.stdin.write(np_frame.astype(np.uint8).tobytes())
-                        except Exception as e:
-                            print(f"[FFmpeg] Error writing frame {e}")
+                    if self.recorder is not None and not self.subtitles:
+                        self.recorder.write(self.backend.to_numpy(annotated), timestamp)
                         
                 except Exception as e:
                     print(f"[Display] Render error: {e}")
                     import traceback
                     traceback.print_exc()
-            else:
-                print("[Display] Cannot find valid frame to render")
-                time.sleep(1)
-
-            time.sleep(0.1)
 
     def start(self):
         """Start live video processing."""
         print("[LiveVideoAgent] Starting...")
         self.running = True
-        if self.save_video:
-            self.ffmpeg_process = subprocess.Popen([
-                'ffmpeg', '-y', '-f', 'rawvideo',
-                '-vcodec', 'rawvideo',
-                '-pix_fmt', 'rgb24',
-                '-s', f'{self.video_output.width}x{self.video_output.height}',
-                '-r', str(self.fps),
-                '-i', '-',
-                '-an',
-                '-vcodec', 'libx264',
-                '-pix_fmt', 'yuv420p',
-                self.video_path
-            ], stdin=subprocess.PIPE)
+        self.started = True
+        if self.recorder is not None:
+            self.recorder.start()
+        if self.owns_scheduler:
+            self.scheduler.start()
+        if self.save_output and self.owns_caption_writer:
+            self.caption_writer.start()
         self.video_source.start(self.on_frame)
         
     def stop(self):
-        """Stop all processes."""
-        print("[LiveVideoAgent] Stopping...")
-        self.running = False
-        self.video_source.stop()
-        if self.save_video and self.ffmpeg_process:
-            self.ffmpeg_process.stdin.close()
-            self.ffmpeg_process.wait()
-        if self.display_thread and self.display_thread.is_alive():
-            self.display_thread.join(timeout=1)
+        """
+        Stop all processes. Idempotent, and blocks until the teardown (final caption
+        flush, recording finalized) is done, also when another thread is running it.
+        """
+        with self.stop_lock:
+            if not self.started:
+                return
+            self.started = False
+            print("[LiveVideoAgent] Stopping...")
+            self.running = False
+            self.display_event.set()  # wake display_loop so it sees running == False
+            if self.owns_metrics:
+                print(self.metrics.report())
+            if self.sampler is not None:
+                print(f"[LiveVideoAgent] Sampling: {self.sampler}")
+            if self.scene_detector is not None:
+                print(f"[LiveVideoAgent] Scene gating: {self.scene_detector}")
+            if self.caption_cache is not None:
+                print(f"[LiveVideoAgent] Caption cache: {self.caption_cache}")
+                self.caption_cache.save()
+            if self.history is not None:
+                print(f"[LiveVideoAgent] History: {self.history}")
+            if getattr(self.describer, 'embedding_cache', None) is not None:
+                print(f"[LiveVideoAgent] Embedding cache: {self.describer.embedding_cache}")
+            if self.owns_scheduler:
+                self.scheduler.stop()  # before the source, so a capture thread blocked in submit() is released
+            self.video_source.stop()
+            if self.save_output and self.owns_caption_writer:
+                self.caption_writer.close()  # final flush of any unwritten captions
+            if self.display_thread and self.display_thread.is_alive():
+                self.display_thread.join(timeout=1)
+            if self.recorder is not None:
+                self.recorder.close()  # encodes the queued frames and finalizes the file
+            with self.frame_lock:
+                pending, self.pending_frames = self.pending_frames, []
+                latest, self.latest_frame = self.latest_frame, None
+            self._release_batch(pending)
+            if latest is not None:
+                latest.release()
@@ -1,9 +1,34 @@
 # video_query.py
+import os
 import argparse
 import time
 from camera import VideoSource
 from video_agent import LiveVideoAgent
 from display import VideoOutput
+from scheduler import InferenceScheduler
+from utils.caption_cache import CaptionCache
+from utils.caption_writer import CaptionWriter
+from utils.metrics import Metrics, MetricsServer
+from utils.backend import BACKENDS, set_backend
+from utils.sampling import SAMPLING_POLICIES, make_sampler
+from offline import run_offline, add_sampling_args, sampling_kwargs, add_decoding_args, decoding_kwargs
+from offline import timeline_fields, single_prompt, add_index_args, open_caption_index
+from utils.recorder import SUBTITLE_FORMATS
+from query_server import QueryServer
+from utils.history import FrameHistory
+
+
+def make_history(args, index):
+    """FrameHistory for source index, None when the history is off."""
+    history_mb = args.history_mb if args.history_mb is not None else (64 if args.on_server else 0)
+    if history_mb <= 0:
+        return None
+    spill_path = None
+    if args.history_spill:
+        os.makedirs(args.history_spill, exist_ok=True)
+        spill_path = os.path.join(args.history_spill, f"history_{index}.bin")
+    return FrameHistory(max_bytes=int(history_mb * 2**20), size=args.history_size, interval=args.history_interval,
+                        spill_path=spill_path, spill_bytes=int(args.history_spill_mb * 2**20))
 
 
 def main():
@@ -13,8 +38,9 @@ def main():
     parser.add_argument(
         "--source",
         type=str,
-        default="/dev/video0",
-        help="Video source (e.g. /dev/video0, rtsp://, file path)"
+        nargs="+",
+        default=["/dev/video0"],
+        help="Video source(s) (e.g. /dev/video0, rtsp://, file path). Several sources share one model"
     )
     parser.add_argument(
         "--frame_rate",
@@ -55,6 +81,25 @@ def main():
         default="prompt_history.csv",
         help="Save VLM output as a csv"
     )
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        default=None,
+        choices=["csv", "jsonl"],
+        help="Caption file format; jsonl adds latency fields (default: from the --output_file extension)"
+    )
+    parser.add_argument(
+        "--flush_every",
+        type=int,
+        default=5,
+        help="Write captions to the output file once this many are waiting"
+    )
+    parser.add_argument(
+        "--flush_interval",
+        type=float,
+        default=1.0,
+        help="Write waiting captions to the output file at least every N seconds"
+    )
     parser.add_argument(
         "--save_video", 
         action="store_true",
@@ -67,10 +112,81 @@ def main():
         help="Path to save video with VLM output"
     )
     parser.add_argument(
-        "--on_server", #TBC
+        "--segment_duration",
+        type=float,
+        default=0,
+        help="Split the saved video into files of this many seconds (video_000.mp4, ...). 0 records one file"
+    )
+    parser.add_argument(
+        "--subtitles",
+        type=str,
+        default=None,
+        choices=SUBTITLE_FORMATS,
+        help="Write captions to an SRT/WebVTT file next to the saved video instead of burning them in"
+    )
+    parser.add_argument(
+        "--video_codec",
+        type=str,
+        default="libx264",
+        help="Encoder for --save_video, e.g. libx264 or a hardware encoder (h264_nvenc, h264_v4l2m2m)"
+    )
+    parser.add_argument(
+        "--on_server",
+        type=str,
+        default=None,
+        help="host:port (or port) of the interactive query server: stream captions, change the prompt and "
+             "ask questions about the live video over HTTP (see query_server.py). Off by default"
+    )
+    parser.add_argument(
+        "--query_rate",
+        type=float,
+        default=2.0,
+        help="Requests per second each query server client may make (bursts of up to --query_burst)"
+    )
+    parser.add_argument(
+        "--query_burst",
+        type=int,
+        default=5,
+        help="Requests a query server client may make at once"
+    )
+    parser.add_argument(
+        "--query_trusted_proxy",
         type=str,
-        default="rtc",
-        help="Stream live video display and caption rendering on server"
+        nargs="+",
+        default=[],
+        help="Addresses of reverse proxies whose X-Client-Id header names the client for the query rate limit "
+             "(by default every client address is limited on its own)"
+    )
+    parser.add_argument(
+        "--history_mb",
+        type=float,
+        default=None,
+        help="RAM per source for the rolling history of downscaled frames and captions, used for time-range "
+             "queries and reruns (default: 64 with --on_server, else no history)"
+    )
+    parser.add_argument(
+        "--history_size",
+        type=int,
+        default=448,
+        help="Longest side (pixels) of the frames kept in the history"
+    )
+    parser.add_argument(
+        "--history_interval",
+        type=float,
+        default=0.5,
+        help="Seconds between the frames kept in the history"
+    )
+    parser.add_argument(
+        "--history_spill",
+        type=str,
+        default=None,
+        help="Directory for memory-mapped files that older history frames spill to once the RAM is full"
+    )
+    parser.add_argument(
+        "--history_spill_mb",
+        type=float,
+        default=1024,
+        help="Disk per source for --history_spill"
     )
     parser.add_argument(
         "--model_id",
@@ -81,8 +197,10 @@ def main():
     parser.add_argument(
         "--prompt",
         type=str,
-        default="Describe the image precisely.",
-        help="Define prompt to pass to the VLM"
+        nargs="+",
+        default=["Describe the image precisely."],
+        help="Define prompt to pass to the VLM. Several prompts are all asked about every frame, "
+             "sharing one image encoding, and get one output column each"
     )
     parser.add_argument(
         "--max_tokens",
@@ -90,32 +208,190 @@ def main():
         default=16,
         help="Define the maximum output token of the VLM"
     )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help="Number of frames collected into one batch before running the VLM"
+    )
+    parser.add_argument(
+        "--scene_threshold",
+        type=float,
+        default=0.0,
+        help="Skip VLM inference while the mean frame difference stays below this value (0-1, e.g. 0.02). 0 disables"
+    )
+    parser.add_argument(
+        "--sampling",
+        type=str,
+        default="all",
+        choices=SAMPLING_POLICIES,
+        help="Which frames are captioned: 'all' (whenever the model is free), 'interval' (every --interval s), "
+             "'motion' (above --motion_threshold), 'keyframe' (codec keyframes) or 'adaptive' (more often as scene entropy rises)"
+    )
+    parser.add_argument(
+        "--motion_threshold",
+        type=float,
+        default=0.02,
+        help="Mean frame-to-frame difference (0-1) that triggers a caption with --sampling motion"
+    )
+    parser.add_argument(
+        "--min_interval",
+        type=float,
+        default=0.25,
+        help="Shortest time between sampled frames with --sampling motion / adaptive (seconds)"
+    )
+    parser.add_argument(
+        "--max_interval",
+        type=float,
+        default=4.0,
+        help="Longest time between sampled frames with --sampling adaptive (seconds)"
+    )
+    parser.add_argument(
+        "--caption_cache",
+        type=int,
+        default=0,
+        help="Cache up to this many captions keyed by perceptual frame hash and prompt. 0 disables"
+    )
+    parser.add_argument(
+        "--caption_cache_ttl",
+        type=float,
+        default=None,
+        help="Seconds before a cached caption expires (default: never)"
+    )
+    parser.add_argument(
+        "--caption_cache_file",
+        type=str,
+        default=None,
+        help="JSON file to load the caption cache from and save it to on exit"
+    )
+    parser.add_argument(
+        "--backpressure",
+        type=str,
+        default="drop_oldest",
+        choices=["drop_oldest", "drop_newest", "block"],
+        help="What to do with a new frame while the previous one still waits for inference"
+    )
+    parser.add_argument(
+        "--inference_workers",
+        type=int,
+        default=1,
+        help="Number of persistent inference worker threads serving the sources"
+    )
+    parser.add_argument(
+        "--benchmark",
+        type=int,
+        default=None,
+        help="Stop after N inferences per source and print the latency report"
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        default=0,
+        help="Serve Prometheus-text metrics on http://127.0.0.1:<port>/metrics. 0 disables"
+    )
+    parser.add_argument(
+        "--show_metrics",
+        action="store_true",
+        help="Draw throughput and latency percentiles on the video display"
+    )
+    parser.add_argument(
+        "--no_fast_preprocess",
+        dest="fast_preprocess",
+        action="store_false",
+        help="Preprocess frames with the HF processor (PIL) instead of the on-device tensor path"
+    )
+    parser.add_argument(
+        "--num_buffers",
+        type=int,
+        default=0,
+        help="Preallocated frame buffers per source, shared by capture, inference and display (default: 3 * batch_size + 4)"
+    )
+    parser.add_argument(
+        "--display_fps",
+        type=float,
+        default=0,
+        help="Cap the display at this frame rate. 0 renders every new frame (camera rate)"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Update the displayed caption token by token while it is generated (batch_size 1 only)"
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="auto",
+        choices=BACKENDS,
+        help="Frame backend: 'jetson' (jetson_utils/CUDA), 'cpu' (OpenCV/PyAV + NumPy) or 'auto' (jetson if available)"
+    )
     parser.add_argument(
         "--return_tensors",
         type=str,
         default='cuda',
         choices=['cuda', 'np', 'pt'],
-        help="Tensors output format: 'cuda' (GPU), 'np' (NumPy), 'pt' (PyTorch). Defaults to 'cuda'.",
+        help="Tensors output format: 'cuda' (backend native: GPU cudaImage, or NumPy on the cpu backend), 'np' (NumPy), 'pt' (PyTorch). Defaults to 'cuda'.",
     )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Caption video files as fast as the model allows (decode ahead, batch every sampled frame) instead of live"
+    )
+    add_sampling_args(parser)
+    add_decoding_args(parser)
+    add_index_args(parser)
 
 
     args = parser.parse_args()
     parser.print_help()
 
+    prompt = single_prompt(args.prompt)
+    if args.caption_index and not args.save_output and not args.offline:
+        print("[INFO] --caption_index enabled but --save_output not detected. Automatically enabling --save_output, the index is built as captions are written")
+        args.save_output = True
+    caption_index = open_caption_index(args)
+
     # -----------------------------
     # Initialize components
     # -----------------------------
+    backend = set_backend(args.backend)
+    print(f"[INFO] Using {backend.name} frame backend")
     print(f"[INFO] Loading model and initializing video source: {args.source}")
     if "gemma" in args.model_id:
         from model import Gemma3ImageDescriber
-        describer = Gemma3ImageDescriber(model_id = args.model_id)
+        describer = Gemma3ImageDescriber(model_id = args.model_id, fast_preprocess = args.fast_preprocess,
+                                         **decoding_kwargs(args))
     elif "Qwen" in args.model_id:
         from model import QwenImageDescriber
-        describer = QwenImageDescriber(model_id=args.model_id)
+        describer = QwenImageDescriber(model_id=args.model_id, fast_preprocess=args.fast_preprocess,
+                                       **decoding_kwargs(args))
     else:
         print("[Warning] Model not available yet. Stay tuned! For now, please use vision-language-models from the Gemma family")
         return
-    video_source = VideoSource(args.source, video_input_framerate=args.frame_rate, return_tensors=args.return_tensors)
+
+    if args.offline:
+        # Files are captioned back to back, every caption keyed by its media time
+        caption_writer = CaptionWriter(args.output_file, format=args.output_format, fieldnames=timeline_fields(prompt),
+                                       flush_every=args.flush_every, flush_interval=args.flush_interval,
+                                       index=caption_index)
+        caption_writer.start()
+        metrics = Metrics()
+        try:
+            for source in args.source:
+                run_offline(describer, source, prompt, args.max_tokens, args.batch_size,
+                            caption_writer=caption_writer, metrics=metrics, **sampling_kwargs(args))
+        except KeyboardInterrupt:
+            print("\n[INFO] Interrupted by user")
+        finally:
+            caption_writer.close()
+            print(metrics.report())
+            if caption_index is not None:
+                caption_index.close()
+        return
+    video_sources = [
+        VideoSource(source, video_input_framerate=args.frame_rate, return_tensors=args.return_tensors,
+                    num_buffers=args.num_buffers or 3 * args.batch_size + 4, keyframes=args.sampling == 'keyframe')
+        for source in args.source
+    ]
 
     if args.save_video and not args.on_video:
         print("[INFO] --save_video enabled but --on_video not detected. Automatically enabling --on_video for frame fetching and rendering")
@@ -125,31 +401,101 @@ def main():
     else:
         video_output = VideoOutput(width=args.width, height=args.height)
 
-    agent = LiveVideoAgent(describer, 
-                           video_source, video_output, 
-                           prompt=args.prompt, max_tokens=args.max_tokens,
+    # With several sources, one scheduler shares the describer between the streams
+    # and every caption is tagged with the source it came from
+    scheduler = None
+    if len(video_sources) > 1 or args.inference_workers > 1:
+        scheduler = InferenceScheduler(num_workers=args.inference_workers, policy=args.backpressure).start()
+
+    caption_cache = None
+    if args.caption_cache > 0:
+        caption_cache = CaptionCache(max_size=args.caption_cache, ttl=args.caption_cache_ttl,
+                                     path=args.caption_cache_file)
+
+    # All sources append to the same output file through one writer thread
+    caption_writer = None
+    if args.save_output and len(video_sources) > 1:
+        caption_writer = CaptionWriter(args.output_file, format=args.output_format,
+                                       fieldnames=["timeframe", "source"] + (prompt if isinstance(prompt, list) else ["description"]),
+                                       flush_every=args.flush_every, flush_interval=args.flush_interval,
+                                       index=caption_index)
+        caption_writer.start()
+
+    metrics = Metrics()
+    metrics_server = MetricsServer(metrics, port=args.metrics_port).start() if args.metrics_port else None
+
+    agents = []
+    for i, (source, video_source) in enumerate(zip(args.source, video_sources)):
+        agents.append(LiveVideoAgent(describer, 
+                           video_source, video_output if i == 0 else None, 
+                           prompt=prompt, max_tokens=args.max_tokens,
                            save_output = args.save_output, output_file=args.output_file,
-                           save_video = args.save_video, video_path = args.video_path,
-                           on_server = args.on_server
-                           )
-    agent.start()
+                           save_video = args.save_video and i == 0, video_path = args.video_path,
+                           segment_duration = args.segment_duration, subtitles = args.subtitles,
+                           video_codec = args.video_codec,
+                           on_server = args.on_server,
+                           batch_size = args.batch_size,
+                           scheduler = scheduler,
+                           source_id = source if len(video_sources) > 1 else None,
+                           scene_threshold = args.scene_threshold,
+                           caption_cache = caption_cache,
+                           backpressure = args.backpressure,
+                           caption_writer = caption_writer, output_format = args.output_format,
+                           flush_every = args.flush_every, flush_interval = args.flush_interval,
+                           metrics = metrics, benchmark = args.benchmark, show_metrics = args.show_metrics,
+                           stream = args.stream, display_fps = args.display_fps,
+                           sampler = make_sampler(args.sampling, interval=args.interval or 1.0,
+                                                  motion_threshold=args.motion_threshold,
+                                                  min_interval=args.min_interval, max_interval=args.max_interval)
+                                     if args.sampling != 'all' else None,
+                           history = make_history(args, i),
+                           caption_index = caption_index
+                           ))
+
+    query_server = None
+    if args.on_server:
+        host, _, port = args.on_server.rpartition(':')
+        query_server = QueryServer(agents, host=host or "127.0.0.1", port=int(port),
+                                   rate=args.query_rate, burst=args.query_burst,
+                                   trusted_proxies=args.query_trusted_proxy)
+
+    for agent in agents:
+        agent.start()
+    if query_server is not None:
+        query_server.start()
 
     # -----------------------------
     # Run display or background mode
     # -----------------------------
     try:
         if args.on_video and not args.headless:
+            # Only the first source is rendered
             print("[INFO] Starting video display loop...")
-            while True:
-                agent.display_loop()
+            while agents[0].running:
+                agents[0].display_loop()
         else:
             print("[INFO] Running without display (inference only mode)...")
-            while True:
+            while any(agent.running for agent in agents):
                 time.sleep(0.1)
     except KeyboardInterrupt:
         print("\n[INFO] Interrupted by user, stopping agent...")
-        agent.stop()
 
+    if query_server is not None:
+        query_server.stop()
+    if scheduler is not None:
+        scheduler.stop()
+    for agent in agents:
+        agent.stop()
+        if agent.history is not None:
+            agent.history.close()
+    if caption_writer is not None:
+        caption_writer.close()
+    if caption_index is not None:
+        print(f"[INFO] Caption index: {caption_index}")
+        caption_index.close()
+    if metrics_server is not None:
+        metrics_server.stop()
+    print(metrics.report())
 
 if __name__ == "__main__":
     main()